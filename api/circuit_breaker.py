@@ -0,0 +1,177 @@
+"""
+平台熔断器
+按平台统计最近任务的成功率和耗时，某个平台连续失败（限流、页面结构变化等）时熔断，
+新任务直接失败而不再走完整的下载回退流程，冷却后放行少量试探任务，成功后恢复
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 针对单个视频的错误（地区限制、内容不存在等）和本地错误不代表平台异常，不计入熔断统计
+IGNORED_CATEGORIES = {
+    'geo_blocked', 'login_required', 'private', 'copyright', 'not_found', 'unsupported',
+    'over_budget', 'postprocess', 'circuit_open',
+}
+
+
+class CircuitOpenError(Exception):
+    """平台处于熔断状态，任务直接失败"""
+
+
+class PlatformCircuitBreaker:
+    """
+    按平台的熔断器
+
+    - closed: 正常放行；最近 window 个样本中至少有 min_samples 个、且失败率达到 failure_threshold 时熔断
+    - open: 新任务直接失败，open_seconds 秒后进入半开
+    - half_open: 最多同时放行 half_open_probes 个试探任务，全部成功后恢复，任一失败重新熔断
+    """
+
+    def __init__(self, window: int = 20, min_samples: int = 5, failure_threshold: float = 0.5,
+                 open_seconds: float = 60.0, half_open_probes: int = 2):
+        """
+        初始化熔断器
+
+        Args:
+            window: 滚动统计的样本数
+            min_samples: 判定熔断所需的最少样本数
+            failure_threshold: 触发熔断的失败率
+            open_seconds: 熔断持续时间（秒）
+            half_open_probes: 半开状态下的试探任务数
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        # 平台 -> 最近样本 (是否成功, 耗时秒)
+        self.samples: Dict[str, deque] = {}
+        self.state: Dict[str, str] = {}
+        self.opened_at: Dict[str, float] = {}
+        # 半开状态下已放行、尚未结束的试探任务数和已成功的试探数
+        self.probes_in_flight: Dict[str, int] = {}
+        self.probe_successes: Dict[str, int] = {}
+        self.stats: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _platform_stats(self, platform: str) -> Dict:
+        return self.stats.setdefault(platform, {'successes': 0, 'failures': 0, 'rejected': 0, 'trips': 0})
+
+    def allow(self, platform: str) -> bool:
+        """
+        新任务是否放行；放行半开状态的试探任务时占用一个试探名额，
+        任务结束后必须调用 record 或 release 归还
+
+        Args:
+            platform: 平台
+        """
+        with self._lock:
+            state = self.state.get(platform, CLOSED)
+            if state == OPEN:
+                if time.monotonic() - self.opened_at[platform] < self.open_seconds:
+                    self._platform_stats(platform)['rejected'] += 1
+                    return False
+                state = self._transition(platform, HALF_OPEN)
+            if state == HALF_OPEN:
+                if self.probes_in_flight.get(platform, 0) + self.probe_successes.get(platform, 0) \
+                        >= self.half_open_probes:
+                    self._platform_stats(platform)['rejected'] += 1
+                    return False
+                self.probes_in_flight[platform] = self.probes_in_flight.get(platform, 0) + 1
+            return True
+
+    def retry_after(self, platform: str) -> float:
+        """熔断状态剩余的秒数"""
+        with self._lock:
+            if self.state.get(platform) != OPEN:
+                return 0.0
+            return max(self.open_seconds - (time.monotonic() - self.opened_at[platform]), 0.0)
+
+    def record(self, platform: str, success: bool, seconds: float):
+        """
+        记录一个任务的结果
+
+        Args:
+            platform: 平台
+            success: 是否成功
+            seconds: 访问源站的耗时（秒）
+        """
+        with self._lock:
+            samples = self.samples.setdefault(platform, deque(maxlen=self.window))
+            samples.append((success, seconds))
+            stats = self._platform_stats(platform)
+            stats['successes' if success else 'failures'] += 1
+
+            state = self.state.get(platform, CLOSED)
+            if state == HALF_OPEN:
+                self.probes_in_flight[platform] = max(self.probes_in_flight.get(platform, 0) - 1, 0)
+                if not success:
+                    self._transition(platform, OPEN)
+                else:
+                    self.probe_successes[platform] = self.probe_successes.get(platform, 0) + 1
+                    if self.probe_successes[platform] >= self.half_open_probes:
+                        self._transition(platform, CLOSED)
+            elif state == CLOSED and not success:
+                failures = sum(1 for ok, _ in samples if not ok)
+                if len(samples) >= self.min_samples and failures / len(samples) >= self.failure_threshold:
+                    self._transition(platform, OPEN)
+
+    def release(self, platform: str):
+        """任务没有产生有效样本（取消、命中缓存、视频本身的错误）时归还试探名额"""
+        with self._lock:
+            if self.state.get(platform) == HALF_OPEN:
+                self.probes_in_flight[platform] = max(self.probes_in_flight.get(platform, 0) - 1, 0)
+
+    def _transition(self, platform: str, state: str) -> str:
+        """切换状态（调用方持有锁）"""
+        previous = self.state.get(platform, CLOSED)
+        self.state[platform] = state
+        self.probes_in_flight[platform] = 0
+        self.probe_successes[platform] = 0
+        if state == OPEN:
+            self.opened_at[platform] = time.monotonic()
+            self._platform_stats(platform)['trips'] += 1
+            logger.warning(f"⚡ 平台 {platform} 熔断（{previous} -> open），{self.open_seconds:.0f}秒内新任务直接失败")
+        elif state == CLOSED:
+            # 恢复后丢弃熔断前的失败样本，避免立即再次触发熔断（保留试探成功的耗时）
+            self.samples[platform] = deque(
+                (sample for sample in self.samples.get(platform, ()) if sample[0]), maxlen=self.window
+            )
+            logger.info(f"✅ 平台 {platform} 试探成功，熔断解除")
+        else:
+            logger.info(f"平台 {platform} 熔断冷却结束，放行 {self.half_open_probes} 个试探任务")
+        return state
+
+    def get_stats(self) -> Dict:
+        """获取各平台的熔断状态、最近成功率和耗时"""
+        with self._lock:
+            result = {}
+            for platform in set(self.stats) | set(self.samples):
+                samples = list(self.samples.get(platform, ()))
+                durations = sorted(seconds for ok, seconds in samples if ok)
+                state = self.state.get(platform, CLOSED)
+                result[platform] = {
+                    **self._platform_stats(platform),
+                    'state': state,
+                    'recent_samples': len(samples),
+                    'recent_success_rate': round(sum(1 for ok, _ in samples if ok) / len(samples), 3) if samples else None,
+                    'avg_seconds': round(sum(durations) / len(durations), 2) if durations else None,
+                    'p95_seconds': round(durations[min(int(len(durations) * 0.95), len(durations) - 1)], 2) if durations else None,
+                    'retry_after': round(max(self.open_seconds - (time.monotonic() - self.opened_at[platform]), 0), 1)
+                    if state == OPEN else None,
+                }
+            return result
+
+    def open_platforms(self) -> list:
+        """当前熔断或半开（试探中）的平台"""
+        with self._lock:
+            return [platform for platform, state in self.state.items() if state != CLOSED]
@@ -0,0 +1,125 @@
+"""
+下载错误分类
+把下载失败按原因分为可重试（网络、限流、源站5xx等临时错误）和不可重试（地区限制、内容不存在、
+需要登录等），并计算重试前带随机抖动的指数退避时间
+"""
+
+import re
+import random
+import time
+from typing import Dict, List, Optional, Union
+
+# 分类规则，按顺序匹配：(类别, 说明, 是否可重试, 是否致命, 匹配模式)
+# 致命错误针对整个视频（换格式、换下载方式都没有意义），直接结束回退流程；
+# 不可重试但非致命的错误只针对当前这一路下载（如请求的格式不存在），仍可回退到其他下载方式
+ERROR_RULES = [
+    ('geo_blocked', '地区限制', False, True,
+     r'not available in your (country|region|location)|geo.?restrict|available from your location|地区|区域限制'),
+    ('login_required', '需要登录', False, True,
+     r'sign in to confirm|log ?in required|login to|requires? (authentication|login|an account)|'
+     r'members.only|use --cookies|需要登录|大会员|付费'),
+    ('private', '私密内容', False, True, r'private video|this video is private|私密|仅自己可见'),
+    ('copyright', '版权限制', False, True, r'copyright|drm protected|版权'),
+    # 本地缺少FFmpeg或合并失败，重新下载没有意义（"ffmpeg not found" 不能归为内容不存在）
+    ('postprocess', '本地合并/转换失败', False, False, r'ffmpeg|ffprobe|postprocess'),
+    # 分片不存在通常是被限流后的表现，先于“不存在”匹配
+    ('throttled', '请求过于频繁/被限流', True, False,
+     r'HTTP Error 429|Too Many Requests|rate.?limit|fragment( \d+)? not found|giving up after'),
+    # 签名下载链接过期，先于“访问被拒绝”匹配
+    ('expired', '下载链接已过期', True, False,
+     r'(url|link|signature|token) (has )?expired|expired (url|link|signature|token)|链接已过期'),
+    ('forbidden', '访问被拒绝(403)', True, False, r'HTTP Error 403|Forbidden'),
+    ('not_found', '内容不存在或已删除', False, True,
+     r'HTTP Error (404|410)|not found|does not exist|has been removed|video unavailable|'
+     r'no longer available|been deleted|已删除|不存在|已失效'),
+    ('unsupported', '不支持的链接', False, True, r'Unsupported URL|不支持'),
+    ('format_unavailable', '请求的格式不可用', False, False,
+     r'requested format (is )?not available|no video formats found|no suitable formats?'),
+    ('server_error', '源站服务器错误', True, False, r'HTTP Error 5\d\d|Internal Server Error|Bad Gateway|Service Unavailable'),
+    ('network', '网络错误', True, False,
+     r'timed? ?out|timeout|connection (reset|refused|aborted)|remote end closed|IncompleteRead|'
+     r'Temporary failure in name resolution|Name or service not known|Network is unreachable|'
+     r'EOF occurred|SSL|ConnectionError|Read error'),
+]
+
+# 重试前需要重新提取信息的类别：提取结果中的签名媒体链接已过期或被拒绝，沿用旧链接重试只会重复失败
+REFRESH_CATEGORIES = {'expired', 'forbidden'}
+
+# 下载没有报错但没有产生文件：设置了大小预算时是被大小上限中止，否则按临时错误处理
+OVER_BUDGET = {'category': 'over_budget', 'reason': '超出大小预算', 'retryable': False, 'fatal': False}
+NO_OUTPUT = {'category': 'no_output', 'reason': '没有产生文件', 'retryable': True, 'fatal': False}
+
+_COMPILED_RULES = [
+    (category, label, retryable, fatal, re.compile(pattern, re.IGNORECASE))
+    for category, label, retryable, fatal, pattern in ERROR_RULES
+]
+
+
+class DownloadFailure(Exception):
+    """下载失败，带各次失败的分类记录"""
+
+    def __init__(self, message: str, failures: Optional[List[Dict]] = None):
+        super().__init__(message)
+        self.failures = failures or []
+
+    def __reduce__(self):
+        # 工作进程模式下异常需要序列化传回主进程，保留失败记录
+        return (self.__class__, (str(self), self.failures))
+
+    @property
+    def category(self) -> Optional[str]:
+        """最后一次失败的类别"""
+        return self.failures[-1]['category'] if self.failures else None
+
+
+def classify_error(error: Union[BaseException, str]) -> Dict:
+    """
+    对下载错误分类
+
+    Args:
+        error: yt-dlp 抛出的异常或错误信息
+
+    Returns:
+        {'category': 类别, 'reason': 说明, 'retryable': 是否可重试, 'fatal': 是否致命（放弃整个视频）}
+    """
+    message = str(error)
+    # DownloadError 包装的原始异常（如 GeoRestrictedError）信息也参与匹配
+    exc_info = getattr(error, 'exc_info', None)
+    if exc_info and exc_info[1] is not None:
+        message += f" {exc_info[1]}"
+    for category, label, retryable, fatal, pattern in _COMPILED_RULES:
+        if pattern.search(message):
+            return {'category': category, 'reason': label, 'retryable': retryable, 'fatal': fatal}
+    # 无法识别的错误保持原有行为：允许重试
+    return {'category': 'unknown', 'reason': '未知错误', 'retryable': True, 'fatal': False}
+
+
+def make_failure_record(stage: str, error: Union[BaseException, str],
+                        classification: Optional[Dict] = None) -> Dict:
+    """
+    生成写入任务记录的失败信息
+
+    Args:
+        stage: 失败的下载阶段（download_video / download_audio）
+        error: 异常或错误信息
+        classification: 已有的分类结果，不提供时自动分类
+    """
+    return {
+        'stage': stage,
+        **(classification or classify_error(error)),
+        'message': str(error)[:300],
+        'time': time.time(),
+    }
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    指数退避时间（full jitter）：在 [0, min(cap, base*2^attempt)] 内均匀取值，
+    避免同一平台的多个任务在同一时刻集中重试
+
+    Args:
+        attempt: 第几次重试（从0开始）
+        base: 基础等待时间（秒）
+        cap: 最大等待时间（秒）
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
@@ -0,0 +1,341 @@
+"""
+执行引擎
+在当前进程（线程）或独立的工作进程池中执行 VideoProcessor 任务
+"""
+
+import os
+import sys
+import asyncio
+import logging
+import threading
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional
+
+from .video_processor import VideoProcessor
+
+logger = logging.getLogger(__name__)
+
+
+def run_processor_job(
+    method: str,
+    kwargs: Dict,
+    processor_opts: Dict,
+    progress_queue=None,
+    job_id: Optional[int] = None
+) -> Dict:
+    """
+    在工作进程中执行 VideoProcessor 的异步方法
+    
+    Args:
+        method: 方法名，如 download_video_and_audio
+        kwargs: 方法参数（需可序列化）
+        processor_opts: VideoProcessor 构造参数
+        progress_queue: 进度队列，进度以 (job_id, data) 的形式放入
+        job_id: 任务编号
+        
+    Returns:
+        {'result': 方法返回值, 'download_stats': 下载统计}
+    """
+    progress_callback = None
+    if progress_queue is not None:
+        progress_callback = lambda data: progress_queue.put((job_id, data))
+    processor = VideoProcessor(progress_callback=progress_callback, **processor_opts)
+    result = asyncio.run(getattr(processor, method)(**kwargs))
+    return {'result': result, 'download_stats': processor.download_stats}
+
+
+def _isolated_job_entry(conn, method: str, kwargs: Dict, processor_opts: Dict,
+                        progress_queue, job_id: int):
+    """独立工作进程的入口：执行单个任务，通过管道返回结果或异常"""
+    try:
+        result = run_processor_job(method, kwargs, processor_opts, progress_queue, job_id)
+        conn.send(('ok', result))
+    except Exception as e:
+        try:
+            conn.send(('error', e))
+        except Exception:
+            # 异常无法序列化时只返回信息
+            conn.send(('error', Exception(str(e))))
+    finally:
+        conn.close()
+
+
+class ThreadExecutionEngine:
+    """在API进程内执行任务（yt-dlp阻塞调用由 VideoProcessor 放到线程中）"""
+    
+    backend = 'thread'
+    
+    def __init__(self, processor_opts: Dict = None):
+        """
+        初始化执行引擎
+        
+        Args:
+            processor_opts: VideoProcessor 构造参数
+        """
+        self.processor_opts = processor_opts or {}
+        self.stats = {'completed': 0, 'failed': 0, 'running': 0}
+    
+    def start(self):
+        """启动引擎（线程模式无需准备）"""
+    
+    def shutdown(self):
+        """关闭引擎"""
+    
+    async def run(self, method: str, kwargs: Dict, progress_callback: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        执行 VideoProcessor 方法
+        
+        Args:
+            method: 方法名
+            kwargs: 方法参数
+            progress_callback: 进度回调（在事件循环线程中调用）
+            
+        Returns:
+            {'result': 方法返回值, 'download_stats': 下载统计}
+        """
+        loop = asyncio.get_running_loop()
+        callback = None
+        if progress_callback is not None:
+            # 进度可能在yt-dlp的工作线程中产生，切回事件循环线程处理
+            callback = lambda data: loop.call_soon_threadsafe(progress_callback, data)
+        processor = VideoProcessor(progress_callback=callback, **self.processor_opts)
+        self.stats['running'] += 1
+        try:
+            result = await getattr(processor, method)(**kwargs)
+            self.stats['completed'] += 1
+            return {'result': result, 'download_stats': processor.download_stats}
+        except Exception:
+            self.stats['failed'] += 1
+            raise
+        finally:
+            self.stats['running'] -= 1
+    
+    def get_stats(self) -> Dict:
+        """获取引擎统计信息"""
+        return {'backend': self.backend, **self.stats}
+
+
+class ProcessExecutionEngine:
+    """
+    受监管的工作进程池：工作进程执行N个任务后回收，进程崩溃时重建进程池
+    
+    隔离级别：
+    - pool（默认）：任务在共享进程池中执行，进程启动开销小。一个进程崩溃会使池中所有进行中的任务失败，
+      这些任务各自在独立进程中重试一次，必然崩溃的任务只会再次拖垮它自己；
+      取消任务时正在执行的工作进程会继续下载直到结束
+    - job：每个任务在独立进程中执行，崩溃只影响该任务，取消任务时立即终止进程；每个任务多一次进程启动开销
+    """
+    
+    backend = 'process'
+    
+    def __init__(self, pool_size: int = None, max_jobs_per_worker: int = 20, processor_opts: Dict = None,
+                 isolation: str = 'pool'):
+        """
+        初始化进程池引擎
+        
+        Args:
+            pool_size: 工作进程数，默认为CPU核数
+            max_jobs_per_worker: 每个工作进程执行多少个任务后回收
+            processor_opts: VideoProcessor 构造参数
+            isolation: 隔离级别，pool 或 job
+        """
+        self.pool_size = pool_size or os.cpu_count() or 2
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.processor_opts = processor_opts or {}
+        if isolation not in ('pool', 'job'):
+            logger.warning(f"未知的隔离级别 {isolation}，使用 pool")
+            isolation = 'pool'
+        self.isolation = isolation
+        # 独立进程任务的并发上限（与进程池大小一致），在 start 中创建
+        self._isolated_slots: Optional[asyncio.Semaphore] = None
+        self._ctx = multiprocessing.get_context("spawn")
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_jobs = 0
+        self._manager = None
+        self._progress_queue = None
+        self._pump_thread = None
+        self._callbacks: Dict[int, Callable[[Dict], None]] = {}
+        self._job_ids = itertools.count(1)
+        self._loop = None
+        self.stats = {
+            'completed': 0, 'failed': 0, 'running': 0, 'crashes': 0, 'recycles': 0,
+            'isolated_retries': 0, 'terminated': 0,
+        }
+    
+    def start(self):
+        """启动进程池和进度转发线程"""
+        self._loop = asyncio.get_running_loop()
+        self._isolated_slots = asyncio.Semaphore(self.pool_size)
+        self._manager = self._ctx.Manager()
+        self._progress_queue = self._manager.Queue()
+        self._executor = self._new_executor()
+        self._pump_thread = threading.Thread(target=self._pump_progress, name="progress-pump", daemon=True)
+        self._pump_thread.start()
+        logger.info(f"⚙️ 工作进程池已启动: {self.pool_size} 个进程，每个进程最多执行 {self.max_jobs_per_worker} 个任务")
+    
+    def _new_executor(self) -> ProcessPoolExecutor:
+        """创建新的进程池"""
+        self._executor_jobs = 0
+        if sys.version_info >= (3, 11):
+            return ProcessPoolExecutor(
+                max_workers=self.pool_size,
+                mp_context=self._ctx,
+                max_tasks_per_child=self.max_jobs_per_worker
+            )
+        return ProcessPoolExecutor(max_workers=self.pool_size, mp_context=self._ctx)
+    
+    def _maybe_recycle(self):
+        """旧版Python不支持 max_tasks_per_child，按整池任务数整体轮换进程池"""
+        if sys.version_info >= (3, 11):
+            return
+        if self._executor_jobs >= self.pool_size * self.max_jobs_per_worker:
+            old_executor = self._executor
+            self._executor = self._new_executor()
+            # 不等待：旧进程池中正在执行的任务会继续完成
+            old_executor.shutdown(wait=False)
+            self.stats['recycles'] += 1
+            logger.info("♻️ 工作进程池已轮换")
+    
+    def _pump_progress(self):
+        """把工作进程上报的进度转发到事件循环线程"""
+        while True:
+            try:
+                item = self._progress_queue.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            job_id, data = item
+            callback = self._callbacks.get(job_id)
+            if callback is not None:
+                self._loop.call_soon_threadsafe(callback, data)
+    
+    async def run(self, method: str, kwargs: Dict, progress_callback: Optional[Callable[[Dict], None]] = None) -> Dict:
+        """
+        在工作进程中执行 VideoProcessor 方法
+        
+        Args:
+            method: 方法名
+            kwargs: 方法参数（需可序列化）
+            progress_callback: 进度回调（在事件循环线程中调用）
+            
+        Returns:
+            {'result': 方法返回值, 'download_stats': 下载统计}
+        """
+        job_id = next(self._job_ids)
+        if progress_callback is not None:
+            self._callbacks[job_id] = progress_callback
+        self.stats['running'] += 1
+        try:
+            if self.isolation == 'job':
+                result = await self._run_isolated(method, kwargs, job_id)
+            else:
+                result = await self._run_pooled(method, kwargs, job_id)
+            self.stats['completed'] += 1
+            return result
+        except Exception:
+            self.stats['failed'] += 1
+            raise
+        finally:
+            self.stats['running'] -= 1
+            self._callbacks.pop(job_id, None)
+    
+    async def _run_pooled(self, method: str, kwargs: Dict, job_id: int) -> Dict:
+        """在共享进程池中执行；进程池因进程崩溃损坏时，在独立进程中重试一次"""
+        self._maybe_recycle()
+        executor = self._executor
+        self._executor_jobs += 1
+        try:
+            future = executor.submit(
+                run_processor_job, method, kwargs, self.processor_opts,
+                self._progress_queue, job_id
+            )
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            if self._executor is executor:
+                self.stats['crashes'] += 1
+                logger.error("💥 工作进程异常退出，重建进程池")
+                self._executor = self._new_executor()
+                executor.shutdown(wait=False)
+        # 无法确定是哪个任务导致崩溃：受影响的任务各自在独立进程中重试，
+        # 必然崩溃的任务只会拖垮它自己的进程，不会再次影响其他任务
+        self.stats['isolated_retries'] += 1
+        logger.warning(f"任务 {job_id} 受工作进程崩溃影响，在独立进程中重试")
+        return await self._run_isolated(method, kwargs, job_id)
+    
+    async def _run_isolated(self, method: str, kwargs: Dict, job_id: int) -> Dict:
+        """在独立进程中执行单个任务，取消时终止该进程"""
+        async with self._isolated_slots:
+            parent_conn, child_conn = self._ctx.Pipe(duplex=False)
+            process = self._ctx.Process(
+                target=_isolated_job_entry,
+                args=(child_conn, method, kwargs, self.processor_opts, self._progress_queue, job_id),
+                name=f"job-{job_id}",
+                daemon=True
+            )
+            process.start()
+            child_conn.close()
+            try:
+                status, payload = await asyncio.to_thread(parent_conn.recv)
+            except asyncio.CancelledError:
+                if process.is_alive():
+                    process.terminate()
+                    self.stats['terminated'] += 1
+                    logger.info(f"任务 {job_id} 已取消，终止工作进程")
+                # 读取线程在进程退出后收到EOF结束，连接随之回收
+                raise
+            except EOFError:
+                parent_conn.close()
+                await asyncio.to_thread(process.join)
+                self.stats['crashes'] += 1
+                logger.error(f"💥 任务 {job_id} 的工作进程异常退出（退出码 {process.exitcode}）")
+                raise Exception(f"工作进程异常退出（退出码 {process.exitcode}），任务执行失败")
+            parent_conn.close()
+            await asyncio.to_thread(process.join)
+            if status == 'error':
+                raise payload
+            return payload
+    
+    def shutdown(self):
+        """关闭进程池和进度转发线程"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self._progress_queue is not None:
+            try:
+                self._progress_queue.put(None)
+            except Exception:
+                pass
+        if self._manager is not None:
+            self._manager.shutdown()
+    
+    def get_stats(self) -> Dict:
+        """获取引擎统计信息"""
+        return {
+            'backend': self.backend,
+            'pool_size': self.pool_size,
+            'max_jobs_per_worker': self.max_jobs_per_worker,
+            'isolation': self.isolation,
+            **self.stats
+        }
+
+
+def create_execution_engine(backend: str, processor_opts: Dict = None, pool_size: int = None,
+                            max_jobs_per_worker: int = 20, isolation: str = 'pool'):
+    """
+    按配置创建执行引擎
+    
+    Args:
+        backend: thread 或 process
+        processor_opts: VideoProcessor 构造参数
+        pool_size: 工作进程数（仅 process 模式）
+        max_jobs_per_worker: 工作进程回收阈值（仅 process 模式）
+        isolation: 任务隔离级别 pool 或 job（仅 process 模式）
+    """
+    if backend == 'process':
+        return ProcessExecutionEngine(pool_size, max_jobs_per_worker, processor_opts, isolation)
+    if backend != 'thread':
+        logger.warning(f"未知的执行后端 {backend}，使用线程模式")
+    return ThreadExecutionEngine(processor_opts)
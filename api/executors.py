@@ -0,0 +1,164 @@
+"""
+有界执行器
+把阻塞调用放到独立线程池中执行，限制并发数并设置超时，避免阻塞事件循环；
+以及限制处理流水线各阶段并发数的阶段池
+"""
+
+import time
+import asyncio
+import threading
+import logging
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedExecutor:
+    """带并发上限和超时的线程池执行器"""
+    
+    def __init__(self, name: str, max_workers: int, timeout: Optional[float] = None):
+        """
+        初始化有界执行器
+        
+        Args:
+            name: 执行器名称（用于线程名和日志）
+            max_workers: 最大并发数
+            timeout: 单次调用超时时间(秒)，None表示不限制
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'submitted': 0,
+            'running': 0,
+            'completed': 0,
+            'failed': 0,
+            'timeouts': 0,
+            'total_seconds': 0.0,
+        }
+    
+    async def run(self, func: Callable, *args):
+        """
+        在线程池中执行阻塞函数
+        
+        Args:
+            func: 要执行的阻塞函数
+            *args: 函数参数
+            
+        Returns:
+            函数返回值
+        """
+        loop = asyncio.get_running_loop()
+        self.stats['submitted'] += 1
+        future = loop.run_in_executor(self._executor, self._timed_call, func, args)
+        try:
+            return await asyncio.wait_for(future, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            logger.warning(f"{self.name} 执行超时（{self.timeout}秒）")
+            raise TimeoutError(f"执行超时（{self.timeout}秒）")
+    
+    def _timed_call(self, func: Callable, args: tuple):
+        """在工作线程中执行并记录耗时"""
+        with self._stats_lock:
+            self.stats['running'] += 1
+        start = time.monotonic()
+        outcome = 'failed'
+        try:
+            result = func(*args)
+            outcome = 'completed'
+            return result
+        finally:
+            with self._stats_lock:
+                self.stats['running'] -= 1
+                self.stats[outcome] += 1
+                self.stats['total_seconds'] += time.monotonic() - start
+    
+    def get_stats(self) -> Dict:
+        """获取执行器统计信息"""
+        finished = self.stats['completed'] + self.stats['failed']
+        return {
+            'max_workers': self.max_workers,
+            'timeout': self.timeout,
+            'running': self.stats['running'],
+            'queued': max(self.stats['submitted'] - finished - self.stats['running'], 0),
+            'completed': self.stats['completed'],
+            'failed': self.stats['failed'],
+            'timeouts': self.stats['timeouts'],
+            'avg_seconds': round(self.stats['total_seconds'] / finished, 3) if finished else 0,
+        }
+    
+    def shutdown(self):
+        """关闭线程池"""
+        self._executor.shutdown(wait=False)
+
+
+class StagePool:
+    """
+    处理流水线中单个阶段的并发上限
+    
+    阶段内的工作由执行引擎完成（线程或工作进程），这里只控制同时进入该阶段的任务数，
+    使网络阶段和本地处理阶段按各自的资源分别限流、互不占用名额
+    """
+    
+    def __init__(self, name: str, max_workers: int):
+        """
+        初始化阶段池
+        
+        Args:
+            name: 阶段名称（用于日志和统计）
+            max_workers: 同时处于该阶段的最大任务数
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self.stats = {
+            'running': 0,
+            'queued': 0,
+            'completed': 0,
+            'failed': 0,
+            'total_seconds': 0.0,
+        }
+    
+    @asynccontextmanager
+    async def slot(self, on_wait: Optional[Callable[[], None]] = None):
+        """
+        占用一个阶段名额
+        
+        Args:
+            on_wait: 没有立即拿到名额、需要排队时的回调
+        """
+        if self._semaphore.locked() and on_wait is not None:
+            on_wait()
+        self.stats['queued'] += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.stats['queued'] -= 1
+        self.stats['running'] += 1
+        start = time.monotonic()
+        outcome = 'failed'
+        try:
+            yield
+            outcome = 'completed'
+        finally:
+            self.stats['running'] -= 1
+            self.stats[outcome] += 1
+            self.stats['total_seconds'] += time.monotonic() - start
+            self._semaphore.release()
+    
+    def get_stats(self) -> Dict:
+        """获取阶段统计信息"""
+        finished = self.stats['completed'] + self.stats['failed']
+        return {
+            'max_workers': self.max_workers,
+            'running': self.stats['running'],
+            'queued': self.stats['queued'],
+            'completed': self.stats['completed'],
+            'failed': self.stats['failed'],
+            'avg_seconds': round(self.stats['total_seconds'] / finished, 3) if finished else 0,
+        }
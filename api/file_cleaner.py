@@ -9,7 +9,7 @@ import logging
 import asyncio
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import Dict, List
+from typing import Callable, Dict, List
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +27,16 @@ class FileCleanerManager:
         self.temp_dir = temp_dir
         self.config = config or self._get_default_config()
         self.is_running = False
+        self.delete_callbacks: List[Callable[[str], None]] = []
+        self.cleanup_callbacks: List[Callable[[], None]] = []
+        
+    def add_delete_callback(self, callback: Callable[[str], None]):
+        """注册文件删除回调，参数为被删除的文件名（用于同步缓存等索引）"""
+        self.delete_callbacks.append(callback)
+    
+    def add_cleanup_callback(self, callback: Callable[[], None]):
+        """注册清理完成回调，每轮清理结束后调用（用于同步清理任务记录等）"""
+        self.cleanup_callbacks.append(callback)
         
     def _get_default_config(self) -> Dict:
         """获取默认清理配置"""
@@ -37,6 +47,7 @@ class FileCleanerManager:
             'max_storage_mb': 1000,  # 最大存储空间(MB) - 1GB
             'cleanup_on_startup': True,  # 启动时清理
             'preserve_recent_files': 10,  # 保留最近的文件数量
+            'stale_stream_minutes': 30,  # 流式下载临时文件超过该时间未写入视为残留
         }
     
     async def start_cleanup_service(self):
@@ -80,13 +91,17 @@ class FileCleanerManager:
             if not self.temp_dir.exists():
                 return {'status': 'no_temp_dir', 'message': '临时目录不存在'}
             
+            self._remove_stale_streams()
+            
             # 获取所有文件信息
             files_info = self._get_files_info()
             if not files_info:
+                self._run_cleanup_callbacks()
                 return {'status': 'no_files', 'message': '没有文件需要清理'}
             
             # 执行清理策略
             cleanup_stats = await self._execute_cleanup_strategy(files_info)
+            self._run_cleanup_callbacks()
             
             logger.info(f"✅ 文件清理完成: {cleanup_stats}")
             return cleanup_stats
@@ -96,6 +111,21 @@ class FileCleanerManager:
             logger.error(error_msg)
             return {'status': 'error', 'message': error_msg}
     
+    def _remove_stale_streams(self) -> int:
+        """删除进程崩溃或重启后残留的流式下载临时文件（.stream_*），正在写入的文件不受影响"""
+        stale_seconds = self.config.get('stale_stream_minutes', 30) * 60
+        removed = 0
+        for file_path in self.temp_dir.glob(".stream_*"):
+            try:
+                if time.time() - file_path.stat().st_mtime > stale_seconds:
+                    file_path.unlink()
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"删除残留流式文件失败 {file_path}: {e}")
+        if removed:
+            logger.info(f"🗑️ 已删除 {removed} 个残留的流式下载临时文件")
+        return removed
+    
     def _get_files_info(self) -> List[Dict]:
         """获取所有文件信息"""
         files_info = []
@@ -170,12 +200,25 @@ class FileCleanerManager:
         stats['freed_space_mb'] = round(stats['freed_space_mb'], 2)
         return stats
     
+    def _run_cleanup_callbacks(self):
+        """执行清理完成回调"""
+        for callback in self.cleanup_callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"清理完成回调失败: {e}")
+    
     async def _delete_file(self, file_info: Dict) -> bool:
         """删除文件"""
         try:
             file_path = file_info['path']
             file_path.unlink()
             logger.info(f"🗑️ 已删除文件: {file_info['name']} ({file_info['size']/1024/1024:.1f}MB)")
+            for callback in self.delete_callbacks:
+                try:
+                    callback(file_info['name'])
+                except Exception as e:
+                    logger.warning(f"文件删除回调失败 {file_info['name']}: {e}")
             return True
         except Exception as e:
             logger.warning(f"删除文件失败 {file_info['name']}: {e}")
@@ -0,0 +1,184 @@
+"""
+文件下载响应
+支持 Range 断点续传、HEAD 请求和强 ETag 的文件响应
+"""
+
+import asyncio
+import hashlib
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+def compute_etag(path: Path, chunk_size: int = 1024 * 1024) -> str:
+    """
+    计算文件内容的强ETag（BLAKE2b摘要），在文件定稿时计算一次
+
+    Args:
+        path: 文件路径
+        chunk_size: 每次读取的字节数
+
+    Returns:
+        带引号的ETag字符串
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return f'"{digest.hexdigest()}"'
+
+def stat_etag(stat_result: os.stat_result) -> str:
+    """没有预先计算的ETag时，由文件大小和修改时间生成"""
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+class RangeNotSatisfiable(Exception):
+    """Range 请求无法满足（格式错误、多段或超出文件范围）"""
+
+def parse_range(header: str, size: int) -> Tuple[int, int]:
+    """
+    解析单段 Range 头
+
+    Args:
+        header: Range 头，如 bytes=0-1023、bytes=1024-、bytes=-512
+        size: 文件大小
+
+    Returns:
+        (起始位置, 结束位置)，均包含
+
+    Raises:
+        RangeNotSatisfiable: 多段范围、格式错误或超出文件范围
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in ranges:
+        raise RangeNotSatisfiable(header)
+    start_text, sep, end_text = ranges.strip().partition('-')
+    if not sep:
+        raise RangeNotSatisfiable(header)
+    try:
+        if start_text == '':
+            # 后缀范围：最后N个字节
+            suffix = int(end_text)
+            if suffix <= 0:
+                raise RangeNotSatisfiable(header)
+            return max(size - suffix, 0), size - 1
+        start = int(start_text)
+        end = int(end_text) if end_text else size - 1
+    except ValueError:
+        raise RangeNotSatisfiable(header)
+    if start < 0 or start >= size or end < start:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+def _etag_matches(header: Optional[str], etag: str, weak: bool) -> bool:
+    """比较条件请求头中的ETag，weak为True时忽略 W/ 前缀"""
+    if not header:
+        return False
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if weak and tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+class FileRangeResponse(Response):
+    """
+    发送文件的全部或一段
+
+    服务器支持 ASGI zerocopy 扩展时交给服务器用 sendfile 零拷贝发送，
+    支持 pathsend 扩展时整文件交给服务器发送，否则在线程中分块读取。
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, path: Path, start: int, end: int, status_code: int,
+                 headers: Dict[str, str], media_type: str, send_body: bool = True):
+        headers = {**headers, 'Content-Length': str(end - start + 1)}
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.end = end
+        self.send_body = send_body
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        count = self.end - self.start + 1
+        if not self.send_body or count <= 0:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+
+        extensions = scope.get('extensions') or {}
+        size = self.path.stat().st_size
+        if 'http.response.pathsend' in extensions and self.start == 0 and count == size:
+            await send({'type': 'http.response.pathsend', 'path': str(self.path)})
+            return
+
+        with open(self.path, 'rb') as f:
+            if 'http.response.zerocopy' in extensions:
+                await send({
+                    'type': 'http.response.zerocopy',
+                    'file': f,
+                    'offset': self.start,
+                    'count': count,
+                    'more_body': False
+                })
+                return
+
+            f.seek(self.start)
+            remaining = count
+            while remaining > 0:
+                chunk = await asyncio.to_thread(f.read, min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+            if remaining > 0:
+                # 文件在发送过程中被截断
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+def build_file_response(request: Request, path: Path, etag: str, media_type: str,
+                        headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    按条件请求头和 Range 头构造文件响应
+
+    - If-None-Match 匹配：304
+    - Range 多段或不可满足：416
+    - If-Range 与当前ETag不一致：忽略 Range，返回完整文件
+    - 单段 Range：206
+
+    Args:
+        request: 请求
+        path: 文件路径
+        etag: 文件的强ETag
+        media_type: 媒体类型
+        headers: 额外响应头
+    """
+    size = path.stat().st_size
+    headers = {**(headers or {}), 'ETag': etag, 'Accept-Ranges': 'bytes'}
+    send_body = request.method != 'HEAD'
+
+    if _etag_matches(request.headers.get('if-none-match'), etag, weak=True):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if range_header and if_range and not _etag_matches(if_range, etag, weak=False):
+        range_header = None
+
+    if range_header:
+        try:
+            start, end = parse_range(range_header, size)
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        return FileRangeResponse(path, start, end, 206, headers, media_type, send_body)
+
+    return FileRangeResponse(path, 0, size - 1, 200, headers, media_type, send_body)
@@ -0,0 +1,313 @@
+"""
+格式选择
+在已提取的 formats 列表上按预估体积、分辨率和是否需要合并选择下载格式，
+代替依赖 filesize 元数据的 yt-dlp 格式字符串
+"""
+
+import logging
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 各平台的格式偏好：目标分辨率上限；B站分离流体积大，沿用原策略的最低画质（不低于360p），优先体积最小的格式
+PLATFORM_FORMAT_PROFILES = {
+    'bilibili': {'max_height': 480, 'min_height': 360, 'prefer_smallest': True},
+    'youtube': {'max_height': 1080},
+    'tiktok': {'max_height': 720},
+    'xiaohongshu': {'max_height': 720},
+    'generic': {'max_height': 720},
+}
+
+# 请求没有指定大小预算时的默认体积上限（沿用原格式字符串的 filesize<100M / filesize<50M），
+# 只影响排序：没有满足上限的格式时仍然下载，不会报错
+DEFAULT_MAX_BYTES = {
+    'video': 100 * 1024 * 1024,
+    'audio': 50 * 1024 * 1024,
+}
+
+# 可直接封装进 mp4 的音频编码，分离流合并为 mp4 时优先选择
+MP4_AUDIO_CODECS = ('mp4a', 'aac')
+
+
+class FormatBudgetError(ValueError):
+    """所有体积已知的格式都超出请求的大小/码率预算"""
+
+
+def estimate_bytes(fmt: Dict, duration: Optional[float]) -> Optional[int]:
+    """
+    预估格式的字节数：filesize > filesize_approx > 码率×时长
+
+    Args:
+        fmt: yt-dlp 格式字典
+        duration: 媒体时长（秒）
+
+    Returns:
+        预估字节数，无法估算时返回None
+    """
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    tbr = fmt.get('tbr') or ((fmt.get('vbr') or 0) + (fmt.get('abr') or 0))
+    if tbr and duration:
+        return int(tbr * 1000 / 8 * duration)
+    return None
+
+
+def _bitrate(fmt: Dict, size: Optional[int], duration: Optional[float]) -> Optional[float]:
+    """格式的总码率(kbps)，缺少码率元数据时由体积和时长推算"""
+    tbr = fmt.get('tbr') or ((fmt.get('vbr') or 0) + (fmt.get('abr') or 0))
+    if tbr:
+        return tbr
+    if size and duration:
+        return size * 8 / 1000 / duration
+    return None
+
+
+def _has_video(fmt: Dict) -> bool:
+    # 编码未知（通用提取器的直链）按音视频合一处理
+    return fmt.get('vcodec') != 'none'
+
+
+def _has_audio(fmt: Dict) -> bool:
+    return fmt.get('acodec') != 'none'
+
+
+def _format_size(size: Optional[int]) -> str:
+    return f"约{size / 1024 / 1024:.1f}MB" if size else "大小未知"
+
+
+def _describe(candidate: Dict) -> str:
+    kind = "渐进式" if candidate['progressive'] else "分离流(需合并)"
+    height = f"{candidate['height']}p" if candidate['height'] else "分辨率未知"
+    return f"{kind} {height}，{_format_size(candidate['bytes'])}"
+
+
+class FormatSelector:
+    """
+    在 formats 列表上选择下载格式
+
+    视频：候选为音视频合一的渐进式格式，以及纯视频+纯音频的组合。
+    1. 超出大小/码率预算的候选排除（体积未知的候选保留，排在已知体积的候选之后）
+    2. 超出平台目标分辨率范围的候选排除（没有其他候选时保留）
+    3. 没有指定预算时，默认体积上限内的候选优先
+    4. 渐进式优先，避免合并；再按预估体积选择预算内最大的（平台偏好最低画质时选最小的）
+    音频：纯音频格式按预算内的码率排序，优先可直接流复制为目标格式的编码
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None, max_bitrate: Optional[float] = None,
+                 max_height: Optional[int] = None, min_height: Optional[int] = None,
+                 prefer_smallest: bool = False, default_max_bytes: Optional[Dict] = None):
+        """
+        初始化选择器
+
+        Args:
+            max_bytes: 大小预算（字节），分离流按视频+音频合计
+            max_bitrate: 码率预算(kbps)
+            max_height: 目标分辨率上限
+            min_height: 目标分辨率下限
+            prefer_smallest: 是否优先体积最小的格式
+            default_max_bytes: 没有大小和码率预算时各类下载的默认体积上限 {'video': 字节, 'audio': 字节}
+        """
+        self.max_bytes = max_bytes
+        self.max_bitrate = max_bitrate
+        self.max_height = max_height
+        self.min_height = min_height
+        self.prefer_smallest = prefer_smallest
+        self.default_max_bytes = default_max_bytes or {}
+
+    def _fits_budget(self, candidate: Dict) -> Optional[bool]:
+        """是否在预算内，体积和码率都未知时返回None"""
+        checks = []
+        if self.max_bytes and candidate['bytes']:
+            checks.append(candidate['bytes'] <= self.max_bytes)
+        if self.max_bitrate and candidate['bitrate']:
+            checks.append(candidate['bitrate'] <= self.max_bitrate)
+        if not checks:
+            return None if (self.max_bytes or self.max_bitrate) else True
+        return all(checks)
+
+    def _within_default(self, candidate: Dict, kind: str) -> bool:
+        """没有指定预算时是否在默认体积上限内（体积未知按超出处理）"""
+        limit = self.default_max_bytes.get(kind)
+        if self.max_bytes or self.max_bitrate or not limit:
+            return True
+        return bool(candidate['bytes']) and candidate['bytes'] <= limit
+
+    def _candidate(self, formats: List[Dict], duration: Optional[float]) -> Dict:
+        """把单个格式或分离流组合转换为候选"""
+        sizes = [estimate_bytes(fmt, duration) for fmt in formats]
+        size = sum(sizes) if all(sizes) else None
+        bitrates = [_bitrate(fmt, s, duration) for fmt, s in zip(formats, sizes)]
+        return {
+            'spec': '+'.join(str(fmt['format_id']) for fmt in formats),
+            'bytes': size,
+            'bitrate': sum(bitrates) if all(bitrates) else None,
+            'height': formats[0].get('height'),
+            'progressive': len(formats) == 1,
+        }
+
+    def _budget_filter(self, candidates: List[Dict]) -> List[Dict]:
+        """排除超出预算的候选，预算内（已知）的排在未知的前面"""
+        known = [c for c in candidates if self._fits_budget(c) is True]
+        unknown = [c for c in candidates if self._fits_budget(c) is None]
+        return known + unknown
+
+    def _budget_text(self) -> str:
+        parts = []
+        if self.max_bytes:
+            parts.append(f"大小≤{self.max_bytes / 1024 / 1024:g}MB")
+        if self.max_bitrate:
+            parts.append(f"码率≤{self.max_bitrate:.0f}kbps")
+        return "、".join(parts)
+
+    def _best_audio(self, audio_only: List[Dict], duration: Optional[float],
+                    preferred_codecs: tuple = ()) -> Optional[Dict]:
+        """纯音频格式中优先指定编码，再选码率最高的（平台偏好最低画质时选码率最低的）"""
+        if not audio_only:
+            return None
+        direction = -1 if self.prefer_smallest else 1
+        return max(audio_only, key=lambda fmt: (
+            (fmt.get('acodec') or '').startswith(preferred_codecs) if preferred_codecs else False,
+            direction * (fmt.get('abr') or fmt.get('tbr') or 0),
+            -(estimate_bytes(fmt, duration) or 0),
+        ))
+
+    def select_video(self, info: Dict) -> Optional[Dict]:
+        """
+        选择视频下载格式
+
+        Args:
+            info: yt-dlp 信息字典（包含 formats）
+
+        Returns:
+            选中的格式 {'format': yt-dlp格式字符串如 18 或 137+140, 'estimated_bytes', 'height',
+            'progressive': 是否音视频合一（不需要合并）, 'reason': 选择原因}，没有可用格式时返回None
+
+        Raises:
+            FormatBudgetError: 所有体积已知的格式都超出预算
+        """
+        formats = [fmt for fmt in info.get('formats') or [] if fmt.get('format_id') is not None]
+        if not formats:
+            return None
+        duration = info.get('duration')
+
+        progressive = [fmt for fmt in formats if _has_video(fmt) and _has_audio(fmt)]
+        video_only = [fmt for fmt in formats if _has_video(fmt) and not _has_audio(fmt)]
+        audio_only = [fmt for fmt in formats if _has_audio(fmt) and not _has_video(fmt)]
+
+        candidates = [self._candidate([fmt], duration) for fmt in progressive]
+        audio = self._best_audio(audio_only, duration, MP4_AUDIO_CODECS)
+        if audio is not None:
+            candidates += [self._candidate([fmt, audio], duration) for fmt in video_only]
+        if not candidates:
+            return None
+        return self._choose(candidates, "视频")
+
+    def select_audio(self, info: Dict, preferred_codecs: tuple = ()) -> Optional[Dict]:
+        """
+        选择音频下载格式，没有纯音频格式时选择体积最小的音视频合一格式
+
+        Args:
+            info: yt-dlp 信息字典（包含 formats）
+            preferred_codecs: 优先的音频编码前缀（可直接流复制为目标格式的编码）
+
+        Raises:
+            FormatBudgetError: 所有体积已知的格式都超出预算
+        """
+        formats = [fmt for fmt in info.get('formats') or [] if fmt.get('format_id') is not None]
+        if not formats:
+            return None
+        duration = info.get('duration')
+
+        audio_only = [fmt for fmt in formats if _has_audio(fmt) and not _has_video(fmt)]
+        if audio_only:
+            candidates = []
+            for fmt in audio_only:
+                candidate = self._candidate([fmt], duration)
+                candidate['preferred'] = (fmt.get('acodec') or '').startswith(preferred_codecs) if preferred_codecs else False
+                candidate['abr'] = fmt.get('abr') or fmt.get('tbr') or 0
+                candidates.append(candidate)
+            allowed = self._budget_filter(candidates)
+            if not allowed:
+                self._raise_over_budget(candidates)
+            best = max(allowed, key=lambda c: (
+                self._fits_budget(c) is True, self._within_default(c, 'audio'),
+                c['preferred'], c['abr'], -(c['bytes'] or 0)
+            ))
+            reason = f"纯音频 {best['abr']:.0f}kbps，{_format_size(best['bytes'])}"
+            if best['preferred']:
+                reason += "，编码可直接流复制"
+            return self._finish(best, "音频", reason)
+
+        progressive = [fmt for fmt in formats if _has_audio(fmt)]
+        candidates = [self._candidate([fmt], duration) for fmt in progressive]
+        if not candidates:
+            return None
+        allowed = self._budget_filter(candidates)
+        if not allowed:
+            self._raise_over_budget(candidates)
+        best = min(allowed, key=lambda c: (self._fits_budget(c) is not True, c['bytes'] or float('inf')))
+        return self._finish(best, "音频", f"没有纯音频格式，选择体积最小的 {_describe(best)}")
+
+    def _choose(self, candidates: List[Dict], kind: str) -> Dict:
+        """按预算、目标分辨率、默认体积上限、是否渐进式和预估体积选择视频候选"""
+        allowed = self._budget_filter(candidates)
+        if not allowed:
+            self._raise_over_budget(candidates)
+
+        reasons = []
+        if self.max_height:
+            within = [c for c in allowed if (c['height'] or 0) <= self.max_height]
+            if within:
+                allowed = within
+                reasons.append(f"目标分辨率≤{self.max_height}p")
+        if self.min_height:
+            within = [c for c in allowed if not c['height'] or c['height'] >= self.min_height]
+            if within:
+                allowed = within
+
+        def size_rank(c: Dict) -> float:
+            # 体积未知的候选排在体积已知的后面
+            if self.prefer_smallest:
+                return -(c['bytes'] or float('inf'))
+            return c['bytes'] or 0
+
+        best = max(allowed, key=lambda c: (
+            self._fits_budget(c) is True,
+            self._within_default(c, 'video'),
+            c['progressive'],
+            size_rank(c),
+            c['height'] or 0,
+        ))
+        if best['progressive'] and any(not c['progressive'] for c in allowed):
+            reasons.append("优先渐进式，无需合并")
+        elif not best['progressive']:
+            reasons.append("没有合适的渐进式格式，选择分离流")
+        reasons.append("优先体积最小的格式" if self.prefer_smallest else "选择预算内体积最大的格式")
+        if not self._within_default(best, 'video'):
+            reasons.append(f"没有默认上限{_format_size(self.default_max_bytes['video'])}内的格式")
+        if self._fits_budget(best) is None:
+            reasons.append("体积未知，无法确认预算")
+        return self._finish(best, kind, "，".join([_describe(best)] + reasons))
+
+    def _finish(self, candidate: Dict, kind: str, reason: str) -> Dict:
+        """生成选择结果并记录日志"""
+        budget = self._budget_text()
+        if budget:
+            reason += f"（预算 {budget}）"
+        logger.info(f"{kind}格式选择: {candidate['spec']} - {reason}")
+        return {
+            'format': candidate['spec'],
+            'estimated_bytes': candidate['bytes'],
+            'height': candidate['height'],
+            'progressive': candidate['progressive'],
+            'reason': reason,
+        }
+
+    def _raise_over_budget(self, candidates: List[Dict]):
+        """所有候选都超出预算"""
+        smallest = min((c['bytes'] for c in candidates if c['bytes']), default=None)
+        message = f"没有满足预算（{self._budget_text()}）的格式"
+        if smallest:
+            message += f"，最小的格式{_format_size(smallest)}"
+        raise FormatBudgetError(message)
@@ -0,0 +1,173 @@
+"""
+分片并发控制
+按平台自适应调整 HLS/DASH 分片下载的并发数，被限流时降低、稳定时逐步提高
+"""
+
+import logging
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# 各平台分片并发的初始值和上下限（B站对单IP并发敏感，上限较低）
+DEFAULT_FRAGMENT_LIMITS = {
+    'bilibili': {'initial': 4, 'min': 1, 'max': 8},
+    'youtube': {'initial': 4, 'min': 1, 'max': 16},
+    'tiktok': {'initial': 2, 'min': 1, 'max': 4},
+    'xiaohongshu': {'initial': 2, 'min': 1, 'max': 4},
+    'generic': {'initial': 4, 'min': 1, 'max': 16},
+}
+
+# 分片下载中表示被限流或源站拒绝的错误
+THROTTLE_PATTERN = re.compile(
+    r'HTTP Error (429|403|503)|Too Many Requests|rate.?limit|fragment not found|giving up after',
+    re.IGNORECASE
+)
+
+class FragmentConcurrencyController:
+    """
+    按平台自适应调整分片并发数（HLS/DASH）
+
+    每次分片下载结束后根据实测吞吐和限流错误调整：
+    - 出现限流错误：并发减半，并把上限压到触发限流的并发数以下
+    - 吞吐比上一次提升超过 gain_threshold：并发加1，继续试探
+    - 吞吐明显下降：并发减1
+    - 其他情况保持不变
+    因限流压低的上限在连续 probe_after 次无限流后放宽1，重新试探。
+    """
+
+    def __init__(self, limits: Optional[Dict[str, Dict]] = None, gain_threshold: float = 0.1,
+                 probe_after: int = 10):
+        """
+        初始化控制器
+
+        Args:
+            limits: 各平台的 initial/min/max 配置
+            gain_threshold: 判定吞吐提升或下降的相对幅度
+            probe_after: 限流后连续多少次正常下载才放宽上限
+        """
+        self.limits = {**DEFAULT_FRAGMENT_LIMITS, **(limits or {})}
+        self.gain_threshold = gain_threshold
+        self.probe_after = probe_after
+        self.current: Dict[str, int] = {}
+        # 因限流压低的并发上限和此后连续正常的次数
+        self.ceiling: Dict[str, int] = {}
+        self.clean_samples: Dict[str, int] = {}
+        # 上一次样本：平台 -> (并发数, 吞吐 字节/秒)
+        self.last_sample: Dict[str, tuple] = {}
+        self.stats: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _limits_for(self, platform: str) -> Dict:
+        return self.limits.get(platform) or self.limits['generic']
+
+    def get(self, platform: str) -> int:
+        """当前应使用的分片并发数"""
+        with self._lock:
+            return self.current.get(platform, self._limits_for(platform)['initial'])
+
+    def record(self, platform: str, concurrency: int, total_bytes: int, seconds: float, throttled: bool):
+        """
+        记录一次分片下载的结果并调整并发数
+
+        Args:
+            platform: 平台
+            concurrency: 本次使用的并发数
+            total_bytes: 下载字节数
+            seconds: 耗时（秒）
+            throttled: 是否出现限流错误
+        """
+        limits = self._limits_for(platform)
+        throughput = total_bytes / seconds if seconds > 0 else 0
+        with self._lock:
+            current = self.current.get(platform, limits['initial'])
+            last = self.last_sample.get(platform)
+            if throttled:
+                self.ceiling[platform] = max(limits['min'], concurrency - 1)
+                self.clean_samples[platform] = 0
+            elif platform in self.ceiling:
+                self.clean_samples[platform] += 1
+                if self.clean_samples[platform] >= self.probe_after:
+                    self.clean_samples[platform] = 0
+                    self.ceiling[platform] += 1
+                    if self.ceiling[platform] >= limits['max']:
+                        del self.ceiling[platform]
+            upper = min(limits['max'], self.ceiling.get(platform, limits['max']))
+            
+            if throttled:
+                new = max(limits['min'], min(current // 2, upper))
+            elif last is None or throughput > last[1] * (1 + self.gain_threshold):
+                new = min(upper, current + 1)
+            elif throughput < last[1] * (1 - self.gain_threshold):
+                new = max(limits['min'], current - 1)
+            else:
+                new = current
+            self.current[platform] = new
+            if throttled:
+                # 被限流的样本吞吐没有参考价值，下次重新建立基准
+                self.last_sample.pop(platform, None)
+            else:
+                self.last_sample[platform] = (concurrency, throughput)
+            stats = self.stats.setdefault(platform, {'samples': 0, 'throttled': 0})
+            stats['samples'] += 1
+            stats['throttled'] += int(throttled)
+            stats['last_throughput'] = round(throughput)
+        if new != current:
+            logger.info(f"{platform} 分片并发 {current} -> {new}（吞吐 {throughput / 1024 / 1024:.2f} MB/s{'，被限流' if throttled else ''}）")
+
+    def get_stats(self) -> Dict:
+        """获取各平台当前并发数和统计"""
+        with self._lock:
+            return {
+                platform: {
+                    **stats,
+                    'concurrency': self.current.get(platform),
+                    'ceiling': self.ceiling.get(platform)
+                }
+                for platform, stats in self.stats.items()
+            }
+
+class FragmentDownloadMonitor:
+    """
+    单次下载的分片统计，同时作为 yt-dlp 的 logger 和 progress_hook
+
+    只有分片下载（进度中带 fragment_index）才会作为样本上报给控制器
+    """
+
+    def __init__(self):
+        self.fragmented = False
+        self.throttled = False
+        self.total_bytes = 0
+        self.started_at = time.monotonic()
+        self.seconds = 0.0
+
+    def progress_hook(self, d: dict):
+        if d.get('status') == 'downloading' and d.get('fragment_index') is not None:
+            self.fragmented = True
+        elif d.get('status') == 'finished':
+            self.total_bytes += d.get('downloaded_bytes') or d.get('total_bytes') or 0
+            self.seconds = time.monotonic() - self.started_at
+
+    def _check(self, message: str):
+        if THROTTLE_PATTERN.search(message):
+            self.throttled = True
+
+    # yt-dlp logger 接口
+    def debug(self, message: str):
+        self._check(message)
+
+    def info(self, message: str):
+        self._check(message)
+
+    def warning(self, message: str):
+        self._check(message)
+        logger.warning(message)
+
+    def error(self, message: str):
+        self._check(message)
+        logger.error(message)
+
+# 进程内共享的控制器（进程池模式下每个工作进程各自学习）
+fragment_controller = FragmentConcurrencyController()
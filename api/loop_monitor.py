@@ -0,0 +1,61 @@
+"""
+事件循环延迟监控
+定期测量 asyncio.sleep 的实际唤醒延迟，用于确认事件循环没有被阻塞
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """事件循环延迟监控器"""
+    
+    def __init__(self, interval: float = 0.5, window: int = 240):
+        """
+        初始化监控器
+        
+        Args:
+            interval: 采样间隔(秒)
+            window: 保留的采样点数量
+        """
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+        self.is_running = False
+    
+    async def start(self):
+        """启动监控循环"""
+        self.is_running = True
+        loop = asyncio.get_running_loop()
+        while self.is_running:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            self.samples.append(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if lag > 1.0:
+                logger.warning(f"⚠️ 事件循环阻塞 {lag * 1000:.0f}ms")
+    
+    def stop(self):
+        """停止监控"""
+        self.is_running = False
+    
+    def get_stats(self) -> Dict:
+        """获取延迟统计（毫秒）"""
+        if not self.samples:
+            return {'samples': 0, 'current_ms': 0, 'avg_ms': 0, 'p99_ms': 0, 'max_ms': 0}
+        
+        ordered = sorted(self.samples)
+        p99 = ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)]
+        return {
+            'samples': len(ordered),
+            'current_ms': round(self.samples[-1] * 1000, 2),
+            'avg_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+            'p99_ms': round(p99 * 1000, 2),
+            'max_ms': round(self.max_lag * 1000, 2),
+        }
@@ -1,19 +1,35 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import StreamingResponse
 import os
+import time
 import asyncio
 import logging
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, List, Tuple
 import uuid
-import json
+import psutil
 import re
 import yaml
-from datetime import datetime
+from datetime import datetime, timedelta
 from pydantic import BaseModel
 
-from .video_processor import VideoProcessor
+from .video_processor import VideoProcessor, AUDIO_FORMATS, plan_audio_output
+from .executors import BoundedExecutor, StagePool
+from .download_errors import DownloadFailure, classify_error
+from .format_selector import FormatBudgetError
+from .circuit_breaker import PlatformCircuitBreaker, CircuitOpenError, IGNORED_CATEGORIES
+from .loop_monitor import LoopLagMonitor
+from .result_cache import ResultCache
+from .metadata_cache import MetadataCache
+from .task_store import TaskStore, TaskPersistenceWriter
+from .task_index import TaskIndex
+from .scheduler import DownloadScheduler
+from .execution import create_execution_engine
+from .task_events import TaskEventBroker
+from .streaming import TeeStream
+from .file_response import build_file_response, compute_etag, stat_etag
+from .fragment_controller import fragment_controller
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -29,10 +45,37 @@ app = FastAPI(
 async def startup_event():
     """应用启动事件"""
     logger.info("🚀 视频下载API服务启动")
+    # 启动下载执行引擎
+    execution_engine.start()
+    # 启动事件循环延迟监控
+    asyncio.create_task(loop_monitor.start())
+    # 清理超过保留时间的任务记录
+    prune_finished_tasks()
+    if SHARED_STATE:
+        # 清理已退出进程遗留的去重登记，并开始处理跨进程取消请求
+        task_store.clear_stale_inflight(_is_process_alive)
+        asyncio.create_task(_watch_cancel_requests())
+        logger.info(f"多工作进程模式: 共 {API_WORKERS} 个工作进程，当前进程 {WORKER_ID}")
+    # 恢复上次运行时被中断的任务
+    recover_interrupted_tasks()
+    # 启动任务状态的后台批量写入
+    asyncio.create_task(task_writer.start())
+    # 启动视频信息缓存的定期持久化
+    asyncio.create_task(metadata_cache.start_persist_service())
     # 启动文件清理服务
     if file_cleaner is not None:
         asyncio.create_task(file_cleaner.start_cleanup_service())
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """应用关闭事件"""
+    execution_engine.shutdown()
+    await task_writer.stop()
+    metadata_cache.save()
+    result_cache.close()
+    task_store.close()
+    logger.info("👋 视频下载API服务关闭")
+
 # CORS中间件配置
 app.add_middleware(
     CORSMiddleware,
@@ -49,12 +92,87 @@ PROJECT_ROOT = Path(__file__).parent.parent
 TEMP_DIR = PROJECT_ROOT / "temp"
 TEMP_DIR.mkdir(exist_ok=True)
 
+# 同时需要视频和音频时只从源站拉取一次（设置 SINGLE_FETCH=0 恢复并行双下载）
+SINGLE_FETCH = os.getenv("SINGLE_FETCH", "1") != "0"
+
+# 字节级进度的最小上报间隔（秒），避免下载进度频繁写入任务存储
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 0.5))
+
+# 下载失败的重试：只有网络、限流、源站5xx等临时错误才重试，按指数退避加随机抖动等待
+DOWNLOAD_RETRY_ATTEMPTS = int(os.getenv("DOWNLOAD_RETRY_ATTEMPTS", 2))
+DOWNLOAD_RETRY_BASE_DELAY = float(os.getenv("DOWNLOAD_RETRY_BASE_DELAY", 2))
+DOWNLOAD_RETRY_MAX_DELAY = float(os.getenv("DOWNLOAD_RETRY_MAX_DELAY", 30))
+
+# 下载执行引擎：thread 在API进程内执行，process 在独立工作进程池中执行（可利用多核）
+execution_engine = create_execution_engine(
+    os.getenv("EXECUTION_BACKEND", "thread"),
+    processor_opts={
+        "single_fetch": SINGLE_FETCH,
+        "progress_interval": PROGRESS_INTERVAL,
+        "retry_attempts": DOWNLOAD_RETRY_ATTEMPTS,
+        "retry_base_delay": DOWNLOAD_RETRY_BASE_DELAY,
+        "retry_max_delay": DOWNLOAD_RETRY_MAX_DELAY
+    },
+    pool_size=int(os.getenv("WORKER_PROCESSES", 0)) or None,
+    max_jobs_per_worker=int(os.getenv("WORKER_MAX_JOBS", 20)),
+    isolation=os.getenv("WORKER_ISOLATION", "pool")
+)
+
+# 视频信息提取在独立线程池中执行，限制并发并设置超时，避免阻塞事件循环
+info_executor = BoundedExecutor(
+    "video-info",
+    max_workers=int(os.getenv("INFO_MAX_WORKERS", 4)),
+    timeout=float(os.getenv("INFO_TIMEOUT", 60))
+)
+loop_monitor = LoopLagMonitor()
+
+# 处理流水线：提取信息 → 拉取（下载调度器，按网络限流）→ 音频流复制（磁盘IO）或转码（CPU）→ 定稿（计算ETag），
+# 各阶段并发上限相互独立，下载不会占着名额等转码，转码也不会排在下载后面
+remux_pool = StagePool("remux", int(os.getenv("REMUX_MAX_WORKERS", 4)))
+transcode_pool = StagePool("transcode", int(os.getenv("TRANSCODE_MAX_WORKERS", 0)) or os.cpu_count() or 2)
+finalize_executor = BoundedExecutor("finalize", max_workers=int(os.getenv("FINALIZE_MAX_WORKERS", 2)))
+
+def _parse_platform_limits(value: str) -> Dict[str, int]:
+    """解析平台并发配置，格式如 bilibili=2,youtube=4"""
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            platform, limit = item.split("=", 1)
+            limits[platform.strip()] = int(limit)
+    return limits
+
+# 下载调度器：全局并发上限 + 各平台并发上限 + 优先级队列
+scheduler = DownloadScheduler({
+    'max_concurrent': int(os.getenv("MAX_CONCURRENT_DOWNLOADS", 4)),
+    'platform_limits': _parse_platform_limits(
+        os.getenv("PLATFORM_CONCURRENCY", "bilibili=2,youtube=4,tiktok=2,xiaohongshu=2")
+    ),
+    'initial_avg_duration': 60.0,
+})
+
+# 平台熔断：某个平台最近的任务失败率过高时，新任务直接失败，冷却后放行少量试探任务
+circuit_breaker = PlatformCircuitBreaker(
+    window=int(os.getenv("CIRCUIT_WINDOW", 20)),
+    min_samples=int(os.getenv("CIRCUIT_MIN_SAMPLES", 5)),
+    failure_threshold=float(os.getenv("CIRCUIT_FAILURE_RATE", 0.5)),
+    open_seconds=float(os.getenv("CIRCUIT_OPEN_SECONDS", 60)),
+    half_open_probes=int(os.getenv("CIRCUIT_HALF_OPEN_PROBES", 2))
+)
+
 # cookies管理器已移除，抖音等平台暂时不支持
 
+# 下载结果缓存：相同媒体和选项的重复请求直接复用已下载的文件
+result_cache = ResultCache(TEMP_DIR / ".cache.db", TEMP_DIR)
+
+# 视频信息缓存：前端预览链接时的重复查询直接从缓存返回
+metadata_cache = MetadataCache(TEMP_DIR / ".metadata_cache.json")
+
 # 初始化文件清理管理器
 try:
     from .file_cleaner import FileCleanerManager
     file_cleaner = FileCleanerManager(TEMP_DIR)
+    # 文件被清理后同步失效缓存条目
+    file_cleaner.add_delete_callback(result_cache.invalidate_file)
 except ImportError as e:
     logger.warning(f"文件清理管理器导入失败: {e}，禁用文件清理功能")
     file_cleaner = None
@@ -68,10 +186,33 @@ class ProcessVideoRequest(BaseModel):
     url: str
     extract_audio: bool = True
     keep_video: bool = True
+    priority: int = 0  # 排队优先级，数值越大越先执行
+    audio_format: str = "auto"  # 音频格式：auto/m4a/ogg/webm/mp3，auto 尽量流复制不转码
+    audio_bitrate: Optional[int] = None  # 转码码率(kbps)，指定时总是转码
+    max_filesize_mb: Optional[float] = None  # 下载大小预算(MB)，只选择预算内的格式
+    max_bitrate_kbps: Optional[int] = None  # 下载码率预算(kbps)，适合带宽受限的客户端
+
+class BatchProcessRequest(BaseModel):
+    urls: List[str] = []  # 视频链接列表
+    playlist_url: Optional[str] = None  # 播放列表链接，平铺展开后逐个处理
+    extract_audio: bool = True
+    keep_video: bool = True
+    priority: int = 0
+    max_items: Optional[int] = None  # 最多处理的视频数
+    audio_format: str = "auto"
+    audio_bitrate: Optional[int] = None
+    max_filesize_mb: Optional[float] = None
+    max_bitrate_kbps: Optional[int] = None
+
+class BatchProcessResponse(BaseModel):
+    batch_id: str
+    task_ids: List[str]
+    message: str
+    status_url: str
 
 class TaskStatusResponse(BaseModel):
     task_id: str
-    status: str  # processing, completed, error
+    status: str  # processing, queued, completed, error
     progress: int
     message: str
     created_at: str
@@ -79,40 +220,149 @@ class TaskStatusResponse(BaseModel):
     files: Optional[Dict[str, str]] = None  # 文件类型到下载链接的映射
     video_info: Optional[Dict] = None
     error: Optional[str] = None
+    queue_position: Optional[int] = None  # 排队中时的位置（从1开始）
+    estimated_wait_seconds: Optional[float] = None  # 预计排队等待时间
+    progress_detail: Optional[Dict] = None  # 当前阶段的字节进度、速度和剩余时间
+    selected_formats: Optional[Dict] = None  # 选中的下载格式、预估体积和选择原因
+    failures: Optional[List[Dict]] = None  # 各次下载失败的阶段、原因分类和是否可重试
+    version: int = 0  # 任务状态版本号，每次变化递增
 
 class ProcessVideoResponse(BaseModel):
     task_id: str
     message: str
     status_url: str
 
-# 存储任务状态
-import threading
+# 存储任务状态：SQLite(WAL)按任务增量写入，启动时从数据库恢复
+task_store = TaskStore(TEMP_DIR / ".tasks.db", legacy_file=TEMP_DIR / "tasks.json")
+if file_cleaner is not None:
+    file_cleaner.add_delete_callback(task_store.delete_file_meta)
 
-TASKS_FILE = TEMP_DIR / "tasks.json"
-tasks_lock = threading.Lock()
+# 多工作进程模式（start.py --workers N）：任务状态、去重和取消通过共享的SQLite在进程间同步
+API_WORKERS = int(os.getenv("API_WORKERS", 1))
+SHARED_STATE = API_WORKERS > 1
+WORKER_ID = os.getpid()
 
-def load_tasks():
-    """加载任务状态"""
+def _is_process_alive(pid: int) -> bool:
+    """判断进程是否仍在运行"""
     try:
-        if TASKS_FILE.exists():
-            with open(TASKS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-    except:
-        pass
-    return {}
+        return psutil.pid_exists(pid)
+    except Exception:
+        return True
 
-def save_tasks(tasks_data):
-    """保存任务状态"""
-    try:
-        with tasks_lock:
-            with open(TASKS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(tasks_data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"保存任务状态失败: {e}")
+def save_task(task_id: str):
+    """标记任务状态需要保存，由后台写入器合并后批量写入"""
+    task_writer.mark_dirty(task_id)
 
 # 启动时加载任务状态
-tasks = load_tasks()
-processing_urls = set()
+tasks = task_store.load_all()
+
+# 后台持久化写入器，刷新间隔可通过 TASK_FLUSH_INTERVAL 配置(秒)
+task_writer = TaskPersistenceWriter(
+    task_store, tasks, flush_interval=float(os.getenv("TASK_FLUSH_INTERVAL", 0.5))
+)
+
+# 任务的时间序索引和状态计数，用于 /api/tasks 分页
+task_index = TaskIndex()
+for _task_id, _task in tasks.items():
+    task_index.add(_task_id, _task)
+
+# 任务状态推送（SSE / WebSocket）的进程内发布订阅
+task_events = TaskEventBroker()
+
+# 任务结束状态，到达后状态推送流关闭
+FINISHED_STATUSES = ("completed", "error")
+
+# 已结束任务的保留时间，默认与文件清理服务的文件保留时间一致
+TASK_RETENTION_HOURS = float(os.getenv(
+    "TASK_RETENTION_HOURS",
+    file_cleaner.config.get('file_retention_hours', 24) if file_cleaner is not None else 24
+))
+
+async def add_task(task_id: str, task: Dict):
+    """登记新任务"""
+    task["owner"] = WORKER_ID
+    task["version"] = 1
+    tasks[task_id] = task
+    task_index.add(task_id, task)
+    save_task(task_id)
+    if SHARED_STATE:
+        # 返回前写入（在线程中执行），客户端下一次请求可能落在其他工作进程上
+        await task_writer.flush()
+
+async def get_task(task_id: str) -> Optional[Dict]:
+    """
+    获取任务状态
+    
+    本进程创建的任务以内存为准；多工作进程模式下其他进程的任务从共享存储读取（在线程中执行）
+    """
+    task = tasks.get(task_id)
+    if not SHARED_STATE:
+        return task
+    if task is not None and task.get("owner") == WORKER_ID:
+        return task
+    return await asyncio.to_thread(task_store.get, task_id)
+
+def update_task(task_id: str, fields: Dict):
+    """更新任务状态并同步索引、持久化和推送（任务已被删除时忽略）"""
+    task = tasks.get(task_id)
+    if task is None:
+        return
+    task.update(fields)
+    # 单调递增的版本号，用于长轮询和ETag
+    task["version"] = task.get("version", 0) + 1
+    if "status" in fields:
+        task_index.update(task_id, task)
+    save_task(task_id)
+    if SHARED_STATE and "status" in fields:
+        # 状态变化不等刷新间隔立即在线程中写入，其他工作进程的状态查询/推送不会长时间读到旧状态
+        task_writer.request_flush()
+    _publish_task(task_id, task)
+
+def remove_task(task_id: str):
+    """删除任务记录"""
+    tasks.pop(task_id, None)
+    task_index.remove(task_id)
+    save_task(task_id)
+    task_events.close(task_id)
+
+def _publish_task(task_id: str, task: Dict):
+    """向状态订阅者推送最新状态（只序列化一次），任务结束后关闭订阅"""
+    if not task_events.has_subscribers(task_id):
+        return
+    task_events.publish(task_id, build_status_response(task_id, task).model_dump_json())
+    if task.get("status") in FINISHED_STATUSES:
+        task_events.close(task_id)
+
+def prune_finished_tasks() -> int:
+    """清理超过保留时间的已结束任务，返回清理数量"""
+    cutoff = (datetime.now() - timedelta(hours=TASK_RETENTION_HOURS)).isoformat()
+    expired = [
+        task_id for task_id, task in tasks.items()
+        if task.get("status") in FINISHED_STATUSES
+        and (task.get("completed_at") or task.get("created_at") or "") < cutoff
+    ]
+    for task_id in expired:
+        remove_task(task_id)
+    if SHARED_STATE:
+        # 其他工作进程创建的任务不在本进程内存中，直接在共享存储中清理
+        task_store.delete_finished_before(cutoff)
+    task_store.delete_batches_before(cutoff)
+    if expired:
+        logger.info(f"🗑️ 已清理 {len(expired)} 个过期任务记录")
+    return len(expired)
+
+# 服务重启后恢复中断的任务（设置 RESUME_INTERRUPTED_TASKS=0 时直接标记为失败）
+RESUME_INTERRUPTED_TASKS = os.getenv("RESUME_INTERRUPTED_TASKS", "1") != "0"
+
+# 同一任务最多恢复的次数，避免导致进程崩溃的任务在每次重启后反复执行
+RESUME_MAX_ATTEMPTS = int(os.getenv("RESUME_MAX_ATTEMPTS", 3))
+
+# 任务记录随文件清理服务一起清理
+if file_cleaner is not None:
+    file_cleaner.add_cleanup_callback(prune_finished_tasks)
+
+# 去重索引：规范化URL+处理选项 -> 正在处理的任务ID
+processing_urls: Dict[str, str] = {}
 active_tasks = {}
 
 def _sanitize_filename(title: str) -> str:
@@ -135,7 +385,13 @@ async def read_root():
         "description": "简单的视频下载和音频提取API服务",
         "endpoints": {
             "process": "POST /api/process - 处理视频链接",
+            "info": "GET /api/info?url= - 获取视频信息（带缓存）",
             "status": "GET /api/status/{task_id} - 查询任务状态",
+            "status_events": "GET /api/status/{task_id}/events - 推送任务状态（SSE）",
+            "status_ws": "WS /api/status/{task_id}/ws - 推送任务状态（WebSocket）",
+            "batch": "POST /api/process/batch - 批量处理视频链接或播放列表",
+            "batch_status": "GET /api/batch/{batch_id} - 查询批量任务汇总进度",
+            "stream": "GET /api/stream?url=&type=video|audio - 边下载边发送",
             "download": "GET /api/download/{file_id} - 下载文件",
             "health": "GET /api/health - 健康检查"
         },
@@ -145,14 +401,101 @@ async def read_root():
 @app.get("/api/health")
 async def health_check():
     """健康检查接口"""
+    open_platforms = circuit_breaker.open_platforms()
     return {
-        "status": "healthy",
+        "status": "degraded" if open_platforms else "healthy",
         "timestamp": datetime.now().isoformat(),
         "services": {
             "video_processor": "available"
+        },
+        "circuit_breaker": circuit_breaker.get_stats(),
+        "metrics": {
+            "loop_lag": loop_monitor.get_stats(),
+            "result_cache": result_cache.get_stats(),
+            "metadata_cache": metadata_cache.get_stats(),
+            "task_persistence": task_writer.get_stats(),
+            "scheduler": scheduler.get_stats(),
+            "execution": execution_engine.get_stats(),
+            "info_extraction": info_executor.get_stats(),
+            "pipeline": {
+                "remux": remux_pool.get_stats(),
+                "transcode": transcode_pool.get_stats(),
+                "finalize": finalize_executor.get_stats()
+            },
+            "status_streams": task_events.get_stats(),
+            "fragment_concurrency": fragment_controller.get_stats()
         }
     }
 
+def _release_dedupe_key(task_id: str, dedupe_key: Optional[str]):
+    """任务结束后从去重索引中移除（只移除仍指向该任务的条目）"""
+    if dedupe_key and processing_urls.get(dedupe_key) == task_id:
+        del processing_urls[dedupe_key]
+    if dedupe_key and SHARED_STATE:
+        # 只释放仍属于该任务的登记，在线程中执行，不等待结果
+        asyncio.get_running_loop().run_in_executor(None, task_store.release_inflight, dedupe_key, task_id)
+
+async def _get_url_key(url: str) -> str:
+    """计算URL的规范化键，短链接先在线程池中解析跳转（解析结果有缓存，命中时不请求网络）"""
+    processor = VideoProcessor()
+    if not processor.is_short_url(url):
+        return processor.get_canonical_url(url)
+    
+    url_key = metadata_cache.get_short_link(url)
+    if url_key is not None:
+        return url_key
+    try:
+        resolved = await info_executor.run(processor.resolve_short_url, url)
+    except TimeoutError:
+        logger.warning(f"短链接解析超时: {url}")
+        return processor.get_canonical_url(url)
+    url_key = processor.get_canonical_url(resolved)
+    if resolved != url:
+        # 解析失败时返回原地址，不缓存，下次重新解析
+        metadata_cache.put_short_link(url, url_key)
+    return url_key
+
+async def _get_cached_video_info(processor: VideoProcessor, url: str,
+                                 url_key: Optional[str]) -> Tuple[Dict, bool]:
+    """
+    优先从缓存获取视频信息，未命中时在线程池中提取并写入缓存
+    
+    Returns:
+        (视频信息, 是否命中缓存)
+    """
+    if url_key:
+        video_info = metadata_cache.get(url_key)
+        if video_info is not None:
+            return video_info, True
+    
+    try:
+        video_info = await info_executor.run(processor.get_video_info, url)
+    except TimeoutError as e:
+        raise Exception(f"获取视频信息失败: {e}")
+    
+    if url_key:
+        metadata_cache.put(url_key, video_info)
+    return video_info, False
+
+@app.get("/api/info")
+async def get_info(url: str):
+    """
+    获取视频信息（优先从缓存返回）
+    
+    Args:
+        url: 视频链接
+        
+    Returns:
+        视频信息和是否命中缓存
+    """
+    url_key = await _get_url_key(url)
+    try:
+        video_info, cached = await _get_cached_video_info(VideoProcessor(), url, url_key)
+    except Exception as e:
+        logger.error(f"获取视频信息失败: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"url": url, "url_key": url_key, "cached": cached, "video_info": video_info}
+
 @app.post("/api/process", response_model=ProcessVideoResponse)
 async def process_video(request: ProcessVideoRequest):
     """
@@ -164,47 +507,20 @@ async def process_video(request: ProcessVideoRequest):
     Returns:
         ProcessVideoResponse: 包含任务ID和状态查询URL
     """
+    _validate_audio_options(request.audio_format, request.audio_bitrate)
+    _validate_budget(request.max_filesize_mb, request.max_bitrate_kbps)
     try:
-        # 检查是否已经在处理相同的URL
-        if request.url in processing_urls:
-            # 查找现有任务
-            for tid, task in tasks.items():
-                if task.get("url") == request.url:
-                    return ProcessVideoResponse(
-                        task_id=tid,
-                        message="该视频正在处理中，请等待...",
-                        status_url=f"/api/status/{tid}"
-                    )
-            
-        # 生成唯一任务ID
-        task_id = str(uuid.uuid4())
-        
-        # 标记URL为正在处理
-        processing_urls.add(request.url)
-        
-        # 初始化任务状态
-        tasks[task_id] = {
-            "status": "processing",
-            "progress": 0,
-            "message": "开始处理视频...",
-            "created_at": datetime.now().isoformat(),
-            "url": request.url,
-            "extract_audio": request.extract_audio,
-            "keep_video": request.keep_video,
-            "files": {},
-            "video_info": {},
-            "error": None
-        }
-        save_tasks(tasks)
-        
-        # 创建并跟踪异步任务
-        task = asyncio.create_task(process_video_task(
-            task_id, 
-            request.url, 
-            request.extract_audio,
-            request.keep_video
-        ))
-        active_tasks[task_id] = task
+        task_id, created = await _submit_task(
+            request.url, request.extract_audio, request.keep_video, request.priority,
+            audio_format=request.audio_format, audio_bitrate=request.audio_bitrate,
+            max_filesize_mb=request.max_filesize_mb, max_bitrate_kbps=request.max_bitrate_kbps
+        )
+        if not created:
+            return ProcessVideoResponse(
+                task_id=task_id,
+                message="该视频正在处理中，请等待...",
+                status_url=f"/api/status/{task_id}"
+            )
         
         return ProcessVideoResponse(
             task_id=task_id,
@@ -216,41 +532,432 @@ async def process_video(request: ProcessVideoRequest):
         logger.error(f"处理视频时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
 
-async def process_video_task(task_id: str, url: str, extract_audio: bool = True, keep_video: bool = True):
+def _validate_audio_options(audio_format: str, audio_bitrate: Optional[int]):
+    """校验音频格式和码率"""
+    if audio_format not in AUDIO_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的音频格式: {audio_format}，可选 {', '.join(AUDIO_FORMATS)}"
+        )
+    if audio_bitrate is not None and not 32 <= audio_bitrate <= 320:
+        raise HTTPException(status_code=400, detail="音频码率需在 32-320 kbps 之间")
+
+def _validate_budget(max_filesize_mb: Optional[float], max_bitrate_kbps: Optional[int]):
+    """校验下载大小和码率预算"""
+    if max_filesize_mb is not None and max_filesize_mb <= 0:
+        raise HTTPException(status_code=400, detail="max_filesize_mb 必须大于0")
+    if max_bitrate_kbps is not None and max_bitrate_kbps <= 0:
+        raise HTTPException(status_code=400, detail="max_bitrate_kbps 必须大于0")
+
+async def _submit_task(
+    url: str,
+    extract_audio: bool,
+    keep_video: bool,
+    priority: int = 0,
+    batch_id: Optional[str] = None,
+    audio_format: str = "auto",
+    audio_bitrate: Optional[int] = None,
+    max_filesize_mb: Optional[float] = None,
+    max_bitrate_kbps: Optional[int] = None
+) -> Tuple[str, bool]:
+    """
+    创建处理任务，相同视频、相同选项正在处理时加入已有任务
+    
+    Returns:
+        (任务ID, 是否新建)
+    """
+    # 不提取音频时音频选项没有意义，统一后再去重
+    if not extract_audio:
+        audio_format, audio_bitrate = "auto", None
+    
+    # 规范化URL，同一视频的不同写法（短链接、分享参数等）视为同一个任务
+    url_key = await _get_url_key(url)
+    dedupe_key = f"{url_key}|audio={extract_audio}|video={keep_video}"
+    if extract_audio:
+        dedupe_key += f"|format={audio_format}|bitrate={audio_bitrate}"
+    if max_filesize_mb or max_bitrate_kbps:
+        dedupe_key += f"|max_mb={max_filesize_mb}|max_kbps={max_bitrate_kbps}"
+    
+    # 检查是否已经在处理相同的视频
+    existing_task_id = processing_urls.get(dedupe_key)
+    if existing_task_id in tasks:
+        return existing_task_id, False
+        
+    # 生成唯一任务ID
+    task_id = str(uuid.uuid4())
+    
+    # 多工作进程模式下在共享存储中原子登记，其他进程正在处理时直接加入
+    if SHARED_STATE:
+        owner_task_id = await asyncio.to_thread(task_store.claim_inflight, dedupe_key, task_id, WORKER_ID)
+        if owner_task_id != task_id:
+            return owner_task_id, False
+    
+    # 标记URL为正在处理
+    processing_urls[dedupe_key] = task_id
+    
+    # 初始化任务状态
+    await add_task(task_id, {
+        "status": "processing",
+        "progress": 0,
+        "message": "开始处理视频...",
+        "created_at": datetime.now().isoformat(),
+        "url": url,
+        "url_key": url_key,
+        "dedupe_key": dedupe_key,
+        "extract_audio": extract_audio,
+        "keep_video": keep_video,
+        "audio_format": audio_format,
+        "audio_bitrate": audio_bitrate,
+        "max_filesize_mb": max_filesize_mb,
+        "max_bitrate_kbps": max_bitrate_kbps,
+        "priority": priority,
+        "batch_id": batch_id,
+        "files": {},
+        "video_info": {},
+        "error": None
+    })
+    
+    # 创建并跟踪异步任务
+    active_tasks[task_id] = asyncio.create_task(process_video_task(
+        task_id, 
+        url, 
+        extract_audio,
+        keep_video,
+        audio_format,
+        audio_bitrate,
+        max_filesize_mb,
+        max_bitrate_kbps
+    ))
+    return task_id, True
+
+# 单个批量任务最多包含的视频数
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 500))
+
+@app.post("/api/process/batch", response_model=BatchProcessResponse)
+async def process_batch(request: BatchProcessRequest):
+    """
+    批量处理视频链接和/或播放列表
+    
+    播放列表通过一次平铺提取展开为视频链接，每个视频作为子任务进入下载队列，
+    通过 /api/batch/{batch_id} 查询汇总进度和结果
+    
+    Args:
+        request: 视频链接列表、播放列表链接和处理选项
+        
+    Returns:
+        BatchProcessResponse: 批量任务ID和子任务ID列表
+    """
+    if not request.urls and not request.playlist_url:
+        raise HTTPException(status_code=400, detail="请提供 urls 或 playlist_url")
+    _validate_audio_options(request.audio_format, request.audio_bitrate)
+    _validate_budget(request.max_filesize_mb, request.max_bitrate_kbps)
+    if request.max_items is not None and request.max_items < 1:
+        raise HTTPException(status_code=400, detail="max_items 必须大于0")
+    
+    max_items = min(request.max_items or BATCH_MAX_ITEMS, BATCH_MAX_ITEMS)
+    urls = list(dict.fromkeys(request.urls))
+    playlist_title = None
+    
+    if request.playlist_url:
+        try:
+            processor = VideoProcessor(single_fetch=SINGLE_FETCH)
+            playlist_title, entry_urls = await info_executor.run(
+                processor.expand_playlist, request.playlist_url, max_items
+            )
+        except Exception as e:
+            logger.error(f"展开播放列表失败: {e}")
+            raise HTTPException(status_code=400, detail=f"展开播放列表失败: {str(e)}")
+        urls.extend(url for url in entry_urls if url not in urls)
+    
+    urls = urls[:max_items]
+    batch_id = str(uuid.uuid4())
+    
+    task_ids = []
+    created_ids = []
+    try:
+        for url in urls:
+            task_id, created = await _submit_task(
+                url, request.extract_audio, request.keep_video, request.priority, batch_id,
+                request.audio_format, request.audio_bitrate,
+                request.max_filesize_mb, request.max_bitrate_kbps
+            )
+            task_ids.append(task_id)
+            if created:
+                created_ids.append(task_id)
+    except Exception as e:
+        logger.error(f"创建批量任务时出错: {str(e)}")
+        # 回滚已创建的子任务，避免留下没有批量记录的任务（加入的已有任务不受影响）
+        for task_id in created_ids:
+            _cancel_local_task(task_id)
+        raise HTTPException(status_code=500, detail=f"处理失败: {str(e)}")
+    
+    task_store.put_batch(batch_id, {
+        "created_at": datetime.now().isoformat(),
+        "playlist_url": request.playlist_url,
+        "playlist_title": playlist_title,
+        "extract_audio": request.extract_audio,
+        "keep_video": request.keep_video,
+        "audio_format": request.audio_format,
+        "audio_bitrate": request.audio_bitrate,
+        "max_filesize_mb": request.max_filesize_mb,
+        "max_bitrate_kbps": request.max_bitrate_kbps,
+        "task_ids": task_ids
+    })
+    logger.info(f"批量任务 {batch_id}: {len(task_ids)} 个视频")
+    
+    return BatchProcessResponse(
+        batch_id=batch_id,
+        task_ids=task_ids,
+        message=f"批量任务已创建，共 {len(task_ids)} 个视频",
+        status_url=f"/api/batch/{batch_id}"
+    )
+
+@app.get("/api/batch/{batch_id}")
+async def get_batch_status(batch_id: str):
+    """
+    获取批量任务的汇总进度和结果列表
+    
+    Args:
+        batch_id: 批量任务ID
+    """
+    batch = await asyncio.to_thread(task_store.get_batch, batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="批量任务不存在")
+    
+    items = []
+    status_counts: Dict[str, int] = {}
+    total_progress = 0
+    for task_id in batch["task_ids"]:
+        task = await get_task(task_id)
+        if task is None:
+            # 子任务已被取消或超过保留时间被清理
+            status = "removed"
+            items.append({"task_id": task_id, "status": status})
+        else:
+            status = task["status"]
+            total_progress += 100 if status in FINISHED_STATUSES else task.get("progress", 0)
+            items.append({
+                "task_id": task_id,
+                "url": task.get("url"),
+                "status": status,
+                "progress": task.get("progress", 0),
+                "title": (task.get("video_info") or {}).get("title"),
+                "files": task.get("files") or {},
+                "error": task.get("error")
+            })
+        status_counts[status] = status_counts.get(status, 0) + 1
+    
+    total = len(batch["task_ids"])
+    active = total - sum(status_counts.get(s, 0) for s in (*FINISHED_STATUSES, "removed"))
+    if active:
+        status = "processing"
+    elif status_counts.get("completed", 0) == total:
+        status = "completed"
+    elif status_counts.get("completed", 0):
+        status = "partial"
+    else:
+        status = "error"
+    
+    return {
+        "batch_id": batch_id,
+        "status": status,
+        "progress": int(total_progress / total) if total else 100,
+        "created_at": batch.get("created_at"),
+        "playlist_url": batch.get("playlist_url"),
+        "playlist_title": batch.get("playlist_title"),
+        "total": total,
+        "status_counts": status_counts,
+        "items": items
+    }
+
+# 处理阶段对应的状态消息
+STAGE_MESSAGES = {
+    "download_video": "正在下载视频...",
+    "download_audio": "正在下载音频...",
+    "extract_audio": "正在从视频中提取音频...",
+    "postprocess": "正在合并处理文件...",
+}
+
+# 各阶段在总进度中所占的区间（百分比）
+STAGE_PROGRESS = {
+    "download_video": (20, 85),
+    "download_audio": (20, 85),
+    "postprocess": (85, 88),
+    "extract_audio": (88, 98),
+}
+
+def _on_task_progress(task_id: str, data: Dict):
+    """执行引擎上报的进度（在事件循环线程中调用，处理器端已节流）"""
+    task = tasks.get(task_id)
+    if task is None:
+        return
+    stage = data.get("stage")
+    fields = {"progress_detail": data}
+    
+    message = STAGE_MESSAGES.get(stage)
+    if message:
+        fields["message"] = message
+    
+    # 按阶段内完成比例换算总进度，只增不减
+    low, high = STAGE_PROGRESS.get(stage, (0, 0))
+    done = data.get("downloaded_bytes") if "downloaded_bytes" in data else data.get("processed_seconds")
+    total = data.get("total_bytes") if "downloaded_bytes" in data else data.get("total_seconds")
+    progress = low
+    if done is not None and total:
+        progress = low + int((high - low) * min(done / total, 1.0))
+    if progress > task.get("progress", 0):
+        fields["progress"] = progress
+    
+    update_task(task_id, fields)
+
+async def process_video_task(
+    task_id: str,
+    url: str,
+    extract_audio: bool = True,
+    keep_video: bool = True,
+    audio_format: str = "auto",
+    audio_bitrate: Optional[int] = None,
+    max_filesize_mb: Optional[float] = None,
+    max_bitrate_kbps: Optional[int] = None
+):
     """
     异步处理视频任务
     """
+    dedupe_key = tasks[task_id].get("dedupe_key")
+    # 已通过熔断检查、结束时需要记录样本或归还试探名额的平台
+    probe = None
+    # 访问源站（提取信息和下载）的累计耗时，作为平台的耗时样本
+    origin_seconds = 0.0
     try:
         # 创建专用的VideoProcessor
-        video_processor = VideoProcessor()
+        video_processor = VideoProcessor(single_fetch=SINGLE_FETCH)
+        
+        platform = video_processor._get_platform_from_url(url)
         logger.info(f"任务 {task_id}: 开始处理视频")
         
         # 更新状态：获取视频信息
-        tasks[task_id].update({
+        update_task(task_id, {
             "status": "processing",
             "progress": 10,
             "message": "正在获取视频信息..."
         })
-        save_tasks(tasks)
         
-        # 获取视频信息
-        video_info = video_processor.get_video_info(url)
-        tasks[task_id]["video_info"] = video_info
+        # 获取视频信息（提取结果缓存在处理器中，后续下载阶段直接复用）
+        url_key = tasks[task_id].get("url_key")
+        video_info = metadata_cache.get(url_key) if url_key else None
+        if video_info is None:
+            # 第一次访问源站前检查熔断：平台熔断中直接失败，不再提取信息和走下载回退流程
+            probe = _allow_platform(platform)
+            started = time.monotonic()
+            video_info, _ = await _get_cached_video_info(video_processor, url, url_key)
+            origin_seconds += time.monotonic() - started
+        update_task(task_id, {"video_info": video_info})
         
-        # 更新状态：开始下载
-        tasks[task_id].update({
-            "progress": 20,
-            "message": "正在下载视频..."
+        # 相同媒体、相同选项已下载过且文件仍在时直接复用
+        cache_key = result_cache.make_key(video_info, {
+            "extract_audio": extract_audio,
+            "keep_video": keep_video,
+            "audio_format": audio_format,
+            "audio_bitrate": audio_bitrate,
+            "max_filesize_mb": max_filesize_mb,
+            "max_bitrate_kbps": max_bitrate_kbps
         })
-        save_tasks(tasks)
-        
-        # 下载视频和提取音频
-        result_files = await video_processor.download_video_and_audio(
-            url, 
-            TEMP_DIR, 
-            extract_audio=extract_audio,
-            keep_video=keep_video
-        )
+        cached = result_cache.get(cache_key)
+        if cached:
+            update_task(task_id, {
+                "status": "completed",
+                "progress": 100,
+                "message": "处理完成（命中缓存）！",
+                "completed_at": datetime.now().isoformat(),
+                "files": {
+                    file_type: f"/api/download/{filename}"
+                    for file_type, filename in cached["files"].items()
+                },
+                "file_etags": await _finalize_files(cached["files"]),
+                "cache_hit": True
+            })
+            logger.info(f"任务 {task_id}: 命中结果缓存")
+            return
+        
+        # 提取阶段：下载前提取一次完整信息供拉取阶段复用（视频信息来自缓存时才会真正请求），不占用下载名额
+        if probe is None:
+            probe = _allow_platform(platform)
+        started = time.monotonic()
+        raw_info = await info_executor.run(video_processor.extract_info, url)
+        origin_seconds += time.monotonic() - started
+        
+        priority = tasks[task_id].get("priority", 0)
+        progress_callback = lambda data: _on_task_progress(task_id, data)
+        unique_id = _file_prefix(task_id)
+        download_stats = {"fetches": 0, "bytes_downloaded": 0}
+        
+        # 拉取阶段：排队等待下载名额（全局和平台并发上限），下载结束立即归还
+        async with scheduler.slot(
+            task_id,
+            platform,
+            priority,
+            on_wait=lambda: update_task(task_id, {
+                "status": "queued",
+                "message": "排队等待下载..."
+            })
+        ):
+            # 更新状态：开始下载
+            update_task(task_id, {
+                "status": "processing",
+                "progress": 20,
+                "message": "正在下载视频..."
+            })
+            
+            started = time.monotonic()
+            job = await execution_engine.run("fetch_media", {
+                "url": url,
+                "output_dir": TEMP_DIR,
+                "extract_audio": extract_audio,
+                "keep_video": keep_video,
+                "info": raw_info,
+                "unique_id": unique_id,
+                "audio_format": audio_format,
+                "max_filesize_mb": max_filesize_mb,
+                "max_bitrate_kbps": max_bitrate_kbps
+            }, progress_callback=progress_callback)
+        origin_seconds += time.monotonic() - started
+        fetched = job["result"]
+        _add_download_stats(download_stats, job["download_stats"])
+        failures = list(fetched["download_failures"])
+        if fetched["format_choices"]:
+            update_task(task_id, {"selected_formats": fetched["format_choices"]})
+        
+        result_files = {}
+        if fetched["video"]:
+            result_files["video"] = fetched["video"]
+        
+        if fetched["audio_source"]:
+            audio_file = await _run_audio_stage(task_id, fetched, audio_format, audio_bitrate)
+            if audio_file is None and fetched["audio_from_video"] and not fetched["raw_audio_tried"]:
+                # 本地提取失败（视频无音轨或缺少FFmpeg），回到拉取阶段单独下载音频
+                logger.warning(f"任务 {task_id}: 从视频提取音频失败，回退到单独下载音频")
+                async with scheduler.slot(task_id, platform, priority):
+                    job = await execution_engine.run("fetch_audio_source", {
+                        "url": url,
+                        "output_dir": TEMP_DIR,
+                        "unique_id": fetched["unique_id"],
+                        "info": raw_info,
+                        "audio_format": audio_format,
+                        "max_filesize_mb": max_filesize_mb,
+                        "max_bitrate_kbps": max_bitrate_kbps
+                    }, progress_callback=progress_callback)
+                _add_download_stats(download_stats, job["download_stats"])
+                failures.extend(job["result"]["download_failures"])
+                if job["result"]["audio_source"]:
+                    audio_file = await _run_audio_stage(
+                        task_id, {**fetched, **job["result"], "discard_source": True},
+                        audio_format, audio_bitrate
+                    )
+            if audio_file:
+                result_files["audio"] = audio_file
+        
+        if not result_files:
+            raise Exception("没有成功下载任何文件")
         
         # 生成下载链接
         file_links = {}
@@ -272,56 +979,270 @@ async def process_video_task(task_id: str, url: str, extract_audio: bool = True,
                     logger.warning(f"重命名文件失败: {e}")
                     file_links[file_type] = f"/api/download/{filename}"
         
+        # 计算文件的强ETag（只在定稿时计算一次），记录到结果缓存
+        final_files = {file_type: link.rsplit("/", 1)[-1] for file_type, link in file_links.items()}
+        file_etags = await _finalize_files(final_files)
+        result_cache.put(cache_key, final_files, video_info)
+        
         # 更新状态：完成
-        tasks[task_id].update({
+        update_task(task_id, {
             "status": "completed",
             "progress": 100,
             "message": "处理完成！",
             "completed_at": datetime.now().isoformat(),
-            "files": file_links
+            "files": file_links,
+            "file_etags": file_etags,
+            "download_stats": download_stats,
+            "failures": failures or None
         })
-        save_tasks(tasks)
+        circuit_breaker.record(probe, True, origin_seconds)
+        probe = None
         logger.info(f"任务完成: {task_id}")
-        
-        # 从处理列表中移除URL
-        processing_urls.discard(url)
-        
-        # 从活跃任务列表中移除
-        if task_id in active_tasks:
-            del active_tasks[task_id]
             
     except Exception as e:
         logger.error(f"任务 {task_id} 处理失败: {str(e)}")
-        # 从处理列表中移除URL
-        processing_urls.discard(url)
-        
-        # 从活跃任务列表中移除
-        if task_id in active_tasks:
-            del active_tasks[task_id]
-            
-        tasks[task_id].update({
+        fields = {
             "status": "error",
             "error": str(e),
             "message": f"处理失败: {str(e)}",
             "completed_at": datetime.now().isoformat()
+        }
+        if isinstance(e, DownloadFailure):
+            fields["failures"] = e.failures
+            fields["error_category"] = e.category
+        elif isinstance(e, CircuitOpenError):
+            fields["error_category"] = "circuit_open"
+        elif isinstance(e, FormatBudgetError):
+            fields["error_category"] = "over_budget"
+        else:
+            fields["error_category"] = classify_error(e)["category"]
+        update_task(task_id, fields)
+        # 视频本身的错误（不存在、地区限制等）不代表平台异常，不计入熔断统计
+        if probe is not None and fields["error_category"] not in IGNORED_CATEGORIES:
+            circuit_breaker.record(probe, False, origin_seconds)
+            probe = None
+    
+    finally:
+        # 没有产生熔断样本（取消、视频本身的错误）时归还半开状态的试探名额
+        if probe is not None:
+            circuit_breaker.release(probe)
+        
+        # 从去重索引中移除
+        _release_dedupe_key(task_id, dedupe_key)
+        
+        # 从活跃任务列表中移除
+        active_tasks.pop(task_id, None)
+
+def _add_download_stats(total: Dict, stats: Dict):
+    """累加各阶段的下载统计"""
+    for key, value in stats.items():
+        total[key] = total.get(key, 0) + value
+
+async def _run_audio_stage(task_id: str, fetched: Dict, audio_format: str,
+                           audio_bitrate: Optional[int]) -> Optional[str]:
+    """
+    音频提取阶段：按是否需要转码进入流复制或转码阶段池，再交给执行引擎执行
+    
+    Args:
+        task_id: 任务ID
+        fetched: 拉取阶段的结果（fetch_media 的返回值）
+        audio_format: 音频输出格式
+        audio_bitrate: 转码码率
+        
+    Returns:
+        音频文件路径，失败返回None
+    """
+    _, codec_args = plan_audio_output(fetched["audio_codec"], audio_format, audio_bitrate)
+    pool = remux_pool if codec_args[-1] == "copy" else transcode_pool
+    async with pool.slot(on_wait=lambda: update_task(task_id, {"message": "排队等待音频处理..."})):
+        job = await execution_engine.run("extract_audio", {
+            "source": fetched["audio_source"],
+            "output_dir": TEMP_DIR,
+            "unique_id": fetched["unique_id"],
+            "audio_format": audio_format,
+            "audio_bitrate": audio_bitrate,
+            "codec": fetched["audio_codec"],
+            "delete_source": fetched["discard_source"]
+        }, progress_callback=lambda data: _on_task_progress(task_id, data))
+    return job["result"]
+
+def _file_prefix(task_id: str) -> str:
+    """任务下载文件的前缀，由任务ID确定，重启后据此找回未完成的 .part 文件继续下载"""
+    return task_id.replace("-", "")[:8]
+
+def _discard_partial_files(task_id: str):
+    """删除任务未完成的中间文件（.part、分片状态文件和未合并的分离流）"""
+    prefix = _file_prefix(task_id)
+    for pattern in (f"video_{prefix}*", f"audio_{prefix}*"):
+        for path in TEMP_DIR.glob(pattern):
+            try:
+                path.unlink()
+            except OSError as e:
+                logger.warning(f"删除中间文件失败 {path.name}: {e}")
+
+def recover_interrupted_tasks() -> Dict[str, int]:
+    """
+    恢复上次运行时被中断的任务（启动时调用）
+    
+    未结束的任务重新登记去重并排队执行，文件名前缀由任务ID确定，
+    yt-dlp 会从已有的 .part 文件继续下载；无法恢复的任务标记为失败。
+    多工作进程模式下只接管所属进程已退出的任务，每个任务只由一个进程接管。
+    
+    Returns:
+        恢复和标记失败的任务数
+    """
+    resumed = failed = 0
+    interrupted = [
+        task_id for task_id, task in tasks.items()
+        if task.get("status") not in FINISHED_STATUSES
+    ]
+    for task_id in interrupted:
+        if SHARED_STATE:
+            task = task_store.claim_orphaned_task(task_id, WORKER_ID, _is_process_alive)
+            if task is None:
+                continue
+            tasks[task_id] = task
+        task = tasks[task_id]
+        task["owner"] = WORKER_ID
+        resume_count = task.get("resume_count", 0)
+        
+        reason = None
+        if not RESUME_INTERRUPTED_TASKS:
+            reason = "服务重启，任务已中断"
+        elif not task.get("url"):
+            reason = "任务记录不完整，无法恢复"
+        elif resume_count >= RESUME_MAX_ATTEMPTS:
+            reason = f"任务已中断 {resume_count + 1} 次，不再自动恢复"
+        
+        if reason:
+            _discard_partial_files(task_id)
+            update_task(task_id, {
+                "status": "error",
+                "error": reason,
+                "message": f"处理失败: {reason}",
+                "progress_detail": None,
+                "completed_at": datetime.now().isoformat()
+            })
+            failed += 1
+            continue
+        
+        dedupe_key = task.get("dedupe_key")
+        if dedupe_key:
+            processing_urls[dedupe_key] = task_id
+            if SHARED_STATE:
+                task_store.claim_inflight(dedupe_key, task_id, WORKER_ID)
+        update_task(task_id, {
+            "status": "queued",
+            "progress": 0,
+            "message": "服务重启，任务已恢复，等待继续处理...",
+            "progress_detail": None,
+            "resume_count": resume_count + 1
         })
-        save_tasks(tasks)
+        active_tasks[task_id] = asyncio.create_task(process_video_task(
+            task_id,
+            task["url"],
+            task.get("extract_audio", True),
+            task.get("keep_video", True),
+            task.get("audio_format", "auto"),
+            task.get("audio_bitrate"),
+            task.get("max_filesize_mb"),
+            task.get("max_bitrate_kbps")
+        ))
+        resumed += 1
+    
+    if resumed or failed:
+        logger.info(f"♻️ 恢复中断任务: {resumed} 个重新执行，{failed} 个标记为失败")
+    return {"resumed": resumed, "failed": failed}
 
 @app.get("/api/status/{task_id}", response_model=TaskStatusResponse)
-async def get_task_status(task_id: str):
+async def get_task_status(
+    task_id: str,
+    request: Request,
+    response: Response,
+    wait: float = Query(0, ge=0, le=60, description="长轮询：最多等待的秒数"),
+    since: Optional[int] = Query(None, description="长轮询：客户端已有的版本号，版本变化后立即返回")
+):
     """
     获取任务处理状态
     
+    带 wait 和 since 时进行长轮询：任务版本仍等于 since 时最多阻塞 wait 秒，
+    期间状态变化立即返回。响应带ETag，If-None-Match 匹配时返回304。
+    
     Args:
         task_id: 任务ID
+        wait: 长轮询等待秒数
+        since: 客户端已有的版本号
         
     Returns:
         TaskStatusResponse: 任务状态信息
     """
-    if task_id not in tasks:
+    task = await get_task(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="任务不存在")
     
-    task = tasks[task_id]
+    if wait > 0 and since is not None and task.get("version", 0) == since \
+            and task.get("status") not in FINISHED_STATUSES:
+        await _wait_task_version(task_id, since, wait)
+        task = await get_task(task_id)
+        if task is None:
+            raise HTTPException(status_code=404, detail="任务不存在")
+    
+    status_response = build_status_response(task_id, task)
+    etag = _status_etag(status_response)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = _parse_if_none_match(request.headers.get("if-none-match"))
+    if etag in if_none_match or "*" in if_none_match:
+        return Response(status_code=304, headers=headers)
+    
+    response.headers.update(headers)
+    return status_response
+
+def _status_etag(status_response: TaskStatusResponse) -> str:
+    """由版本号生成ETag；排队位置不改变版本号，排队中时一并计入"""
+    etag = f"v{status_response.version}"
+    if status_response.queue_position is not None:
+        etag += f"-q{status_response.queue_position}"
+    return f'W/"{etag}"'
+
+def _parse_if_none_match(header: Optional[str]) -> set:
+    """解析 If-None-Match 头，弱比较时 W/ 前缀不影响匹配"""
+    if not header:
+        return set()
+    tags = set()
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            tags.add(tag)
+            continue
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tags.add(f"W/{tag}")
+    return tags
+
+async def _wait_task_version(task_id: str, since: int, timeout: float):
+    """等待任务版本号变化，超时或任务被删除时返回"""
+    task = await get_task(task_id)
+    if SHARED_STATE and task is not None and task.get("owner") != WORKER_ID:
+        # 其他工作进程的任务：轮询共享存储
+        deadline = asyncio.get_running_loop().time() + timeout
+        while asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.5)
+            task = await asyncio.to_thread(task_store.get, task_id)
+            if task is None or task.get("version", 0) != since:
+                return
+        return
+    
+    # 本进程的任务：订阅状态推送，update_task 发布新版本时被唤醒
+    queue = task_events.subscribe(task_id)
+    try:
+        await asyncio.wait_for(queue.get(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        task_events.unsubscribe(task_id, queue)
+
+def build_status_response(task_id: str, task: Dict) -> TaskStatusResponse:
+    """由任务记录构造状态响应"""
     return TaskStatusResponse(
         task_id=task_id,
         status=task["status"],
@@ -331,50 +1252,363 @@ async def get_task_status(task_id: str):
         completed_at=task.get("completed_at"),
         files=task.get("files", {}),
         video_info=task.get("video_info", {}),
-        error=task.get("error")
+        error=task.get("error"),
+        queue_position=scheduler.get_position(task_id),
+        estimated_wait_seconds=scheduler.estimate_wait(task_id),
+        progress_detail=task.get("progress_detail"),
+        selected_formats=task.get("selected_formats"),
+        failures=task.get("failures"),
+        version=task.get("version", 0)
     )
 
-@app.get("/api/download/{file_id}")
-async def download_file(file_id: str):
+async def _iter_task_status(task_id: str, keepalive: float = 15.0):
+    """
+    依次产出任务状态的JSON字符串，任务结束或被删除后停止
+    
+    空闲超过 keepalive 秒时产出 None，供调用方发送心跳。
+    本进程的任务通过发布订阅推送；多工作进程模式下其他进程的任务轮询共享存储。
+    """
+    task = await get_task(task_id)
+    if task is None:
+        return
+    
+    if SHARED_STATE and task.get("owner") != WORKER_ID:
+        last_message = None
+        idle = 0.0
+        while task is not None:
+            message = build_status_response(task_id, task).model_dump_json()
+            if message != last_message:
+                yield message
+                last_message = message
+                idle = 0.0
+            elif idle >= keepalive:
+                yield None
+                idle = 0.0
+            if task.get("status") in FINISHED_STATUSES:
+                return
+            await asyncio.sleep(1.0)
+            idle += 1.0
+            task = await asyncio.to_thread(task_store.get, task_id)
+        return
+    
+    # 先订阅再发送当前状态，两者之间没有await，不会漏掉更新
+    queue = task_events.subscribe(task_id)
+    try:
+        yield build_status_response(task_id, task).model_dump_json()
+        if task.get("status") in FINISHED_STATUSES:
+            return
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if message is None:
+                return
+            yield message
+    finally:
+        task_events.unsubscribe(task_id, queue)
+
+@app.get("/api/status/{task_id}/events")
+async def stream_task_status(task_id: str):
+    """
+    以Server-Sent Events推送任务状态
+    
+    每次状态或进度变化推送一条 status 事件，任务完成或失败后关闭连接
+    """
+    if await get_task(task_id) is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    async def event_stream():
+        async for message in _iter_task_status(task_id):
+            if message is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: status\ndata: {message}\n\n"
+        yield "event: end\ndata: {}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.websocket("/api/status/{task_id}/ws")
+async def websocket_task_status(websocket: WebSocket, task_id: str):
+    """以WebSocket推送任务状态，任务完成或失败后关闭连接"""
+    if await get_task(task_id) is None:
+        await websocket.close(code=4404, reason="任务不存在")
+        return
+    
+    await websocket.accept()
+    try:
+        async for message in _iter_task_status(task_id):
+            if message is not None:
+                await websocket.send_text(message)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+def _guess_media_type(filename: str) -> str:
+    """根据文件扩展名确定媒体类型"""
+    ext = Path(filename).suffix.lower()
+    if ext in ['.mp4', '.avi', '.mkv', '.mov', '.wmv']:
+        return "video/mp4"
+    elif ext == '.webm':
+        return "audio/webm" if filename.startswith("audio_") else "video/webm"
+    elif ext in ['.ogg', '.opus']:
+        return "audio/ogg"
+    elif ext in ['.m4a', '.aac']:
+        return "audio/mp4"
+    elif ext == '.mka':
+        return "audio/x-matroska"
+    elif ext in ['.mp3', '.wav', '.flac']:
+        return "audio/mpeg"
+    return "application/octet-stream"
+
+def _content_disposition(filename: str) -> str:
+    """生成下载文件名头（处理中文文件名编码问题）"""
+    import urllib.parse
+    encoded_filename = urllib.parse.quote(filename.encode('utf-8'))
+    return f"attachment; filename*=UTF-8''{encoded_filename}"
+
+# 进行中的流式下载（缓存键 -> 文件流），同一媒体的并发请求共用一次下载
+active_streams: Dict[str, TeeStream] = {}
+
+@app.get("/api/stream")
+async def stream_media(
+    request: Request,
+    url: str = Query(..., description="视频链接"),
+    type: str = Query("video", pattern="^(video|audio)$", description="video 或 audio")
+):
+    """
+    边下载边发送媒体文件
+    
+    选择可直接下载的单文件格式（视频为音视频合一的渐进式格式，音频为原始音频流），
+    数据写入临时目录的同时发送给客户端，完成后登记到结果缓存，后续请求直接返回文件。
+    没有合适格式时返回422，请改用 /api/process。
+    
+    Args:
+        url: 视频链接
+        type: 流类型
+    """
+    processor = VideoProcessor(single_fetch=SINGLE_FETCH)
+    platform = processor._get_platform_from_url(url)
+    
+    # 视频信息已缓存时先查结果缓存，命中时不访问源站（平台熔断中也可以返回）
+    url_key = await _get_url_key(url)
+    cached_info = metadata_cache.get(url_key) if url_key else None
+    if cached_info is not None:
+        cached = result_cache.get(result_cache.make_key(cached_info, {"stream": type}))
+        if cached and cached["files"].get(type):
+            return await _file_response(request, cached["files"][type])
+    
+    if not circuit_breaker.allow(platform):
+        retry_after = circuit_breaker.retry_after(platform)
+        raise HTTPException(
+            status_code=503,
+            detail=f"平台 {platform} 近期失败率过高，已暂停处理，约 {retry_after:.0f} 秒后重试",
+            headers={"Retry-After": str(int(retry_after) + 1)}
+        )
+    
+    started = time.monotonic()
+    try:
+        info = await info_executor.run(processor.extract_info, url)
+    except Exception as e:
+        logger.error(f"流式下载获取视频信息失败: {e}")
+        _record_breaker_outcome(platform, classify_error(e)["category"], time.monotonic() - started)
+        raise HTTPException(status_code=400, detail=f"获取视频信息失败: {str(e)}")
+    video_info = processor.summarize_info(info, url)
+    
+    cache_key = result_cache.make_key(video_info, {"stream": type})
+    cached = result_cache.get(cache_key)
+    if cached and cached["files"].get(type):
+        circuit_breaker.release(platform)
+        return await _file_response(request, cached["files"][type])
+    
+    stream_key = cache_key or f"{url}|{type}"
+    stream = active_streams.get(stream_key)
+    if stream is not None:
+        # 加入已有的流，不产生新的源站访问
+        circuit_breaker.release(platform)
+    else:
+        fmt = processor.select_stream_format(info, type)
+        if fmt is None:
+            circuit_breaker.release(platform)
+            raise HTTPException(status_code=422, detail="该视频没有可直接流式传输的格式，请使用 /api/process")
+        
+        stream_id = uuid.uuid4().hex
+        ext = fmt.get('ext') or ('mp4' if type == 'video' else 'm4a')
+        final_name = f"{type}_{_sanitize_filename(video_info.get('title', 'video'))}_{stream_id[:6]}.{ext}"
+        # 下载中的文件以点开头，下载接口不会返回它；残留文件由文件清理服务按修改时间删除
+        stream = TeeStream(TEMP_DIR / f".stream_{stream_id}.{ext}", name=final_name)
+        active_streams[stream_key] = stream
+        asyncio.create_task(_run_stream_download(
+            processor, url, fmt, stream, f"stream-{stream_id}", platform,
+            stream_key, cache_key, type, video_info, time.monotonic() - started
+        ))
+        logger.info(f"开始流式下载: {url} ({type}, 格式 {fmt.get('format_id')})")
+    
+    headers = {"Content-Disposition": _content_disposition(stream.name)}
+    # 元数据中的 filesize 可能不准确，只有下载完成、大小确定时才发送 Content-Length，否则使用分块传输
+    if stream.done and stream.error is None:
+        headers["Content-Length"] = str(stream.written)
+    return StreamingResponse(
+        stream.iter_bytes(),
+        media_type=_guess_media_type(stream.name),
+        headers=headers
+    )
+
+async def _run_stream_download(processor: VideoProcessor, url: str, fmt: Dict, stream: TeeStream,
+                               slot_id: str, platform: str, stream_key: str, cache_key: Optional[str],
+                               file_type: str, video_info: Dict, origin_seconds: float):
+    """
+    占用下载名额执行流式下载，结束后记录平台熔断样本并登记缓存
+    
+    客户端在排队期间保持连接，文件开始写入后即可读到数据
+    """
+    loop = asyncio.get_running_loop()
+    finished = asyncio.Event()
+    
+    def on_done(result: TeeStream):
+        # 下载线程中执行：成功时改为正式文件名并计算ETag
+        temp_path = result.path
+        final_path = TEMP_DIR / result.name
+        try:
+            if result.error is None:
+                temp_path.replace(final_path)
+                result.move_to(final_path)
+                _record_file_meta(result.name)
+        except Exception as e:
+            # 文件定稿失败（磁盘错误等）按下载失败处理，删除残留的临时文件和正式文件
+            logger.error(f"流式下载文件定稿失败: {e}")
+            result.finish(f"保存文件失败: {e}")
+            temp_path.unlink(missing_ok=True)
+            final_path.unlink(missing_ok=True)
+        finally:
+            # 无论成败都要唤醒等待方，否则下载名额和流式下载记录无法释放
+            loop.call_soon_threadsafe(finished.set)
+    
+    try:
+        async with scheduler.slot(slot_id, platform):
+            started = time.monotonic()
+            stream.run(
+                lambda hook: processor.download_format(url, fmt['format_id'], stream.path, hook),
+                on_done
+            )
+            await finished.wait()
+            origin_seconds += time.monotonic() - started
+    except asyncio.CancelledError:
+        circuit_breaker.release(platform)
+        if not stream.done:
+            # 排队中被取消（服务关闭），让等待中的客户端结束
+            stream.finish("流式下载已取消")
+            active_streams.pop(stream_key, None)
+        raise
+    if stream.error is None:
+        circuit_breaker.record(platform, True, origin_seconds)
+    else:
+        _record_breaker_outcome(platform, classify_error(stream.error)["category"], origin_seconds)
+    _finish_stream(stream_key, cache_key, file_type, stream, video_info)
+
+def _allow_platform(platform: str) -> str:
+    """访问源站前检查平台熔断，放行时返回平台（结束时需要记录样本或归还），熔断中抛出 CircuitOpenError"""
+    if not circuit_breaker.allow(platform):
+        raise CircuitOpenError(
+            f"平台 {platform} 近期失败率过高，已暂停处理，"
+            f"约 {circuit_breaker.retry_after(platform):.0f} 秒后重试"
+        )
+    return platform
+
+def _record_breaker_outcome(platform: str, category: str, seconds: float):
+    """记录失败的熔断样本；视频本身的错误不计入，只归还试探名额"""
+    if category in IGNORED_CATEGORIES:
+        circuit_breaker.release(platform)
+    else:
+        circuit_breaker.record(platform, False, seconds)
+
+def _finish_stream(stream_key: str, cache_key: Optional[str], file_type: str, stream: TeeStream, video_info: Dict):
+    """流式下载结束：成功时登记结果缓存，失败时删除残留文件"""
+    active_streams.pop(stream_key, None)
+    if stream.error is None:
+        result_cache.put(cache_key, {file_type: stream.name}, video_info)
+        logger.info(f"流式下载完成: {stream.path.name}")
+    else:
+        stream.path.unlink(missing_ok=True)
+
+def _record_file_meta(filename: str) -> str:
+    """计算文件的强ETag并记录（在工作线程中调用）"""
+    path = TEMP_DIR / filename
+    etag = compute_etag(path)
+    task_store.put_file_meta(filename, etag, path.stat().st_size)
+    return etag
+
+async def _finalize_files(files: Dict[str, str]) -> Dict[str, str]:
+    """
+    文件定稿：计算各文件的强ETag，已计算过的直接复用
+    
+    Args:
+        files: 文件类型到文件名的映射
+        
+    Returns:
+        文件类型到ETag的映射
+    """
+    etags = {}
+    for file_type, filename in files.items():
+        meta = await asyncio.to_thread(task_store.get_file_meta, filename)
+        path = TEMP_DIR / filename
+        if meta and path.exists() and meta["size"] == path.stat().st_size:
+            etags[file_type] = meta["etag"]
+            continue
+        try:
+            etags[file_type] = await finalize_executor.run(_record_file_meta, filename)
+        except OSError as e:
+            logger.warning(f"计算文件ETag失败 {filename}: {e}")
+    return etags
+
+def _file_etag(filename: str, path: Path) -> str:
+    """查询文件定稿时记录的ETag，没有记录或文件已变化时由文件大小和修改时间生成（在线程中调用）"""
+    stat_result = path.stat()
+    meta = task_store.get_file_meta(filename)
+    if meta and meta["size"] == stat_result.st_size:
+        return meta["etag"]
+    return stat_etag(stat_result)
+
+async def _file_response(request: Request, filename: str):
+    """构造支持 Range、HEAD 和条件请求的文件响应"""
+    path = TEMP_DIR / filename
+    return build_file_response(
+        request,
+        path,
+        await asyncio.to_thread(_file_etag, filename, path),
+        _guess_media_type(filename),
+        headers={"Content-Disposition": _content_disposition(filename)}
+    )
+
+@app.api_route("/api/download/{file_id}", methods=["GET", "HEAD"])
+async def download_file(file_id: str, request: Request):
     """
     下载文件
     
+    支持 HEAD、单段 Range（206，多段范围返回416）、If-None-Match 和 If-Range，
+    ETag 为文件定稿时计算的内容摘要
+    
     Args:
         file_id: 文件ID（文件名）
         
     Returns:
-        FileResponse: 文件下载响应
+        文件下载响应
     """
     try:
         # 检查文件名格式（防止路径遍历攻击）
-        if '..' in file_id or '/' in file_id or '\\' in file_id:
+        if '..' in file_id or '/' in file_id or '\\' in file_id or file_id.startswith('.'):
             raise HTTPException(status_code=400, detail="文件名格式无效")
             
         file_path = TEMP_DIR / file_id
         if not file_path.exists():
             raise HTTPException(status_code=404, detail="文件不存在")
         
-        # 根据文件扩展名设置媒体类型
-        ext = file_path.suffix.lower()
-        if ext in ['.mp4', '.avi', '.mkv', '.mov', '.wmv']:
-            media_type = "video/mp4"
-        elif ext in ['.mp3', '.wav', '.m4a', '.aac', '.flac']:
-            media_type = "audio/mpeg"
-        else:
-            media_type = "application/octet-stream"
-            
-        # 处理中文文件名编码问题
-        import urllib.parse
-        encoded_filename = urllib.parse.quote(file_id.encode('utf-8'))
-        
-        return FileResponse(
-            file_path,
-            filename=file_id,
-            media_type=media_type,
-            headers={
-                "Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"
-            }
-        )
+        return await _file_response(request, file_id)
     except HTTPException:
         raise
     except Exception as e:
@@ -396,9 +1630,28 @@ async def cancel_task(task_id: str):
     Returns:
         删除确认消息
     """
-    if task_id not in tasks:
+    task = await get_task(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="任务不存在")
     
+    owner = task.get("owner", WORKER_ID)
+    if SHARED_STATE and owner != WORKER_ID:
+        if _is_process_alive(owner):
+            # 任务属于其他工作进程：登记取消请求，由该进程取消并删除
+            await asyncio.to_thread(task_store.request_cancel, task_id)
+        else:
+            # 所属进程已退出，直接清理共享存储中的记录
+            _release_dedupe_key(task_id, task.get("dedupe_key"))
+            tasks.pop(task_id, None)
+            task_index.remove(task_id)
+            await asyncio.to_thread(task_store.delete, task_id)
+        return {"message": "任务已取消并删除"}
+    
+    _cancel_local_task(task_id)
+    return {"message": "任务已取消并删除"}
+
+def _cancel_local_task(task_id: str):
+    """取消并删除本进程中的任务"""
     # 如果任务还在运行，先取消它
     if task_id in active_tasks:
         task = active_tasks[task_id]
@@ -407,15 +1660,25 @@ async def cancel_task(task_id: str):
             logger.info(f"任务 {task_id} 已被取消")
         del active_tasks[task_id]
     
-    # 从处理URL列表中移除
-    task_url = tasks[task_id].get("url")
-    if task_url:
-        processing_urls.discard(task_url)
+    # 从去重索引中移除
+    _release_dedupe_key(task_id, tasks.get(task_id, {}).get("dedupe_key"))
     
     # 删除任务记录
-    del tasks[task_id]
-    save_tasks(tasks)
-    return {"message": "任务已取消并删除"}
+    remove_task(task_id)
+
+async def _watch_cancel_requests(interval: float = 1.0):
+    """多工作进程模式下定期处理其他进程转交的取消请求"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            requested = await asyncio.to_thread(
+                task_store.pop_cancel_requests,
+                lambda tid: tasks.get(tid, {}).get("owner") == WORKER_ID
+            )
+            for task_id in requested:
+                _cancel_local_task(task_id)
+        except Exception as e:
+            logger.error(f"处理取消请求失败: {e}")
 
 @app.get("/api/storage/info")
 async def get_storage_info():
@@ -456,34 +1719,76 @@ async def manual_cleanup():
         raise HTTPException(status_code=500, detail=f"清理失败: {str(e)}")
 
 @app.get("/api/tasks")
-async def list_tasks():
+async def list_tasks(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    created_after: Optional[str] = None,
+    created_before: Optional[str] = None
+):
     """
-    获取所有任务列表
+    分页获取任务列表（按创建时间倒序）
     
+    Args:
+        limit: 每页数量
+        cursor: 上一页返回的 next_cursor
+        status: 按状态过滤（processing/completed/error）
+        created_after: 只返回此时间之后创建的任务（ISO格式）
+        created_before: 只返回此时间之前创建的任务（ISO格式）
+        
     Returns:
         任务列表和统计信息
     """
-    active_count = len(active_tasks)
-    processing_count = len(processing_urls)
+    try:
+        if SHARED_STATE:
+            # 多工作进程模式：从共享存储分页，包含其他进程创建的任务
+            page = await asyncio.to_thread(
+                task_store.page,
+                limit,
+                TaskIndex.decode_cursor(cursor) if cursor else None,
+                status,
+                created_after,
+                created_before
+            )
+            status_counts = await asyncio.to_thread(task_store.count_by_status)
+            next_cursor = None
+            if len(page) == limit:
+                last_id, last_task = page[-1]
+                next_cursor = TaskIndex.encode_cursor(last_task.get("created_at") or "", last_id)
+        else:
+            task_ids, next_cursor = task_index.page(
+                limit=limit,
+                cursor=cursor,
+                status=status,
+                created_after=created_after,
+                created_before=created_before
+            )
+            page = [(task_id, tasks[task_id]) for task_id in task_ids]
+            status_counts = task_index.get_counts()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="游标格式无效")
     
-    # 返回任务概览
+    # 返回任务概览（只包含标题，完整视频信息请查询 /api/status/{task_id}）
     task_summary = {}
-    for task_id, task in tasks.items():
+    for task_id, task in page:
         task_summary[task_id] = {
             "status": task["status"],
             "progress": task["progress"],
             "message": task["message"],
             "created_at": task.get("created_at"),
             "completed_at": task.get("completed_at"),
-            "video_info": task.get("video_info", {}),
+            "title": (task.get("video_info") or {}).get("title"),
             "files": task.get("files", {})
         }
     
     return {
-        "active_tasks": active_count,
-        "processing_urls": processing_count,
-        "total_tasks": len(tasks),
-        "tasks": task_summary
+        "active_tasks": len(active_tasks),
+        "processing_urls": len(processing_urls),
+        "total_tasks": sum(status_counts.values()),
+        "status_counts": status_counts,
+        "retention_hours": TASK_RETENTION_HOURS,
+        "tasks": task_summary,
+        "next_cursor": next_cursor
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+"""
+视频信息缓存
+按规范化URL缓存视频信息，按平台设置过期时间，超出容量时淘汰最久未使用的条目
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataCache:
+    """带TTL和LRU淘汰的持久化视频信息缓存"""
+    
+    def __init__(self, cache_file: Path, config: Dict = None):
+        """
+        初始化视频信息缓存
+        
+        Args:
+            cache_file: 持久化文件
+            config: 缓存配置
+        """
+        self.cache_file = cache_file
+        self.config = config or self._get_default_config()
+        self._lock = threading.Lock()
+        self.entries: "OrderedDict[str, Dict]" = OrderedDict()
+        # 短链接 -> (规范化键, 过期时间)，只保存在内存中，命中时不必再请求跳转
+        self.short_links: "OrderedDict[str, tuple]" = OrderedDict()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._load()
+    
+    def _get_default_config(self) -> Dict:
+        """获取默认缓存配置"""
+        return {
+            'max_entries': 5000,  # 最大条目数
+            'persist_interval': 30,  # 持久化间隔(秒)
+            'short_link_ttl': 3600,  # 短链接解析结果的过期时间(秒)
+            'ttl_seconds': {  # 各平台的过期时间(秒)
+                'youtube': 24 * 3600,
+                'bilibili': 12 * 3600,
+                'tiktok': 3600,
+                'xiaohongshu': 3600,
+                'default': 6 * 3600,
+            },
+        }
+    
+    def _get_ttl(self, key: str) -> int:
+        """按规范化键的平台前缀获取过期时间"""
+        ttl_config = self.config.get('ttl_seconds', {})
+        platform = key.split(':', 1)[0]
+        return ttl_config.get(platform, ttl_config.get('default', 6 * 3600))
+    
+    def _load(self):
+        """加载持久化的缓存，跳过已过期的条目"""
+        self.entries.update(self._read_file())
+    
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        查询缓存
+        
+        Args:
+            key: 规范化URL
+            
+        Returns:
+            视频信息，未命中或已过期返回None
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry['expires_at'] <= time.time():
+                del self.entries[key]
+                self.dirty = True
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry['video_info']
+    
+    def put(self, key: str, video_info: Dict):
+        """
+        写入缓存
+        
+        Args:
+            key: 规范化URL
+            video_info: 视频信息
+        """
+        with self._lock:
+            self.entries[key] = {
+                'video_info': video_info,
+                'expires_at': time.time() + self._get_ttl(key)
+            }
+            self.entries.move_to_end(key)
+            max_entries = self.config.get('max_entries', 5000)
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+    
+    def get_short_link(self, url: str) -> Optional[str]:
+        """查询短链接解析得到的规范化键，未命中或已过期返回None"""
+        with self._lock:
+            entry = self.short_links.get(url)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self.short_links[url]
+                return None
+            self.short_links.move_to_end(url)
+            return entry[0]
+    
+    def put_short_link(self, url: str, key: str):
+        """
+        记录短链接解析得到的规范化键
+        
+        Args:
+            url: 原始短链接
+            key: 跳转后地址的规范化键
+        """
+        with self._lock:
+            self.short_links[url] = (key, time.time() + self.config.get('short_link_ttl', 3600))
+            self.short_links.move_to_end(url)
+            max_entries = self.config.get('max_entries', 5000)
+            while len(self.short_links) > max_entries:
+                self.short_links.popitem(last=False)
+    
+    def _read_file(self) -> Dict[str, Dict]:
+        """读取持久化文件中未过期的条目"""
+        try:
+            if self.cache_file.exists():
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    now = time.time()
+                    return {
+                        key: entry for key, entry in json.load(f)
+                        if entry.get('expires_at', 0) > now
+                    }
+        except Exception as e:
+            logger.warning(f"读取视频信息缓存失败: {e}")
+        return {}
+    
+    def save(self):
+        """持久化缓存（先写临时文件再替换）"""
+        with self._lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+        
+        # 多个API工作进程共用同一个文件：先合并其他进程写入的条目，再按LRU截断
+        on_disk = self._read_file()
+        with self._lock:
+            for key, entry in on_disk.items():
+                if key not in self.entries:
+                    self.entries[key] = entry
+                    self.entries.move_to_end(key, last=False)
+            max_entries = self.config.get('max_entries', 5000)
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+            data = list(self.entries.items())
+        try:
+            tmp_file = self.cache_file.with_name(f"{self.cache_file.name}.{os.getpid()}.tmp")
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            self.dirty = True
+            logger.error(f"保存视频信息缓存失败: {e}")
+    
+    async def start_persist_service(self):
+        """定期在线程中持久化缓存"""
+        while True:
+            await asyncio.sleep(self.config.get('persist_interval', 30))
+            await asyncio.to_thread(self.save)
+    
+    def get_stats(self) -> Dict:
+        """获取缓存统计信息"""
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'short_links': len(self.short_links),
+            'max_entries': self.config.get('max_entries', 5000),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,189 @@
+"""
+下载结果缓存
+按媒体ID（extractor + id）和处理选项索引已下载的文件，重复请求直接复用
+索引保存在SQLite中，多个API工作进程共享同一份缓存
+"""
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """内容寻址的下载结果缓存"""
+    
+    def __init__(self, db_path: Path, temp_dir: Path):
+        """
+        初始化结果缓存
+        
+        Args:
+            db_path: 缓存索引的SQLite数据库文件
+            temp_dir: 缓存文件所在的临时目录
+        """
+        self.db_path = db_path
+        self.temp_dir = temp_dir
+        self._lock = threading.Lock()
+        self.conn = self._open()
+        self.hits = 0
+        self.misses = 0
+    
+    def _open(self) -> sqlite3.Connection:
+        """打开数据库连接并建表"""
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS result_cache ("
+            "cache_key TEXT PRIMARY KEY, "
+            "files TEXT NOT NULL, "
+            "video_info TEXT, "
+            "created_at TEXT)"
+        )
+        # 文件名到缓存键的反向索引，文件被删除时据此失效缓存
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS result_files ("
+            "filename TEXT NOT NULL, "
+            "cache_key TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_result_files ON result_files(filename)")
+        return conn
+    
+    @staticmethod
+    def make_key(video_info: Dict, options: Dict) -> Optional[str]:
+        """
+        生成缓存键
+        
+        Args:
+            video_info: 视频信息（需要包含 extractor 和 id）
+            options: 影响输出文件的处理选项
+            
+        Returns:
+            缓存键，无法确定媒体ID时返回None
+        """
+        extractor = (video_info or {}).get('extractor')
+        media_id = (video_info or {}).get('id')
+        if not extractor or not media_id:
+            return None
+        opts = ",".join(f"{k}={options[k]}" for k in sorted(options))
+        return f"{extractor.lower()}:{media_id}|{opts}"
+    
+    def _delete_key(self, key: str):
+        """删除缓存条目（调用方持有锁）"""
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM result_cache WHERE cache_key = ?", (key,))
+            self.conn.execute("DELETE FROM result_files WHERE cache_key = ?", (key,))
+    
+    def get(self, key: Optional[str]) -> Optional[Dict]:
+        """
+        查询缓存
+        
+        Args:
+            key: 缓存键
+            
+        Returns:
+            缓存条目 {'files': {类型: 文件名}, ...}，未命中返回None
+        """
+        if not key:
+            return None
+        
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT files, video_info, created_at FROM result_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            
+            entry = {
+                'files': json.loads(row[0]),
+                'video_info': json.loads(row[1] or '{}'),
+                'created_at': row[2]
+            }
+            
+            # 文件可能已被清理，任何一个文件不存在都视为失效
+            paths = [self.temp_dir / name for name in entry['files'].values()]
+            if not all(p.exists() for p in paths):
+                self._delete_key(key)
+                self.misses += 1
+                return None
+            
+            # 刷新修改时间，避免热门文件被文件清理服务当作旧文件删除
+            for p in paths:
+                try:
+                    os.utime(p)
+                except OSError:
+                    pass
+            
+            self.hits += 1
+            return entry
+    
+    def put(self, key: Optional[str], files: Dict[str, str], video_info: Dict = None):
+        """
+        写入缓存
+        
+        Args:
+            key: 缓存键
+            files: 文件类型到文件名的映射
+            video_info: 视频信息
+        """
+        if not key or not files:
+            return
+        
+        with self._lock:
+            try:
+                with self.conn:
+                    self.conn.execute("BEGIN")
+                    self.conn.execute("DELETE FROM result_files WHERE cache_key = ?", (key,))
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO result_cache (cache_key, files, video_info, created_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        (
+                            key,
+                            json.dumps(files, ensure_ascii=False),
+                            json.dumps(video_info or {}, ensure_ascii=False),
+                            datetime.now().isoformat()
+                        )
+                    )
+                    self.conn.executemany(
+                        "INSERT INTO result_files (filename, cache_key) VALUES (?, ?)",
+                        [(name, key) for name in files.values()]
+                    )
+            except sqlite3.Error as e:
+                logger.error(f"保存结果缓存失败: {e}")
+    
+    def invalidate_file(self, filename: str):
+        """文件被删除时移除引用它的缓存条目"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT cache_key FROM result_files WHERE filename = ?", (filename,)
+            ).fetchall()
+            for (key,) in rows:
+                self._delete_key(key)
+            if rows:
+                logger.info(f"缓存条目已失效: {filename}")
+    
+    def get_stats(self) -> Dict:
+        """获取缓存统计信息"""
+        with self._lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self.conn.close()
@@ -0,0 +1,167 @@
+"""
+下载调度器
+限制全局和各平台的并发下载数，超出的任务按优先级和提交顺序排队
+"""
+
+import time
+import bisect
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DownloadScheduler:
+    """带全局并发上限、平台并发上限和优先级队列的调度器"""
+    
+    def __init__(self, config: Dict = None):
+        """
+        初始化调度器
+        
+        Args:
+            config: 调度配置
+        """
+        self.config = config or self._get_default_config()
+        # 等待队列：(负优先级, 序号, 任务ID, 平台)，保持有序，优先级高、提交早的在前
+        self.queue: List[Tuple[int, int, str, str]] = []
+        self.waiters: Dict[str, asyncio.Future] = {}
+        self.running: Dict[str, str] = {}  # 任务ID -> 平台
+        self.started_at: Dict[str, float] = {}
+        self.platform_running: Dict[str, int] = {}
+        self._seq = itertools.count()
+        # 任务平均耗时（指数移动平均），用于估算排队时间
+        self.avg_duration = self.config.get('initial_avg_duration', 60.0)
+        self.completed = 0
+    
+    def _get_default_config(self) -> Dict:
+        """获取默认调度配置"""
+        return {
+            'max_concurrent': 4,  # 全局最大并发下载数
+            'platform_limits': {  # 各平台最大并发数，未配置的平台只受全局上限约束
+                'bilibili': 2,
+                'youtube': 4,
+                'tiktok': 2,
+                'xiaohongshu': 2,
+            },
+            'initial_avg_duration': 60.0,  # 初始平均任务耗时(秒)
+        }
+    
+    def _platform_limit(self, platform: str) -> int:
+        """平台的并发上限"""
+        return self.config.get('platform_limits', {}).get(
+            platform, self.config.get('max_concurrent', 4)
+        )
+    
+    def _can_start(self, platform: str) -> bool:
+        """是否还有全局和平台并发名额"""
+        return (
+            len(self.running) < self.config.get('max_concurrent', 4)
+            and self.platform_running.get(platform, 0) < self._platform_limit(platform)
+        )
+    
+    def _dispatch(self):
+        """按队列顺序启动可以运行的任务，平台名额已满的任务不阻塞其他平台"""
+        pos = 0
+        while pos < len(self.queue) and len(self.running) < self.config.get('max_concurrent', 4):
+            _, _, task_id, platform = self.queue[pos]
+            if not self._can_start(platform):
+                pos += 1
+                continue
+            del self.queue[pos]
+            self.running[task_id] = platform
+            self.started_at[task_id] = time.monotonic()
+            self.platform_running[platform] = self.platform_running.get(platform, 0) + 1
+            waiter = self.waiters.pop(task_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(True)
+    
+    async def acquire(
+        self,
+        task_id: str,
+        platform: str,
+        priority: int = 0,
+        on_wait: Optional[Callable[[], None]] = None
+    ):
+        """
+        排队等待下载名额
+        
+        Args:
+            task_id: 任务ID
+            platform: 平台名（_get_platform_from_url 的结果）
+            priority: 优先级，数值越大越先执行
+            on_wait: 没有立即拿到名额、需要排队时的回调
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (-priority, next(self._seq), task_id, platform)
+        bisect.insort(self.queue, entry)
+        self.waiters[task_id] = waiter
+        self._dispatch()
+        if not waiter.done() and on_wait is not None:
+            on_wait()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # 排队中被取消：移出队列；已拿到名额：归还
+            self.waiters.pop(task_id, None)
+            if entry in self.queue:
+                self.queue.remove(entry)
+            else:
+                self.release(task_id)
+            raise
+    
+    def release(self, task_id: str):
+        """归还下载名额并启动后续任务"""
+        platform = self.running.pop(task_id, None)
+        if platform is None:
+            return
+        self.platform_running[platform] -= 1
+        duration = time.monotonic() - self.started_at.pop(task_id)
+        self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+        self.completed += 1
+        self._dispatch()
+    
+    @asynccontextmanager
+    async def slot(
+        self,
+        task_id: str,
+        platform: str,
+        priority: int = 0,
+        on_wait: Optional[Callable[[], None]] = None
+    ):
+        """以上下文管理器的方式占用下载名额"""
+        await self.acquire(task_id, platform, priority, on_wait)
+        try:
+            yield
+        finally:
+            self.release(task_id)
+    
+    def get_position(self, task_id: str) -> Optional[int]:
+        """任务在等待队列中的位置（从1开始），不在队列中返回None"""
+        for index, entry in enumerate(self.queue):
+            if entry[2] == task_id:
+                return index + 1
+        return None
+    
+    def estimate_wait(self, task_id: str) -> Optional[float]:
+        """按平均任务耗时和并发数估算剩余排队时间(秒)"""
+        position = self.get_position(task_id)
+        if position is None:
+            return None
+        platform = self.queue[position - 1][3]
+        slots = max(min(self.config.get('max_concurrent', 4), self._platform_limit(platform)), 1)
+        return round(((position - 1) // slots + 1) * self.avg_duration, 1)
+    
+    def get_stats(self) -> Dict:
+        """获取调度统计信息"""
+        return {
+            'max_concurrent': self.config.get('max_concurrent', 4),
+            'running': len(self.running),
+            'queued': len(self.queue),
+            'platform_running': {k: v for k, v in self.platform_running.items() if v},
+            'platform_limits': self.config.get('platform_limits', {}),
+            'completed': self.completed,
+            'avg_duration_seconds': round(self.avg_duration, 1),
+        }
@@ -0,0 +1,129 @@
+"""
+边下载边发送
+下载写入临时文件的同时把已写入的数据流式发送给客户端，支持多个客户端共享同一次下载
+"""
+
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import AsyncIterator, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+class TeeStream:
+    """
+    边下载边发送的文件流
+
+    下载线程把数据写入磁盘文件，客户端从同一个文件按已写入的位置跟读。
+    磁盘充当缓冲区：客户端慢时内存占用不变，下载也不会被拖慢；
+    客户端断开后下载继续完成，文件留给后续请求复用。
+    """
+
+    def __init__(self, path: Path, name: str, total_bytes: Optional[int] = None,
+                 chunk_size: int = 256 * 1024, poll_interval: float = 0.05):
+        """
+        初始化文件流
+
+        Args:
+            path: 下载中的文件路径
+            name: 下载完成后的文件名
+            total_bytes: 总大小（未知时为None）
+            chunk_size: 每次发送的最大字节数
+            poll_interval: 追上下载进度后的等待间隔（秒）
+        """
+        self.path = path
+        self.name = name
+        self.total_bytes = total_bytes
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self.written = 0
+        self.done = False
+        self.error: Optional[str] = None
+        self.readers = 0
+        self._lock = threading.Lock()
+
+    def progress_hook(self, d: dict):
+        """yt-dlp 进度回调：记录已写入磁盘的字节数（在下载线程中调用）"""
+        downloaded = d.get('downloaded_bytes')
+        if downloaded is None:
+            return
+        with self._lock:
+            self.written = max(self.written, downloaded)
+            if not self.total_bytes:
+                self.total_bytes = d.get('total_bytes')
+
+    def finish(self, error: Optional[str] = None):
+        """下载结束（在下载线程中调用）"""
+        with self._lock:
+            if error is None and self.path.exists():
+                self.written = self.path.stat().st_size
+            self.error = error
+            self.done = True
+
+    def move_to(self, path: Path):
+        """下载完成后文件被重命名，已打开的读取方不受影响"""
+        with self._lock:
+            self.path = path
+
+    async def iter_bytes(self) -> AsyncIterator[bytes]:
+        """按下载进度逐块产出文件内容，下载失败时抛出异常"""
+        self.readers += 1
+        try:
+            f = None
+            while f is None:
+                with self._lock:
+                    path, done, error = self.path, self.done, self.error
+                if error:
+                    raise IOError(error)
+                try:
+                    f = open(path, 'rb')
+                except FileNotFoundError:
+                    if done:
+                        raise IOError("下载文件不存在")
+                    await asyncio.sleep(self.poll_interval)
+
+            with f:
+                position = 0
+                while True:
+                    with self._lock:
+                        written, done, error = self.written, self.done, self.error
+                    if error:
+                        raise IOError(error)
+                    if position < written:
+                        # 已写入的字节可能还在下载方的缓冲区中，读到的可能少于预期
+                        chunk = await asyncio.to_thread(
+                            f.read, min(self.chunk_size, written - position)
+                        )
+                        if chunk:
+                            position += len(chunk)
+                            yield chunk
+                            continue
+                    elif done:
+                        return
+                    await asyncio.sleep(self.poll_interval)
+        finally:
+            self.readers -= 1
+
+    def run(self, download: Callable[[Callable[[dict], None]], None],
+            on_done: Optional[Callable[['TeeStream'], None]] = None) -> threading.Thread:
+        """
+        在后台线程中执行下载
+
+        Args:
+            download: 下载函数，参数为进度回调
+            on_done: 下载结束后的回调（在下载线程中调用）
+        """
+        def target():
+            try:
+                download(self.progress_hook)
+                self.finish()
+            except Exception as e:
+                logger.error(f"流式下载失败: {e}")
+                self.finish(str(e))
+            if on_done is not None:
+                on_done(self)
+
+        thread = threading.Thread(target=target, name=f"stream-{self.path.name}", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,87 @@
+"""
+任务状态推送
+进程内的发布/订阅，把任务状态变化推送给 SSE 和 WebSocket 订阅者
+"""
+
+import asyncio
+import logging
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+class TaskEventBroker:
+    """
+    进程内的任务状态发布/订阅
+
+    每次状态变化只序列化一次，序列化结果分发给该任务的所有订阅者（SSE、WebSocket）。
+    订阅者只关心最新状态，队列满时丢弃最旧的消息，慢速客户端不会拖住任务处理。
+    """
+
+    def __init__(self, queue_size: int = 16):
+        """
+        初始化事件代理
+
+        Args:
+            queue_size: 每个订阅者的消息队列长度
+        """
+        self.queue_size = queue_size
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.stats = {'published': 0, 'delivered': 0, 'dropped': 0}
+
+    def has_subscribers(self, task_id: str) -> bool:
+        """任务是否有订阅者（没有时发布方可以跳过序列化）"""
+        return bool(self.subscribers.get(task_id))
+
+    def subscribe(self, task_id: str) -> asyncio.Queue:
+        """订阅任务状态，返回接收消息的队列（None 表示流结束）"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(task_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        """取消订阅"""
+        queues = self.subscribers.get(task_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self.subscribers[task_id]
+
+    def publish(self, task_id: str, message: str):
+        """
+        向任务的所有订阅者分发已序列化的消息（需在事件循环线程中调用）
+
+        Args:
+            task_id: 任务ID
+            message: 已序列化的状态（JSON字符串）
+        """
+        queues = self.subscribers.get(task_id)
+        if not queues:
+            return
+        self.stats['published'] += 1
+        for queue in queues:
+            self._offer(queue, message)
+
+    def close(self, task_id: str):
+        """通知任务的所有订阅者流已结束"""
+        for queue in self.subscribers.pop(task_id, set()):
+            self._offer(queue, None)
+
+    def _offer(self, queue: asyncio.Queue, message: Optional[str]):
+        """放入消息，队列满时丢弃最旧的一条"""
+        if queue.full():
+            try:
+                queue.get_nowait()
+                self.stats['dropped'] += 1
+            except asyncio.QueueEmpty:
+                pass
+        queue.put_nowait(message)
+        self.stats['delivered'] += 1
+
+    def get_stats(self) -> Dict:
+        """获取订阅统计"""
+        return {
+            **self.stats,
+            'tasks': len(self.subscribers),
+            'subscribers': sum(len(queues) for queues in self.subscribers.values())
+        }
@@ -0,0 +1,113 @@
+"""
+任务索引
+按创建时间维护有序的任务ID列表和各状态计数，支持游标分页而不必每次遍历全部任务
+"""
+
+import base64
+import bisect
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+
+class TaskIndex:
+    """任务的时间序索引和状态计数"""
+    
+    def __init__(self):
+        """初始化空索引"""
+        self.order: List[Tuple[str, str]] = []  # (created_at, task_id)，按时间升序
+        self.status_by_task: Dict[str, str] = {}
+        self.created_by_task: Dict[str, str] = {}
+        self.status_counts: Counter = Counter()
+    
+    def add(self, task_id: str, task: Dict):
+        """加入任务"""
+        if task_id in self.status_by_task:
+            self.update(task_id, task)
+            return
+        created_at = task.get("created_at") or ""
+        bisect.insort(self.order, (created_at, task_id))
+        self.created_by_task[task_id] = created_at
+        self.status_by_task[task_id] = task.get("status")
+        self.status_counts[task.get("status")] += 1
+    
+    def update(self, task_id: str, task: Dict):
+        """任务状态变化时更新计数"""
+        old_status = self.status_by_task.get(task_id)
+        new_status = task.get("status")
+        if task_id not in self.status_by_task:
+            self.add(task_id, task)
+        elif old_status != new_status:
+            self.status_counts[old_status] -= 1
+            self.status_counts[new_status] += 1
+            self.status_by_task[task_id] = new_status
+    
+    def remove(self, task_id: str):
+        """移除任务"""
+        if task_id not in self.status_by_task:
+            return
+        created_at = self.created_by_task.pop(task_id)
+        pos = bisect.bisect_left(self.order, (created_at, task_id))
+        if pos < len(self.order) and self.order[pos] == (created_at, task_id):
+            del self.order[pos]
+        self.status_counts[self.status_by_task.pop(task_id)] -= 1
+    
+    def get_counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        return {status: count for status, count in self.status_counts.items() if count > 0}
+    
+    @staticmethod
+    def encode_cursor(created_at: str, task_id: str) -> str:
+        """生成分页游标"""
+        raw = f"{created_at}|{task_id}".encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Tuple[str, str]:
+        """解析分页游标"""
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, task_id = raw.split("|", 1)
+        return created_at, task_id
+    
+    def page(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        status: Optional[str] = None,
+        created_after: Optional[str] = None,
+        created_before: Optional[str] = None
+    ) -> Tuple[List[str], Optional[str]]:
+        """
+        按创建时间倒序分页
+        
+        Args:
+            limit: 每页数量
+            cursor: 上一页返回的游标
+            status: 只返回该状态的任务
+            created_after: 只返回此时间之后创建的任务（ISO格式）
+            created_before: 只返回此时间之前创建的任务（ISO格式）
+            
+        Returns:
+            (任务ID列表, 下一页游标)，没有更多数据时游标为None
+        """
+        # 定位起点：游标之前的位置，或 created_before 之前的位置
+        end = len(self.order)
+        if cursor:
+            end = bisect.bisect_left(self.order, self.decode_cursor(cursor))
+        if created_before:
+            end = min(end, bisect.bisect_left(self.order, (created_before, "")))
+        
+        result = []
+        pos = end - 1
+        while pos >= 0 and len(result) < limit:
+            created_at, task_id = self.order[pos]
+            if created_after and created_at <= created_after:
+                break
+            if status is None or self.status_by_task.get(task_id) == status:
+                result.append(task_id)
+            pos -= 1
+        
+        next_cursor = None
+        if len(result) == limit and pos >= 0:
+            last_id = result[-1]
+            next_cursor = self.encode_cursor(self.created_by_task[last_id], last_id)
+        return result, next_cursor
@@ -0,0 +1,486 @@
+"""
+任务存储
+使用SQLite(WAL模式)按行保存任务状态，单个任务更新只写一行，启动时从数据库恢复
+"""
+
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class TaskStore:
+    """基于SQLite的增量任务存储"""
+    
+    def __init__(self, db_path: Path, legacy_file: Optional[Path] = None):
+        """
+        初始化任务存储
+        
+        Args:
+            db_path: SQLite数据库文件
+            legacy_file: 旧版 tasks.json，存在时在首次启动时导入
+        """
+        self.db_path = db_path
+        self.legacy_file = legacy_file
+        self._lock = threading.Lock()
+        self.conn = self._connect()
+    
+    def _connect(self) -> sqlite3.Connection:
+        """打开数据库，文件损坏时备份后重建"""
+        try:
+            conn = self._open()
+            conn.execute("SELECT COUNT(*) FROM tasks").fetchone()
+            return conn
+        except sqlite3.DatabaseError as e:
+            backup = self.db_path.with_name(self.db_path.name + ".corrupt")
+            logger.error(f"任务数据库损坏，已备份到 {backup.name} 并重建: {e}")
+            for suffix in ("", "-wal", "-shm"):
+                path = Path(str(self.db_path) + suffix)
+                if path.exists():
+                    path.replace(Path(str(backup) + suffix))
+            return self._open()
+    
+    def _open(self) -> sqlite3.Connection:
+        """打开数据库连接并建表"""
+        conn = sqlite3.connect(str(self.db_path), check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # 多个API工作进程共享同一个数据库，写冲突时等待而不是立即报错
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "task_id TEXT PRIMARY KEY, "
+            "status TEXT, "
+            "created_at TEXT, "
+            "updated_at TEXT, "
+            "data TEXT NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks(created_at)")
+        # 跨进程去重：规范化键 -> 正在处理的任务
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS inflight ("
+            "dedupe_key TEXT PRIMARY KEY, "
+            "task_id TEXT NOT NULL, "
+            "owner INTEGER, "
+            "created_at TEXT)"
+        )
+        # 跨进程取消：其他工作进程提交的取消请求，由任务所在进程执行
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cancel_requests ("
+            "task_id TEXT PRIMARY KEY, "
+            "requested_at TEXT)"
+        )
+        # 批量任务：创建后不再变化，汇总进度由子任务实时计算
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS batches ("
+            "batch_id TEXT PRIMARY KEY, "
+            "created_at TEXT, "
+            "data TEXT NOT NULL)"
+        )
+        # 已定稿文件的元数据：强ETag在定稿时计算一次，下载时按文件名查询
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_meta ("
+            "filename TEXT PRIMARY KEY, "
+            "etag TEXT NOT NULL, "
+            "size INTEGER, "
+            "created_at TEXT)"
+        )
+        return conn
+    
+    def _row(self, task_id: str, task: Dict) -> Tuple:
+        """把任务转换为数据库行"""
+        return (
+            task_id,
+            task.get("status"),
+            task.get("created_at"),
+            datetime.now().isoformat(),
+            json.dumps(task, ensure_ascii=False)
+        )
+    
+    def put(self, task_id: str, task: Dict):
+        """写入或更新单个任务"""
+        self.put_many([(task_id, task)])
+    
+    def put_many(self, items: Iterable[Tuple[str, Dict]]):
+        """在一个事务中写入多个任务"""
+        self.apply_batch(dict(items))
+    
+    def delete(self, task_id: str):
+        """删除任务"""
+        self.apply_batch({task_id: None})
+    
+    def apply_batch(self, batch: Dict[str, Optional[Dict]]):
+        """
+        在一个事务中写入一批变更
+        
+        Args:
+            batch: 任务ID到任务状态的映射，值为None表示删除
+        """
+        rows = [self._row(task_id, task) for task_id, task in batch.items() if task is not None]
+        deleted = [(task_id,) for task_id, task in batch.items() if task is None]
+        if not rows and not deleted:
+            return
+        with self._lock:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                if rows:
+                    self.conn.executemany(
+                        "INSERT OR REPLACE INTO tasks (task_id, status, created_at, updated_at, data) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        rows
+                    )
+                if deleted:
+                    self.conn.executemany("DELETE FROM tasks WHERE task_id = ?", deleted)
+    
+    def get(self, task_id: str) -> Optional[Dict]:
+        """读取单个任务"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT data FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def page(
+        self,
+        limit: int = 50,
+        cursor: Optional[Tuple[str, str]] = None,
+        status: Optional[str] = None,
+        created_after: Optional[str] = None,
+        created_before: Optional[str] = None
+    ) -> List[Tuple[str, Dict]]:
+        """
+        按创建时间倒序分页查询（多进程模式下各进程共享的任务列表）
+        
+        Args:
+            limit: 每页数量
+            cursor: 上一页最后一条的 (created_at, task_id)
+            status: 只返回该状态的任务
+            created_after: 只返回此时间之后创建的任务
+            created_before: 只返回此时间之前创建的任务
+            
+        Returns:
+            [(任务ID, 任务状态)] 列表
+        """
+        conditions, params = [], []
+        if cursor:
+            conditions.append("(created_at < ? OR (created_at = ? AND task_id < ?))")
+            params.extend([cursor[0], cursor[0], cursor[1]])
+        if status:
+            conditions.append("status = ?")
+            params.append(status)
+        if created_after:
+            conditions.append("created_at > ?")
+            params.append(created_after)
+        if created_before:
+            conditions.append("created_at < ?")
+            params.append(created_before)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        params.append(limit)
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT task_id, data FROM tasks {where} "
+                "ORDER BY created_at DESC, task_id DESC LIMIT ?",
+                params
+            ).fetchall()
+        return [(task_id, json.loads(data)) for task_id, data in rows]
+    
+    def count_by_status(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        with self._lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+    
+    def delete_finished_before(self, cutoff: str) -> int:
+        """删除在指定时间之前结束的任务（没有结束时间的按创建时间，与内存中的清理规则一致）"""
+        with self._lock:
+            cursor = self.conn.execute(
+                "DELETE FROM tasks WHERE status IN ('completed', 'error') "
+                "AND COALESCE(json_extract(data, '$.completed_at'), created_at) < ?",
+                (cutoff,)
+            )
+        return cursor.rowcount
+    
+    def claim_inflight(self, dedupe_key: str, task_id: str, owner: int) -> str:
+        """
+        原子地登记正在处理的任务（跨进程去重）
+        
+        Returns:
+            实际持有该键的任务ID，与传入的 task_id 不同表示已有其他任务在处理
+        """
+        with self._lock:
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO inflight (dedupe_key, task_id, owner, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (dedupe_key, task_id, owner, datetime.now().isoformat())
+                )
+                row = self.conn.execute(
+                    "SELECT task_id FROM inflight WHERE dedupe_key = ?", (dedupe_key,)
+                ).fetchone()
+        return row[0]
+    
+    def release_inflight(self, dedupe_key: str, task_id: str):
+        """任务结束后移除去重登记"""
+        with self._lock:
+            self.conn.execute(
+                "DELETE FROM inflight WHERE dedupe_key = ? AND task_id = ?", (dedupe_key, task_id)
+            )
+    
+    def clear_stale_inflight(self, is_alive: Callable[[int], bool]) -> int:
+        """清理所属进程已退出的去重登记"""
+        with self._lock:
+            rows = self.conn.execute("SELECT DISTINCT owner FROM inflight").fetchall()
+            dead = [(owner,) for (owner,) in rows if not is_alive(owner)]
+            if dead:
+                self.conn.executemany("DELETE FROM inflight WHERE owner = ?", dead)
+        return len(dead)
+    
+    def claim_orphaned_task(self, task_id: str, owner: int, is_alive: Callable[[int], bool]) -> Optional[Dict]:
+        """
+        原子地接管所属进程已退出的未完成任务（重启后恢复任务时使用）
+        
+        Returns:
+            接管后的任务，任务已结束或仍由存活进程（包括先接管的其他进程）处理时返回None
+        """
+        with self._lock:
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                row = self.conn.execute(
+                    "SELECT data FROM tasks WHERE task_id = ?", (task_id,)
+                ).fetchone()
+                if row is None:
+                    return None
+                task = json.loads(row[0])
+                if task.get("status") in ("completed", "error"):
+                    return None
+                # 启动时才调用，记录中的 owner 等于当前进程只可能是上一次运行复用了同一个PID
+                previous = task.get("owner")
+                if previous is not None and previous != owner and is_alive(previous):
+                    return None
+                task["owner"] = owner
+                self.conn.execute(
+                    "UPDATE tasks SET data = ?, updated_at = ? WHERE task_id = ?",
+                    (json.dumps(task, ensure_ascii=False), datetime.now().isoformat(), task_id)
+                )
+        return task
+    
+    def request_cancel(self, task_id: str):
+        """登记取消请求，由任务所在的工作进程执行"""
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cancel_requests (task_id, requested_at) VALUES (?, ?)",
+                (task_id, datetime.now().isoformat())
+            )
+    
+    def pop_cancel_requests(self, owned: Callable[[str], bool]) -> List[str]:
+        """取出属于当前进程的取消请求"""
+        with self._lock:
+            rows = self.conn.execute("SELECT task_id FROM cancel_requests").fetchall()
+            mine = [(task_id,) for (task_id,) in rows if owned(task_id)]
+            if mine:
+                self.conn.executemany("DELETE FROM cancel_requests WHERE task_id = ?", mine)
+        return [task_id for (task_id,) in mine]
+    
+    def put_batch(self, batch_id: str, batch: Dict):
+        """写入批量任务"""
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO batches (batch_id, created_at, data) VALUES (?, ?, ?)",
+                (batch_id, batch.get("created_at"), json.dumps(batch, ensure_ascii=False))
+            )
+    
+    def get_batch(self, batch_id: str) -> Optional[Dict]:
+        """读取批量任务"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT data FROM batches WHERE batch_id = ?", (batch_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def delete_batches_before(self, cutoff: str) -> int:
+        """删除在指定时间之前创建的批量任务"""
+        with self._lock:
+            cursor = self.conn.execute("DELETE FROM batches WHERE created_at < ?", (cutoff,))
+        return cursor.rowcount
+    
+    def put_file_meta(self, filename: str, etag: str, size: int):
+        """记录文件的ETag和大小"""
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO file_meta (filename, etag, size, created_at) VALUES (?, ?, ?, ?)",
+                (filename, etag, size, datetime.now().isoformat())
+            )
+    
+    def get_file_meta(self, filename: str) -> Optional[Dict]:
+        """读取文件的ETag和大小"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT etag, size FROM file_meta WHERE filename = ?", (filename,)
+            ).fetchone()
+        return {"etag": row[0], "size": row[1]} if row else None
+    
+    def delete_file_meta(self, filename: str):
+        """文件删除后移除元数据"""
+        with self._lock:
+            self.conn.execute("DELETE FROM file_meta WHERE filename = ?", (filename,))
+    
+    def load_all(self) -> Dict[str, Dict]:
+        """
+        启动时恢复所有任务（按创建时间排序）
+        
+        Returns:
+            任务ID到任务状态的字典
+        """
+        self._import_legacy_file()
+        tasks = {}
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT task_id, data FROM tasks ORDER BY created_at"
+            ).fetchall()
+        for task_id, data in rows:
+            try:
+                tasks[task_id] = json.loads(data)
+            except ValueError as e:
+                logger.warning(f"跳过无法解析的任务记录 {task_id}: {e}")
+        logger.info(f"已恢复 {len(tasks)} 个任务记录")
+        return tasks
+    
+    def _import_legacy_file(self):
+        """导入旧版 tasks.json，导入后重命名避免重复导入"""
+        if not self.legacy_file or not self.legacy_file.exists():
+            return
+        try:
+            with open(self.legacy_file, 'r', encoding='utf-8') as f:
+                legacy_tasks = json.load(f)
+            self.put_many(legacy_tasks.items())
+            logger.info(f"已从 {self.legacy_file.name} 导入 {len(legacy_tasks)} 个任务")
+            self.legacy_file.replace(self.legacy_file.with_name(self.legacy_file.name + ".migrated"))
+        except FileNotFoundError:
+            # 多工作进程同时启动时，文件可能已被其他进程导入并重命名（重复导入是幂等的）
+            pass
+        except Exception as e:
+            # 保留原文件，下次启动时重试
+            logger.warning(f"导入旧任务文件失败: {e}")
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self.conn.close()
+
+
+class TaskPersistenceWriter:
+    """后台任务持久化写入器：合并多次变更，定期在线程中批量写入"""
+    
+    def __init__(self, store: TaskStore, tasks: Dict[str, Dict], flush_interval: float = 0.5):
+        """
+        初始化写入器
+        
+        Args:
+            store: 任务存储
+            tasks: 内存中的任务字典（写入时读取最新状态）
+            flush_interval: 刷新间隔(秒)
+        """
+        self.store = store
+        self.tasks = tasks
+        self.flush_interval = flush_interval
+        self.dirty = set()
+        self.is_running = False
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = False
+        self.stats = {
+            'flushes': 0,
+            'written_tasks': 0,
+            'last_batch_size': 0,
+            'max_batch_size': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+            'errors': 0,
+        }
+    
+    def mark_dirty(self, task_id: str):
+        """标记任务需要持久化（同一任务的多次变更只写一次）"""
+        self.dirty.add(task_id)
+    
+    def request_flush(self):
+        """
+        请求尽快写入，不等待刷新间隔（在事件循环线程中调用）
+        
+        写入在线程中执行，不阻塞事件循环；已有待执行的写入请求时合并
+        """
+        if self._flush_requested:
+            return
+        self._flush_requested = True
+        asyncio.get_running_loop().create_task(self._flush_requested_batch())
+    
+    async def _flush_requested_batch(self):
+        self._flush_requested = False
+        await self.flush()
+    
+    async def start(self):
+        """启动定期刷新循环"""
+        self.is_running = True
+        while self.is_running:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+    
+    async def stop(self):
+        """停止刷新循环并写入剩余变更"""
+        self.is_running = False
+        await self.flush()
+    
+    async def flush(self):
+        """把当前所有脏任务作为一批写入存储"""
+        async with self._flush_lock:
+            if not self.dirty:
+                return
+            # 在事件循环线程中取快照，之后的变更进入下一批
+            batch = {}
+            for task_id in self.dirty:
+                task = self.tasks.get(task_id)
+                batch[task_id] = dict(task) if task is not None else None
+            self.dirty = set()
+            
+            start = time.monotonic()
+            try:
+                await asyncio.to_thread(self.store.apply_batch, batch)
+            except Exception as e:
+                # 写入失败时放回脏集合，下次重试
+                self.stats['errors'] += 1
+                self.dirty.update(batch)
+                logger.error(f"批量保存任务状态失败: {e}")
+                return
+            
+            elapsed_ms = (time.monotonic() - start) * 1000
+            self.stats['flushes'] += 1
+            self.stats['written_tasks'] += len(batch)
+            self.stats['last_batch_size'] = len(batch)
+            self.stats['max_batch_size'] = max(self.stats['max_batch_size'], len(batch))
+            self.stats['last_flush_ms'] = round(elapsed_ms, 2)
+            self.stats['max_flush_ms'] = round(max(self.stats['max_flush_ms'], elapsed_ms), 2)
+            self.stats['total_flush_ms'] += elapsed_ms
+    
+    def get_stats(self) -> Dict:
+        """获取写入统计信息"""
+        flushes = self.stats['flushes']
+        return {
+            'flush_interval': self.flush_interval,
+            'pending': len(self.dirty),
+            'flushes': flushes,
+            'written_tasks': self.stats['written_tasks'],
+            'last_batch_size': self.stats['last_batch_size'],
+            'max_batch_size': self.stats['max_batch_size'],
+            'avg_batch_size': round(self.stats['written_tasks'] / flushes, 2) if flushes else 0,
+            'last_flush_ms': self.stats['last_flush_ms'],
+            'max_flush_ms': self.stats['max_flush_ms'],
+            'avg_flush_ms': round(self.stats['total_flush_ms'] / flushes, 2) if flushes else 0,
+            'errors': self.stats['errors'],
+        }
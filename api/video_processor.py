@@ -1,21 +1,160 @@
 import os
+import copy
 import yt_dlp
 import logging
 import requests
 import re
 import os
+import time
+import subprocess
+import threading
 from pathlib import Path
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, List, Tuple, Callable
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+from yt_dlp.postprocessor import PostProcessor
+
+from .fragment_controller import fragment_controller, FragmentDownloadMonitor
+from .format_selector import FormatSelector, PLATFORM_FORMAT_PROFILES, DEFAULT_MAX_BYTES
+from .download_errors import (
+    DownloadFailure, make_failure_record, backoff_delay, OVER_BUDGET, NO_OUTPUT, REFRESH_CATEGORIES
+)
 
 logger = logging.getLogger(__name__)
 
+# 需要跟随跳转才能确定目标视频的短链接域名
+SHORT_LINK_HOSTS = ('b23.tv', 'xhslink.com', 'vm.tiktok.com', 'vt.tiktok.com')
+
+# 分享和统计用的查询参数，不影响视频内容，规范化时去掉
+TRACKING_PARAMS = {
+    'spm_id_from', 'from_spm_id', 'vd_source', 'share_source', 'share_medium',
+    'share_plat', 'share_session_id', 'share_tag', 'share_from', 'unique_k',
+    'bbid', 'si', 'feature', 'pp', 'fbclid', 'gclid', 'igshid',
+    'is_from_webapp', 'sender_device', 'xsec_source',
+}
+
+# 音频输出容器 -> 可以直接流复制（不转码）的源音频编码
+AUDIO_COPY_CODECS = {
+    'm4a': {'aac', 'alac'},
+    'ogg': {'opus', 'vorbis'},
+    'webm': {'opus', 'vorbis'},
+    'mp3': {'mp3'},
+}
+
+# 需要转码时各容器使用的音频编码器
+AUDIO_ENCODERS = {'m4a': 'aac', 'ogg': 'libopus', 'webm': 'libopus', 'mp3': 'mp3'}
+
+# auto 模式下按源音频编码选择的输出容器，其他编码（FLAC、AC-3等）原样流复制到 Matroska 音频(mka)
+AUTO_AUDIO_CONTAINERS = {'aac': 'm4a', 'alac': 'm4a', 'opus': 'ogg', 'vorbis': 'ogg', 'mp3': 'mp3'}
+AUTO_FALLBACK_CONTAINER = 'mka'
+
+# 可选的音频输出格式
+AUDIO_FORMATS = ('auto', *AUDIO_COPY_CODECS)
+
+# 选择源音频格式时优先的编码（yt-dlp acodec 前缀），下载后可直接流复制为目标格式
+AUDIO_CODEC_PREFIXES = {
+    'auto': ('mp4a', 'aac', 'opus', 'vorbis', 'mp3'),
+    'm4a': ('mp4a', 'aac'),
+    'ogg': ('opus', 'vorbis'),
+    'webm': ('opus', 'vorbis'),
+    'mp3': ('mp3',),
+}
+
+# 转码时的默认码率(kbps)
+DEFAULT_AUDIO_BITRATE = 192
+
+def plan_audio_output(codec: Optional[str], audio_format: str = 'auto',
+                      audio_bitrate: Optional[int] = None) -> Tuple[str, list]:
+    """
+    根据源音频编码和请求的格式、码率决定输出容器和ffmpeg编码参数
+    
+    源编码能直接放入目标容器且没有指定码率时流复制，否则转码；
+    auto 模式下只有指定码率才转码（其他编码转码为 m4a/AAC），不转码时任何编码都流复制
+    
+    Returns:
+        (输出容器, ffmpeg音频编码参数)
+    """
+    container = audio_format
+    if container == 'auto':
+        if codec not in AUTO_AUDIO_CONTAINERS:
+            if audio_bitrate is None:
+                return AUTO_FALLBACK_CONTAINER, ['-c:a', 'copy']
+            container = 'm4a'
+        else:
+            container = AUTO_AUDIO_CONTAINERS[codec]
+    if codec in AUDIO_COPY_CODECS[container] and audio_bitrate is None:
+        return container, ['-c:a', 'copy']
+    
+    bitrate = audio_bitrate or DEFAULT_AUDIO_BITRATE
+    args = ['-c:a', AUDIO_ENCODERS[container], '-b:a', f'{bitrate}k']
+    if container == 'mp3':
+        args += ['-ar', '44100']
+    return container, args
+
+class _FormatPlanRecorder(PostProcessor):
+    """下载开始前取得yt-dlp选中的格式（分离流为视频+音频），用于计算整个下载阶段的总字节数"""
+    
+    def __init__(self, on_plan: Callable[[List[Dict]], None]):
+        super().__init__()
+        self._on_plan = on_plan
+    
+    def run(self, info):
+        self._on_plan(info.get('requested_formats') or [info])
+        return [], info
+
 class VideoProcessor:
     """视频处理器，使用yt-dlp下载视频和提取音频"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        single_fetch: bool = True,
+        progress_callback: Optional[Callable[[Dict], None]] = None,
+        progress_interval: float = 0.5,
+        retry_attempts: int = 2,
+        retry_base_delay: float = 2.0,
+        retry_max_delay: float = 30.0
+    ):
         """
         初始化视频处理器
+        
+        Args:
+            single_fetch: 同时需要视频和音频时只从源站拉取一次，音频从本地视频文件中提取
+            progress_callback: 进度回调，参数为包含 stage 等字段的字典（可能在工作线程中调用）
+            progress_interval: 字节进度的最小上报间隔（秒），阶段切换和完成事件不受限制
+            retry_attempts: 临时错误（网络、限流、源站5xx）时同一下载最多重试的次数
+            retry_base_delay: 重试退避的基础等待时间（秒），按次数指数增长并随机抖动
+            retry_max_delay: 重试退避的最大等待时间（秒）
         """
+        self.single_fetch = single_fetch
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+        self._last_progress_at = 0.0
+        # 当前阶段已完成文件的字节数（视频+音频分开下载再合并时，一个阶段会有多个文件）
+        self._stage_bytes_done = 0
+        # 当前阶段要下载的文件数和预估总字节数，下载开始前由 _FormatPlanRecorder 记录
+        self._stage_plan = {'files': 1, 'total': None, 'finished': 0}
+        
+        # 下载失败的重试策略和本任务内各次失败的分类记录
+        self.retry_attempts = retry_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.download_failures: List[Dict] = []
+        
+        # 音频输出格式和转码码率（由 download_video_and_audio 按请求设置）
+        self.audio_format = 'auto'
+        self.audio_bitrate: Optional[int] = None
+        
+        # 格式选择的大小(字节)/码率(kbps)预算，以及各类下载选中的格式
+        self.max_bytes: Optional[int] = None
+        self.max_bitrate: Optional[float] = None
+        self.format_choices: Dict[str, Dict] = {}
+        
+        # 下载统计：源站拉取次数与实际下载字节数
+        self.download_stats = {'fetches': 0, 'bytes_downloaded': 0}
+        
+        # 本任务内的提取结果缓存（URL -> yt-dlp info dict），下载阶段直接复用
+        self._info_cache: Dict[str, dict] = {}
+        
         # 基础配置
         self.base_opts = {
             'quiet': True,
@@ -68,21 +207,17 @@ class VideoProcessor:
                 'best'                      # 最后兜底选项
             ),
             'outtmpl': '%(title)s.%(ext)s',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
+            # 下载后由 _extract_audio_from_video 按源编码流复制或转码
         }
     
     def _get_platform_from_url(self, url: str) -> str:
         """从URL识别平台"""
-        if 'bilibili.com' in url:
+        if 'bilibili.com' in url or 'b23.tv' in url:
             return 'bilibili'
         elif 'douyin.com' in url or 'v.douyin.com' in url:
             # 抖音暂时不支持，返回unsupported以便给出明确提示
             return 'unsupported_douyin'
-        elif 'xiaohongshu.com' in url:
+        elif 'xiaohongshu.com' in url or 'xhslink.com' in url:
             return 'xiaohongshu'
         elif 'youtube.com' in url or 'youtu.be' in url:
             return 'youtube'
@@ -91,7 +226,94 @@ class VideoProcessor:
         else:
             return 'generic'
     
+    def is_short_url(self, url: str) -> bool:
+        """判断是否为需要跟随跳转的短链接"""
+        if '://' not in url:
+            url = 'https://' + url
+        host = (urlsplit(url).hostname or '').lower()
+        return any(host == h or host.endswith('.' + h) for h in SHORT_LINK_HOSTS)
+    
+    def resolve_short_url(self, url: str, timeout: float = 10) -> str:
+        """
+        跟随短链接跳转得到真实地址（阻塞网络请求，需在线程中调用）
+        
+        Args:
+            url: 短链接
+            timeout: 请求超时时间(秒)
+            
+        Returns:
+            跳转后的地址，失败时返回原地址
+        """
+        try:
+            response = requests.head(url, allow_redirects=True, timeout=timeout)
+            return response.url or url
+        except Exception as e:
+            logger.warning(f"短链接解析失败 {url}: {e}")
+            return url
     
+    def get_canonical_url(self, url: str) -> str:
+        """
+        生成URL的规范化键，同一视频的不同写法得到相同的键
+        
+        例如 youtu.be/ID、youtube.com/watch?v=ID 和 youtube.com/shorts/ID
+        都规范为 youtube:ID；B站链接规范为 bilibili:BV号（多P视频带分P参数）。
+        短链接需先用 resolve_short_url 解析。
+        
+        Args:
+            url: 视频链接
+            
+        Returns:
+            规范化键
+        """
+        url = url.strip()
+        if '://' not in url:
+            url = 'https://' + url
+        parts = urlsplit(url)
+        host = (parts.hostname or '').lower()
+        if host.startswith('www.') or host.startswith('m.'):
+            host = host.split('.', 1)[1]
+        path = parts.path.rstrip('/')
+        query = dict(parse_qsl(parts.query))
+        platform = self._get_platform_from_url(host)
+        
+        if platform == 'youtube':
+            video_id = None
+            if host == 'youtu.be':
+                video_id = path.lstrip('/').split('/')[0]
+            elif query.get('v'):
+                video_id = query['v']
+            else:
+                match = re.match(r'^/(?:shorts|embed|live|v)/([\w-]+)', path)
+                if match:
+                    video_id = match.group(1)
+            if video_id:
+                return f"youtube:{video_id}"
+        
+        elif platform == 'bilibili':
+            match = re.search(r'(BV[0-9A-Za-z]{10}|av\d+)', path)
+            if match:
+                page = query.get('p', '1')
+                return f"bilibili:{match.group(1)}" + (f"?p={page}" if page != '1' else '')
+        
+        elif platform == 'tiktok':
+            match = re.search(r'/video/(\d+)', path)
+            if match:
+                return f"tiktok:{match.group(1)}"
+        
+        elif platform == 'xiaohongshu':
+            match = re.search(r'/(?:explore|discovery/item)/([0-9a-f]+)', path)
+            if match:
+                return f"xiaohongshu:{match.group(1)}"
+        
+        # 通用规则：去掉统计参数，参数排序后拼接
+        kept = sorted(
+            (k, v) for k, v in parse_qsl(parts.query)
+            if k not in TRACKING_PARAMS and not k.startswith('utm_')
+        )
+        key = f"{platform}:{host}{path}"
+        if kept:
+            key += '?' + urlencode(kept)
+        return key
     
     def _get_bilibili_strategy(self):
         """B站平台的格式选择策略"""
@@ -133,6 +355,15 @@ class VideoProcessor:
         else:
             logger.info("使用通用策略")
         
+        # HLS/DASH 分片并发数由控制器按平台实测吞吐自适应调整
+        opts['concurrent_fragment_downloads'] = fragment_controller.get(
+            platform if platform in self.platform_strategies else 'generic'
+        )
+        # 分片被限流时指数退避后重试，而不是立即连续重试耗尽次数；
+        # 重试仍失败时整个下载失败（降低并发后重下），不输出缺分片的损坏文件
+        opts['retry_sleep_functions'] = {'fragment': lambda n: min(0.5 * 2 ** n, 10)}
+        opts['skip_unavailable_fragments'] = False
+        
         return opts
     
     async def download_video_and_audio(
@@ -140,144 +371,65 @@ class VideoProcessor:
         url: str, 
         output_dir: Path, 
         extract_audio: bool = True, 
-        keep_video: bool = True
+        keep_video: bool = True,
+        info: Optional[dict] = None,
+        unique_id: Optional[str] = None,
+        audio_format: str = 'auto',
+        audio_bitrate: Optional[int] = None,
+        max_filesize_mb: Optional[float] = None,
+        max_bitrate_kbps: Optional[float] = None
     ) -> Dict[str, Optional[str]]:
         """
         下载视频和/或提取音频
         
+        依次执行拉取阶段（fetch_media）和音频提取阶段（extract_audio）；
+        API服务按阶段分别调用，使各阶段使用独立的并发上限
+        
         Args:
             url: 视频链接
             output_dir: 输出目录
             extract_audio: 是否提取音频
             keep_video: 是否保留视频文件
+            info: 已提取的视频信息（extract_info 的结果），提供时不再重复提取
+            unique_id: 文件名前缀，相同前缀的重复调用会从上次未完成的 .part 文件继续下载
+            audio_format: 音频输出格式（auto/m4a/ogg/webm/mp3），auto 按源编码选择可直接流复制的容器
+            audio_bitrate: 转码码率(kbps)，指定时总是转码；不指定时能流复制就不转码
+            max_filesize_mb: 下载大小预算(MB)，选择格式时排除超出预算的格式
+            max_bitrate_kbps: 下载码率预算(kbps)
             
         Returns:
             包含文件路径的字典 {'video': path, 'audio': path}
         """
         try:
-            # 边界情况检查
-            if not extract_audio and not keep_video:
-                raise ValueError("必须至少选择提取音频或保留视频中的一项")
-            
-            # 创建输出目录
-            output_dir.mkdir(exist_ok=True)
-            
-            # 生成唯一的文件名前缀
-            import uuid
-            unique_id = str(uuid.uuid4())[:8]
+            fetched = await self.fetch_media(
+                url, output_dir, extract_audio, keep_video, info, unique_id,
+                audio_format, max_filesize_mb, max_bitrate_kbps
+            )
             
             result_files = {}
+            if keep_video and fetched['video']:
+                result_files['video'] = fetched['video']
             
-            logger.info(f"开始处理视频: {url}")
-            logger.info(f"处理选项: extract_audio={extract_audio}, keep_video={keep_video}")
-            
-            import asyncio
-            
-            # 智能处理策略：如果同时需要视频和音频，优化处理方式
-            if keep_video and extract_audio:
-                # 策略1: 同时下载视频和音频（并行处理）
-                logger.info("同时下载视频和音频...")
-                video_task = self._download_video_only(url, output_dir, unique_id)
-                audio_task = self._download_audio_only(url, output_dir, unique_id)
-                
-                video_result, audio_result = await asyncio.gather(
-                    video_task, audio_task, return_exceptions=True
+            if extract_audio and fetched['audio_source']:
+                audio_file = await self.extract_audio(
+                    fetched['audio_source'], output_dir, fetched['unique_id'],
+                    audio_format, audio_bitrate, fetched['audio_codec'], fetched['discard_source']
                 )
-                
-                if not isinstance(video_result, Exception) and video_result:
-                    result_files['video'] = video_result
-                    logger.info(f"视频文件已保存: {video_result}")
-                
-                if not isinstance(audio_result, Exception) and audio_result:
-                    result_files['audio'] = audio_result
-                    logger.info(f"音频文件已保存: {audio_result}")
-                
-                # 完整的双向回退机制
-                # 情况1: 音频失败但视频成功 -> 从视频提取音频
-                if 'audio' not in result_files and 'video' in result_files:
-                    logger.info("音频下载失败，正在从视频文件提取音频...")
-                    audio_from_video = await self._extract_audio_from_video(
-                        result_files['video'], output_dir, unique_id
+                if audio_file is None and fetched['audio_from_video'] and not fetched['raw_audio_tried']:
+                    # 本地提取失败（视频无音轨或缺少FFmpeg），回退到单独下载音频
+                    logger.warning("从视频提取音频失败，回退到单独下载音频...")
+                    raw = await self.fetch_audio_source(
+                        url, output_dir, fetched['unique_id'], None,
+                        audio_format, max_filesize_mb, max_bitrate_kbps
                     )
-                    if audio_from_video:
-                        result_files['audio'] = audio_from_video
-                        logger.info(f"从视频提取音频成功: {audio_from_video}")
-                
-                # 情况2: 视频失败但音频成功 -> 尝试重新下载视频或提供部分结果
-                elif 'video' not in result_files and 'audio' in result_files:
-                    logger.warning("视频下载失败但音频下载成功，尝试重新下载视频...")
-                    # 重试视频下载一次
-                    retry_video = await self._download_video_only(url, output_dir, unique_id + "_retry")
-                    if retry_video:
-                        result_files['video'] = retry_video
-                        logger.info(f"重试视频下载成功: {retry_video}")
-                    else:
-                        logger.warning("视频重试下载也失败，将只返回音频文件")
-                
-                # 情况3: 两者都失败 -> 尝试下载视频然后提取音频
-                elif 'video' not in result_files and 'audio' not in result_files:
-                    logger.warning("视频和音频都下载失败，尝试应急方案...")
-                    emergency_video = await self._download_video_only(url, output_dir, unique_id + "_emergency")
-                    if emergency_video:
-                        result_files['video'] = emergency_video
-                        logger.info(f"应急视频下载成功: {emergency_video}")
-                        # 从应急视频提取音频
-                        emergency_audio = await self._extract_audio_from_video(
-                            emergency_video, output_dir, unique_id + "_emergency"
+                    if raw['audio_source']:
+                        audio_file = await self.extract_audio(
+                            raw['audio_source'], output_dir, fetched['unique_id'],
+                            audio_format, audio_bitrate, raw['audio_codec'], True
                         )
-                        if emergency_audio:
-                            result_files['audio'] = emergency_audio
-                            logger.info(f"从应急视频提取音频成功: {emergency_audio}")
-                    else:
-                        logger.error("所有下载尝试都失败了")
-            
-            elif keep_video:
-                # 只下载视频 - 带重试机制
-                logger.info("下载视频文件...")
-                video_file = await self._download_video_only(url, output_dir, unique_id)
-                if video_file:
-                    result_files['video'] = video_file
-                    logger.info(f"视频文件已保存: {video_file}")
-                else:
-                    # 视频下载失败，尝试重试一次
-                    logger.warning("视频下载失败，尝试重新下载...")
-                    retry_video = await self._download_video_only(url, output_dir, unique_id + "_retry")
-                    if retry_video:
-                        result_files['video'] = retry_video
-                        logger.info(f"重试视频下载成功: {retry_video}")
-                    else:
-                        logger.error("视频下载和重试都失败了")
-                        raise Exception("无法下载视频文件，请检查链接是否有效或稍后重试")
-            
-            elif extract_audio:
-                # 只提取音频 - 智能回退机制
-                logger.info("提取音频文件...")
-                audio_file = await self._download_audio_only(url, output_dir, unique_id)
                 if audio_file:
                     result_files['audio'] = audio_file
                     logger.info(f"音频文件已保存: {audio_file}")
-                else:
-                    # 直接音频提取失败，尝试下载视频然后提取音频
-                    logger.info("直接音频提取失败，正在下载视频并从中提取音频...")
-                    video_file = await self._download_video_only(url, output_dir, unique_id)
-                    if video_file:
-                        logger.info(f"视频下载成功: {video_file}")
-                        audio_from_video = await self._extract_audio_from_video(
-                            video_file, output_dir, unique_id
-                        )
-                        if audio_from_video:
-                            result_files['audio'] = audio_from_video
-                            logger.info(f"从视频提取音频成功: {audio_from_video}")
-                            # 删除临时视频文件（用户只要音频）
-                            try:
-                                os.unlink(video_file)
-                                logger.info(f"已删除临时视频文件: {video_file}")
-                            except Exception as e:
-                                logger.warning(f"删除临时视频文件失败: {e}")
-                        else:
-                            logger.error("从视频提取音频也失败了")
-                    else:
-                        logger.error("视频下载失败，无法提取音频")
             
             if not result_files:
                 raise Exception("没有成功下载任何文件")
@@ -288,19 +440,444 @@ class VideoProcessor:
             logger.error(f"处理视频失败: {str(e)}")
             raise Exception(f"处理视频失败: {str(e)}")
     
+    async def fetch_media(
+        self,
+        url: str,
+        output_dir: Path,
+        extract_audio: bool = True,
+        keep_video: bool = True,
+        info: Optional[dict] = None,
+        unique_id: Optional[str] = None,
+        audio_format: str = 'auto',
+        max_filesize_mb: Optional[float] = None,
+        max_bitrate_kbps: Optional[float] = None
+    ) -> Dict:
+        """
+        拉取阶段：从源站下载需要的媒体文件，分离的音视频流由yt-dlp下载后直接合并（流复制）
+        
+        只占用网络，音频提取留给 extract_audio 阶段
+        
+        Args:
+            url: 视频链接
+            output_dir: 输出目录
+            extract_audio: 是否需要音频
+            keep_video: 是否保留视频文件
+            info: 已提取的视频信息，提供时不再重复提取
+            unique_id: 文件名前缀，相同前缀的重复调用会从上次未完成的 .part 文件继续下载
+            audio_format: 音频输出格式，选择源音频时优先可直接流复制为该格式的编码
+            max_filesize_mb: 下载大小预算(MB)
+            max_bitrate_kbps: 下载码率预算(kbps)
+            
+        Returns:
+            {
+                'unique_id': 文件名前缀,
+                'video': 需要保留的视频文件,
+                'audio_source': 提取音频用的源文件（原始音频流或视频文件）,
+                'audio_codec': 源文件的音频编码,
+                'audio_from_video': 音频源是否为视频文件,
+                'raw_audio_tried': 是否已尝试单独下载音频流,
+                'discard_source': 提取音频后是否删除源文件,
+                'format_choices': 各类下载选中的格式和原因
+            }
+            
+        Raises:
+            FormatBudgetError: 所有体积已知的格式都超出预算
+        """
+        import asyncio
+        
+        # 边界情况检查
+        if not extract_audio and not keep_video:
+            raise ValueError("必须至少选择提取音频或保留视频中的一项")
+        
+        # 创建输出目录
+        output_dir.mkdir(exist_ok=True)
+        
+        if info is not None:
+            self._info_cache[url] = info
+        self._set_format_budget(audio_format, max_filesize_mb, max_bitrate_kbps)
+        self.format_choices = {}
+        
+        # 有预算时先确认有满足预算的格式，避免下载到一半才被大小限制中止
+        if (self.max_bytes or self.max_bitrate) and self._info_cache.get(url):
+            selector = self._format_selector(url)
+            if keep_video:
+                selector.select_video(self._info_cache[url])
+            else:
+                selector.select_audio(self._info_cache[url], AUDIO_CODEC_PREFIXES[audio_format])
+        
+        # 生成唯一的文件名前缀（调用方提供固定前缀时可续传）
+        if unique_id is None:
+            import uuid
+            unique_id = str(uuid.uuid4())[:8]
+        
+        logger.info(f"开始处理视频: {url}")
+        logger.info(f"处理选项: extract_audio={extract_audio}, keep_video={keep_video}")
+        
+        video_file = None
+        audio_source = None
+        audio_from_video = False
+        raw_audio_tried = False
+        
+        # 智能处理策略：如果同时需要视频和音频，优化处理方式
+        if keep_video and extract_audio and self.single_fetch:
+            # 策略1: 单次拉取，只下载一次视频，音频在提取阶段从本地文件中提取
+            logger.info("单次拉取模式：下载视频后在本地提取音频...")
+            video_file = await self._download_video_with_retry(url, output_dir, unique_id)
+            if video_file:
+                logger.info(f"视频文件已保存: {video_file}")
+                audio_source, audio_from_video = video_file, True
+            else:
+                # 视频无法下载时至少尝试拿到音频（地区限制、内容不存在等错误不再尝试）
+                self._raise_if_fatal()
+                logger.warning("视频下载和重试都失败了，尝试只下载音频...")
+                raw_audio_tried = True
+                audio_source = await self._download_audio_only(url, output_dir, unique_id)
+        
+        elif keep_video and extract_audio:
+            # 策略2: 同时下载视频和音频（并行处理，会从源站拉取两次）
+            logger.info("同时下载视频和音频...")
+            raw_audio_tried = True
+            video_result, audio_result = await asyncio.gather(
+                self._download_video_only(url, output_dir, unique_id),
+                self._download_audio_only(url, output_dir, unique_id),
+                return_exceptions=True
+            )
+            if not isinstance(video_result, Exception) and video_result:
+                video_file = video_result
+                logger.info(f"视频文件已保存: {video_file}")
+            if not isinstance(audio_result, Exception) and audio_result:
+                audio_source = audio_result
+            
+            # 完整的双向回退机制
+            # 情况1: 音频失败但视频成功 -> 从视频提取音频
+            if not audio_source and video_file:
+                logger.info("音频下载失败，将从视频文件提取音频...")
+                audio_source, audio_from_video = video_file, True
+            
+            # 情况2: 视频失败但音频成功 -> 尝试重新下载视频或提供部分结果
+            elif not video_file and audio_source:
+                logger.warning("视频下载失败但音频下载成功，尝试重新下载视频...")
+                video_file = await self._retry_download(self._download_video_only, 'download_video',
+                                                        url, output_dir, unique_id)
+                if video_file:
+                    logger.info(f"重试视频下载成功: {video_file}")
+                else:
+                    logger.warning("视频重试下载也失败，将只返回音频文件")
+            
+            # 情况3: 两者都失败 -> 尝试下载视频然后提取音频
+            elif not video_file and not audio_source:
+                self._raise_if_fatal()
+                logger.warning("视频和音频都下载失败，尝试应急方案...")
+                video_file = await self._retry_download(self._download_video_only, 'download_video',
+                                                        url, output_dir, unique_id)
+                if video_file:
+                    logger.info(f"应急视频下载成功: {video_file}")
+                    audio_source, audio_from_video = video_file, True
+        
+        elif keep_video:
+            # 只下载视频 - 带重试机制
+            logger.info("下载视频文件...")
+            video_file = await self._download_video_with_retry(url, output_dir, unique_id)
+            if not video_file:
+                logger.error("视频下载和重试都失败了")
+                raise DownloadFailure(
+                    self._failure_message("无法下载视频文件", self._last_failure()),
+                    self.download_failures
+                )
+            logger.info(f"视频文件已保存: {video_file}")
+        
+        else:
+            # 只提取音频 - 直接下载音频流失败时下载视频并从中提取音频
+            logger.info("下载音频流...")
+            raw_audio_tried = True
+            audio_source = await self._download_audio_only(url, output_dir, unique_id)
+            if not audio_source:
+                self._raise_if_fatal()
+                logger.info("直接下载音频失败，正在下载视频并从中提取音频...")
+                audio_source = await self._download_video_only(url, output_dir, unique_id)
+                audio_from_video = audio_source is not None
+        
+        if not video_file and not audio_source:
+            logger.error("所有下载尝试都失败了")
+            raise DownloadFailure(
+                self._failure_message("没有成功下载任何文件", self._last_failure()),
+                self.download_failures
+            )
+        
+        audio_codec = None
+        if extract_audio and audio_source:
+            audio_codec = await asyncio.to_thread(self._probe_audio_codec, audio_source)
+        
+        return {
+            'unique_id': unique_id,
+            'video': video_file if keep_video else None,
+            'audio_source': audio_source if extract_audio else None,
+            'audio_codec': audio_codec,
+            'audio_from_video': audio_from_video,
+            'raw_audio_tried': raw_audio_tried,
+            # 原始音频流和只为提取音频下载的视频是中间文件，需要保留的视频不能删除
+            'discard_source': audio_source is not None and not (keep_video and audio_source == video_file),
+            'format_choices': self.format_choices,
+            'download_failures': self.download_failures
+        }
+    
+    async def fetch_audio_source(self, url: str, output_dir: Path, unique_id: str,
+                                 info: Optional[dict] = None, audio_format: str = 'auto',
+                                 max_filesize_mb: Optional[float] = None,
+                                 max_bitrate_kbps: Optional[float] = None) -> Dict:
+        """
+        拉取阶段（回退）：只下载原始音频流，用于从视频提取音频失败的情况
+        
+        Returns:
+            {'audio_source': 源音频文件, 'audio_codec': 音频编码, 'download_failures': 失败记录}
+        """
+        import asyncio
+        
+        if info is not None:
+            self._info_cache[url] = info
+        self._set_format_budget(audio_format, max_filesize_mb, max_bitrate_kbps)
+        audio_source = await self._download_audio_only(url, output_dir, unique_id)
+        if not audio_source:
+            audio_source = await self._retry_download(self._download_audio_only, 'download_audio',
+                                                      url, output_dir, unique_id)
+        audio_codec = None
+        if audio_source:
+            audio_codec = await asyncio.to_thread(self._probe_audio_codec, audio_source)
+        return {'audio_source': audio_source, 'audio_codec': audio_codec,
+                'download_failures': self.download_failures}
+    
+    async def extract_audio(
+        self,
+        source: str,
+        output_dir: Path,
+        unique_id: str,
+        audio_format: str = 'auto',
+        audio_bitrate: Optional[int] = None,
+        codec: Optional[str] = None,
+        delete_source: bool = False
+    ) -> Optional[str]:
+        """
+        音频提取阶段：从拉取阶段得到的源文件中提取音频，只占用本地CPU和磁盘
+        
+        Args:
+            source: 源文件（原始音频流或视频文件）
+            output_dir: 输出目录
+            unique_id: 文件名前缀
+            audio_format: 音频输出格式
+            audio_bitrate: 转码码率(kbps)
+            codec: 拉取阶段探测到的源音频编码，未提供时重新探测
+            delete_source: 提取后删除源文件（中间文件）
+            
+        Returns:
+            音频文件路径，失败返回None
+        """
+        if audio_format not in AUDIO_FORMATS:
+            raise ValueError(f"不支持的音频格式: {audio_format}")
+        self.audio_format = audio_format
+        self.audio_bitrate = audio_bitrate
+        try:
+            return await self._extract_audio_from_video(source, output_dir, unique_id, codec)
+        finally:
+            if delete_source:
+                try:
+                    os.unlink(source)
+                    logger.info(f"已删除临时源文件: {source}")
+                except OSError as e:
+                    logger.warning(f"删除临时源文件失败: {e}")
+    
+    def _report_progress(self, stage: str, throttle: bool = False, **fields):
+        """
+        通过回调上报处理进度
+        
+        Args:
+            stage: 当前阶段
+            throttle: 为True时按 progress_interval 节流，丢弃过于频繁的更新
+        """
+        if self.progress_callback is None:
+            return
+        now = time.monotonic()
+        if throttle and now - self._last_progress_at < self.progress_interval:
+            return
+        self._last_progress_at = now
+        try:
+            self.progress_callback({'stage': stage, **fields})
+        except Exception as e:
+            logger.warning(f"进度回调失败: {e}")
+    
+    def _count_download_hook(self, d: dict):
+        """yt-dlp进度回调：统计每个完成文件的实际下载字节数"""
+        if d.get('status') == 'finished':
+            self.download_stats['fetches'] += 1
+            self.download_stats['bytes_downloaded'] += (
+                d.get('downloaded_bytes') or d.get('total_bytes') or 0
+            )
+    
+    def _make_progress_hooks(self, stage: str) -> Tuple[Callable[[dict], None], Callable[[dict], None]]:
+        """
+        生成某个下载阶段的 yt-dlp progress_hook 和 postprocessor_hook
+        
+        字节数按阶段累计：分开下载的视频流和音频流依次计入同一阶段，
+        分离流的总字节数按选中各格式的 filesize / filesize_approx 合计，整个阶段的进度连续增长
+        """
+        self._stage_bytes_done = 0
+        self._stage_plan = planned = {'files': 1, 'total': None, 'finished': 0}
+        
+        def progress_hook(d: dict):
+            self._count_download_hook(d)
+            status = d.get('status')
+            downloaded = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            if status == 'downloading':
+                stage_total = self._stage_bytes_done + total if total else None
+                if planned['total']:
+                    # 预估值可能偏小，不低于已知的字节数
+                    stage_total = max(planned['total'], stage_total or 0, self._stage_bytes_done + downloaded)
+                self._report_progress(
+                    stage,
+                    throttle=True,
+                    downloaded_bytes=self._stage_bytes_done + downloaded,
+                    total_bytes=stage_total,
+                    speed=d.get('speed'),
+                    eta=d.get('eta')
+                )
+            elif status == 'finished':
+                self._stage_bytes_done += downloaded or total or 0
+                planned['finished'] += 1
+                stage_total = self._stage_bytes_done
+                if planned['total'] and planned['finished'] < planned['files']:
+                    stage_total = max(planned['total'], self._stage_bytes_done)
+                self._report_progress(
+                    stage,
+                    downloaded_bytes=self._stage_bytes_done,
+                    total_bytes=stage_total,
+                    eta=0 if stage_total == self._stage_bytes_done else None
+                )
+        
+        def postprocessor_hook(d: dict):
+            if d.get('status') == 'started':
+                self._report_progress('postprocess', postprocessor=d.get('postprocessor'))
+        
+        return progress_hook, postprocessor_hook
+    
+    def _plan_stage_formats(self, formats: List[Dict]):
+        """记录本次下载选中的格式：分离流的文件数和按 filesize / filesize_approx 合计的预估总字节数"""
+        sizes = [fmt.get('filesize') or fmt.get('filesize_approx') for fmt in formats]
+        self._stage_plan['files'] = len(formats) or 1
+        self._stage_plan['total'] = int(sum(sizes)) if len(sizes) > 1 and all(sizes) else None
+    
+    @staticmethod
+    def _probe_duration(path: str) -> Optional[float]:
+        """用ffprobe读取媒体时长（秒），失败返回None"""
+        try:
+            result = subprocess.run(
+                ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                 '-of', 'default=noprint_wrappers=1:nokey=1', path],
+                capture_output=True, text=True, timeout=30
+            )
+            return float(result.stdout.strip())
+        except (OSError, ValueError, subprocess.SubprocessError):
+            return None
+    
+    def _run_ffmpeg_with_progress(self, cmd: list, stage: str, duration: Optional[float]):
+        """
+        执行ffmpeg并解析 -progress 输出上报进度
+        
+        ffmpeg 每个进度块以 progress=continue/end 结尾，块内包含 out_time_us、total_size、speed 等字段
+        """
+        cmd = cmd[:1] + ['-progress', 'pipe:1', '-nostats'] + cmd[1:]
+        process = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        # stderr 单独线程读取，避免缓冲区写满导致ffmpeg阻塞
+        stderr_chunks = []
+        stderr_reader = threading.Thread(
+            target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True
+        )
+        stderr_reader.start()
+        
+        block = {}
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key != 'progress':
+                block[key] = value
+                continue
+            try:
+                out_seconds = int(block.get('out_time_us') or 0) / 1_000_000
+            except ValueError:
+                out_seconds = 0
+            speed = block.get('speed', '').rstrip('x')
+            try:
+                speed = float(speed)
+            except ValueError:
+                speed = None
+            eta = None
+            if duration and speed:
+                eta = max(duration - out_seconds, 0) / speed
+            self._report_progress(
+                stage,
+                throttle=value != 'end',
+                processed_seconds=round(out_seconds, 2),
+                total_seconds=duration,
+                output_bytes=int(block['total_size']) if block.get('total_size', '').isdigit() else None,
+                speed=speed,
+                eta=round(eta, 1) if eta is not None else None
+            )
+            block = {}
+        
+        returncode = process.wait()
+        stderr_reader.join()
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, stderr=''.join(stderr_chunks))
+    
+    def _run_download(self, url: str, opts: dict):
+        """执行yt-dlp下载，已有提取结果时通过 process_ie_result 复用，不再重新请求页面"""
+        info = self._info_cache.get(url)
+        
+        # 统计分片下载的吞吐和限流错误，反馈给分片并发控制器
+        monitor = FragmentDownloadMonitor()
+        opts = {
+            **opts,
+            'logger': monitor,
+            'progress_hooks': list(opts.get('progress_hooks', [])) + [monitor.progress_hook],
+        }
+        platform = self._get_platform_from_url(url)
+        if platform not in self.platform_strategies:
+            platform = 'generic'
+        
+        try:
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                ydl.add_post_processor(_FormatPlanRecorder(self._plan_stage_formats), when='before_dl')
+                if info is not None:
+                    # process_ie_result 会修改传入的字典，重试路径还要再用，这里传副本
+                    ydl.process_ie_result(copy.deepcopy(info), download=True)
+                else:
+                    ydl.download([url])
+        finally:
+            if monitor.fragmented:
+                fragment_controller.record(
+                    platform,
+                    opts.get('concurrent_fragment_downloads') or 1,
+                    monitor.total_bytes,
+                    monitor.seconds or (time.monotonic() - monitor.started_at),
+                    monitor.throttled
+                )
+    
     async def _download_video_only(self, url: str, output_dir: Path, unique_id: str) -> Optional[str]:
         """只下载视频文件"""
         try:
             import asyncio
             
             logger.info(f"视频下载使用的URL: {url}")
+            self._report_progress('download_video')
             
             video_template = str(output_dir / f"video_{unique_id}.%(ext)s")
-            video_opts = self._get_optimized_opts(url, self.video_opts)
+            video_opts = self._apply_format_selection(url, self._get_optimized_opts(url, self.video_opts), 'video')
             video_opts['outtmpl'] = video_template
+            progress_hook, postprocessor_hook = self._make_progress_hooks('download_video')
+            video_opts['progress_hooks'] = [progress_hook]
+            video_opts['postprocessor_hooks'] = [postprocessor_hook]
             
-            with yt_dlp.YoutubeDL(video_opts) as ydl:
-                await asyncio.to_thread(ydl.download, [url])
+            await asyncio.to_thread(self._run_download, url, video_opts)
             
             # 查找下载的视频文件
             for ext in ['mp4', 'webm', 'mkv', 'avi', 'mov', 'flv']:
@@ -308,57 +885,228 @@ class VideoProcessor:
                 if potential_file.exists():
                     return str(potential_file)
             
+            self._record_failure('download_video', "下载结束但没有找到视频文件",
+                                 OVER_BUDGET if self.max_bytes else NO_OUTPUT)
             return None
         except Exception as e:
-            logger.error(f"下载视频失败: {e}")
+            self._record_failure('download_video', e)
             return None
     
+    def _set_format_budget(self, audio_format: str, max_filesize_mb: Optional[float],
+                           max_bitrate_kbps: Optional[float]):
+        """设置格式选择的预算和源音频的编码偏好"""
+        if audio_format not in AUDIO_FORMATS:
+            raise ValueError(f"不支持的音频格式: {audio_format}")
+        self.audio_format = audio_format
+        self.max_bytes = int(max_filesize_mb * 1024 * 1024) if max_filesize_mb else None
+        self.max_bitrate = max_bitrate_kbps
+    
+    def _format_selector(self, url: str) -> FormatSelector:
+        """按当前预算和平台的格式偏好创建格式选择器"""
+        platform = self._get_platform_from_url(url)
+        profile = PLATFORM_FORMAT_PROFILES.get(platform, PLATFORM_FORMAT_PROFILES['generic'])
+        return FormatSelector(
+            self.max_bytes,
+            self.max_bitrate,
+            profile['max_height'],
+            profile.get('min_height'),
+            profile.get('prefer_smallest', False),
+            DEFAULT_MAX_BYTES
+        )
+    
+    def _apply_format_selection(self, url: str, opts: dict, kind: str) -> dict:
+        """
+        按已提取的 formats 选择下载格式
+        
+        选中的格式放在平台策略的格式字符串前面，下载失败时yt-dlp回退到原有策略；
+        没有提取结果（formats）时保持原有策略不变
+        
+        Args:
+            url: 视频链接
+            opts: yt-dlp 配置
+            kind: video 或 audio
+        """
+        info = self._info_cache.get(url)
+        if not info or not info.get('formats'):
+            return opts
+        selector = self._format_selector(url)
+        try:
+            if kind == 'video':
+                choice = selector.select_video(info)
+            else:
+                choice = selector.select_audio(info, AUDIO_CODEC_PREFIXES[self.audio_format])
+        except ValueError as e:
+            logger.warning(f"格式选择失败，使用平台默认策略: {e}")
+            choice = None
+        if choice is not None:
+            self.format_choices[kind] = choice
+            opts['format'] = f"{choice['format']}/{opts['format']}"
+        if self.max_bytes:
+            # 体积未知的格式由yt-dlp按响应的Content-Length检查，超出预算时中止
+            opts['max_filesize'] = self.max_bytes
+        return opts
+    
+    async def _download_video_with_retry(self, url: str, output_dir: Path, unique_id: str) -> Optional[str]:
+        """下载视频文件，临时错误时退避重试"""
+        video_file = await self._download_video_only(url, output_dir, unique_id)
+        if not video_file:
+            video_file = await self._retry_download(self._download_video_only, 'download_video',
+                                                    url, output_dir, unique_id)
+        return video_file
+    
+    async def _retry_download(self, download: Callable, stage: str, url: str,
+                              output_dir: Path, unique_id: str) -> Optional[str]:
+        """
+        按上一次失败的分类决定是否重试：只有临时错误才重试，每次重试前按指数退避加随机抖动等待
+        
+        重试沿用同一个文件名前缀，从上次未完成的 .part 文件继续下载；
+        链接过期或被拒绝(403)时先重新提取信息，换用新签名的媒体链接
+        
+        Args:
+            download: _download_video_only 或 _download_audio_only
+            stage: 失败记录中的阶段名（download_video / download_audio）
+            
+        Returns:
+            下载的文件路径，不重试或重试都失败时返回None
+        """
+        import asyncio
+        
+        for attempt in range(self.retry_attempts):
+            failure = self._last_failure(stage)
+            if failure is None or not failure['retryable']:
+                if failure is not None:
+                    logger.info(f"下载失败原因为{failure['reason']}，不再重试")
+                return None
+            delay = backoff_delay(attempt, self.retry_base_delay, self.retry_max_delay)
+            logger.warning(f"下载失败（{failure['reason']}），{delay:.1f}秒后第{attempt + 1}次重试...")
+            await asyncio.sleep(delay)
+            if failure['category'] in REFRESH_CATEGORIES:
+                await self._refresh_info(url)
+            result = await download(url, output_dir, unique_id)
+            if result:
+                return result
+        return None
+    
+    async def _refresh_info(self, url: str):
+        """丢弃缓存的提取结果并重新提取，重新提取失败时由下载直接请求页面"""
+        import asyncio
+        
+        self._info_cache.pop(url, None)
+        try:
+            await asyncio.to_thread(self.extract_info, url)
+            logger.info("已重新提取视频信息，使用新的下载链接重试")
+        except Exception as e:
+            logger.warning(f"重新提取视频信息失败，重试时由下载直接请求页面: {e}")
+    
+    def _record_failure(self, stage: str, error, classification: Optional[Dict] = None) -> Dict:
+        """分类并记录一次下载失败"""
+        record = make_failure_record(stage, error, classification)
+        self.download_failures.append(record)
+        kind = "视频" if stage == 'download_video' else "音频"
+        retry_text = "可重试" if record['retryable'] else "不可重试"
+        logger.error(f"下载{kind}失败（{record['reason']}，{retry_text}）: {record['message']}")
+        return record
+    
+    def _last_failure(self, stage: Optional[str] = None) -> Optional[Dict]:
+        """最近一次（指定阶段的）失败记录"""
+        for record in reversed(self.download_failures):
+            if stage is None or record['stage'] == stage:
+                return record
+        return None
+    
+    def _raise_if_fatal(self):
+        """出现针对整个视频的错误（地区限制、内容不存在、需要登录等）时结束回退流程"""
+        for record in self.download_failures:
+            if record['fatal']:
+                raise DownloadFailure(
+                    self._failure_message("无法下载", record), self.download_failures
+                )
+    
+    @staticmethod
+    def _failure_message(prefix: str, failure: Optional[Dict]) -> str:
+        """带失败原因的错误信息"""
+        if failure is None:
+            return prefix
+        if failure['category'] == 'over_budget':
+            return f"{prefix}：文件超出大小预算，请放宽 max_filesize_mb"
+        hint = "请稍后重试" if failure['retryable'] else "重试无效"
+        return f"{prefix}：{failure['reason']}（{hint}）- {failure['message']}"
+    
     async def _download_audio_only(self, url: str, output_dir: Path, unique_id: str) -> Optional[str]:
-        """只提取音频文件（使用yt-dlp直接提取）"""
+        """只下载原始音频流（使用yt-dlp直接下载，格式转换在音频提取阶段进行）"""
         try:
             import asyncio
             
             logger.info(f"音频下载使用的URL: {url}")
+            self._report_progress('download_audio')
             
-            audio_template = str(output_dir / f"audio_{unique_id}.%(ext)s")
-            audio_opts = self._get_optimized_opts(url, self.audio_opts)
+            # 源音频下载为中间文件，提取阶段再按请求的格式流复制或转码
+            audio_template = str(output_dir / f"audio_{unique_id}_src.%(ext)s")
+            audio_opts = self._apply_format_selection(url, self._get_optimized_opts(url, self.audio_opts), 'audio')
             audio_opts['outtmpl'] = audio_template
+            progress_hook, postprocessor_hook = self._make_progress_hooks('download_audio')
+            audio_opts['progress_hooks'] = [progress_hook]
+            audio_opts['postprocessor_hooks'] = [postprocessor_hook]
             
-            with yt_dlp.YoutubeDL(audio_opts) as ydl:
-                await asyncio.to_thread(ydl.download, [url])
+            await asyncio.to_thread(self._run_download, url, audio_opts)
             
-            # 查找提取的音频文件
-            for ext in ['mp3', 'm4a', 'wav', 'aac', 'ogg']:
-                potential_file = output_dir / f"audio_{unique_id}.{ext}"
-                if potential_file.exists():
-                    return str(potential_file)
+            # 查找下载的源音频文件
+            sources = [
+                path for path in output_dir.glob(f"audio_{unique_id}_src.*")
+                if path.suffix not in ('.part', '.ytdl')
+            ]
+            if sources:
+                logger.info(f"音频流已下载: {sources[0]}")
+                return str(sources[0])
             
+            self._record_failure('download_audio', "下载结束但没有找到音频文件",
+                                 OVER_BUDGET if self.max_bytes else NO_OUTPUT)
             return None
         except Exception as e:
-            logger.error(f"提取音频失败: {e}")
+            self._record_failure('download_audio', e)
+            return None
+    
+    @staticmethod
+    def _probe_audio_codec(path: str) -> Optional[str]:
+        """用ffprobe读取第一条音轨的编码名称，没有音轨或失败返回None"""
+        try:
+            result = subprocess.run(
+                ['ffprobe', '-v', 'error', '-select_streams', 'a:0',
+                 '-show_entries', 'stream=codec_name',
+                 '-of', 'default=noprint_wrappers=1:nokey=1', path],
+                capture_output=True, text=True, timeout=30
+            )
+            return result.stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
             return None
     
-    async def _extract_audio_from_video(self, video_path: str, output_dir: Path, unique_id: str) -> Optional[str]:
-        """从视频文件中提取音频（使用FFmpeg）"""
+    async def _extract_audio_from_video(self, video_path: str, output_dir: Path, unique_id: str,
+                                        codec: Optional[str] = None) -> Optional[str]:
+        """从视频（或源音频）文件中提取音频，源编码与目标容器兼容时只流复制不转码（使用FFmpeg）"""
         try:
             import asyncio
-            import subprocess
             
-            audio_path = output_dir / f"audio_{unique_id}.mp3"
+            self._report_progress('extract_audio')
+            if codec is None:
+                codec = await asyncio.to_thread(self._probe_audio_codec, video_path)
+            container, codec_args = plan_audio_output(codec, self.audio_format, self.audio_bitrate)
+            audio_path = output_dir / f"audio_{unique_id}.{container}"
+            logger.info(
+                f"音频{'流复制' if codec_args[-1] == 'copy' else '转码'}: "
+                f"{codec or '未知编码'} -> {container}"
+            )
             
             # 使用FFmpeg从视频中提取音频
             cmd = [
                 'ffmpeg', '-i', video_path,
                 '-vn',  # 不处理视频流
-                '-acodec', 'mp3',  # 音频编码器
-                '-ab', '192k',  # 音频比特率
-                '-ar', '44100',  # 采样率
+                *codec_args,
                 '-y',  # 覆盖输出文件
                 str(audio_path)
             ]
             
-            await asyncio.to_thread(subprocess.run, cmd, 
-                                  capture_output=True, check=True)
+            duration = await asyncio.to_thread(self._probe_duration, video_path)
+            await asyncio.to_thread(self._run_ffmpeg_with_progress, cmd, 'extract_audio', duration)
             
             if audio_path.exists():
                 return str(audio_path)
@@ -400,6 +1148,47 @@ class VideoProcessor:
             logger.error(f"下载转换失败: {str(e)}")
             raise Exception(f"下载转换失败: {str(e)}")
     
+    def extract_info(self, url: str) -> dict:
+        """
+        提取视频的完整信息（yt-dlp info dict），同一任务内只请求一次
+        
+        Args:
+            url: 视频链接
+            
+        Returns:
+            可序列化的 yt-dlp 信息字典，可直接传给下载阶段复用
+        """
+        if url in self._info_cache:
+            return self._info_cache[url]
+        
+        logger.info(f"开始提取视频信息: {url}")
+        
+        # 获取优化后的选项，只用于信息提取
+        opts = self._get_optimized_opts(url, self.base_opts)
+        
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.sanitize_info(ydl.extract_info(url, download=False))
+        
+        self._info_cache[url] = info
+        return info
+    
+    def summarize_info(self, info: dict, url: str = '') -> dict:
+        """将 yt-dlp 信息字典整理为对外返回的视频信息"""
+        return {
+            'title': info.get('title', '未知标题'),
+            'duration': info.get('duration', 0),
+            'uploader': info.get('uploader', '未知作者'),
+            'view_count': info.get('view_count', 0),
+            'like_count': info.get('like_count', 0),
+            'description': info.get('description', ''),
+            'upload_date': info.get('upload_date', ''),
+            'thumbnail': info.get('thumbnail', ''),
+            'webpage_url': info.get('webpage_url', url),
+            'extractor': info.get('extractor', ''),
+            'id': info.get('id', ''),
+            'formats': len(info.get('formats', []))
+        }
+    
     def get_video_info(self, url: str) -> dict:
         """
         获取视频信息
@@ -412,29 +1201,102 @@ class VideoProcessor:
         """
         try:
             logger.info(f"开始获取视频信息: {url}")
-            
-            # 获取优化后的选项，只用于信息提取
-            opts = self._get_optimized_opts(url, self.base_opts)
-            
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                info = ydl.extract_info(url, download=False)
-                
-            return {
-                'title': info.get('title', '未知标题'),
-                'duration': info.get('duration', 0),
-                'uploader': info.get('uploader', '未知作者'),
-                'view_count': info.get('view_count', 0),
-                'like_count': info.get('like_count', 0),
-                'description': info.get('description', ''),
-                'upload_date': info.get('upload_date', ''),
-                'thumbnail': info.get('thumbnail', ''),
-                'webpage_url': info.get('webpage_url', url),
-                'extractor': info.get('extractor', ''),
-                'id': info.get('id', ''),
-                'formats': len(info.get('formats', []))
-            }
+            return self.summarize_info(self.extract_info(url), url)
             
         except Exception as e:
             error_msg = f"获取视频信息失败: {str(e)}"
             logger.error(error_msg)
             raise Exception(error_msg)
+    
+    def expand_playlist(self, url: str, max_items: Optional[int] = None) -> Tuple[Optional[str], list]:
+        """
+        平铺提取播放列表（只请求列表页，不逐个解析视频）
+        
+        Args:
+            url: 播放列表或单个视频链接
+            max_items: 最多返回的条目数
+            
+        Returns:
+            (播放列表标题, 条目链接列表)；不是播放列表时返回 (None, [url])
+        """
+        opts = self._get_optimized_opts(url, self.base_opts)
+        opts['noplaylist'] = False
+        opts['extract_flat'] = 'in_playlist'
+        if max_items:
+            opts['playlistend'] = max_items
+        
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+        
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            return None, [url]
+        
+        entry_urls = []
+        for entry in info.get('entries') or []:
+            if not entry:
+                continue
+            # 平铺条目(_type=url)的 url 是视频页；已完整解析的条目优先用视频页地址，
+            # 视频页就是列表页本身（如一个页面内嵌多个视频）时用媒体地址
+            if entry.get('_type') in ('url', 'url_transparent'):
+                entry_url = entry.get('url')
+            elif entry.get('webpage_url') and entry.get('webpage_url') != info.get('webpage_url'):
+                entry_url = entry['webpage_url']
+            else:
+                entry_url = entry.get('url')
+            if entry_url and entry_url not in entry_urls:
+                entry_urls.append(entry_url)
+        
+        logger.info(f"播放列表 {info.get('title')} 展开为 {len(entry_urls)} 个视频")
+        return info.get('title'), entry_urls[:max_items] if max_items else entry_urls
+    
+    @staticmethod
+    def select_stream_format(info: dict, kind: str = 'video') -> Optional[dict]:
+        """
+        选择可边下载边发送的单文件格式
+        
+        只考虑直接HTTP下载的格式（分片/HLS/DASH无法按字节顺序跟读）。
+        视频要求音视频合一的渐进式格式，音频要求纯音频格式。
+        
+        Args:
+            info: yt-dlp 信息字典
+            kind: video 或 audio
+            
+        Returns:
+            选中的格式字典，没有合适格式时返回None
+        """
+        candidates = []
+        for fmt in info.get('formats') or [info]:
+            if fmt.get('protocol', 'https') not in ('http', 'https'):
+                continue
+            vcodec, acodec = fmt.get('vcodec'), fmt.get('acodec')
+            has_video = vcodec not in (None, 'none') or (vcodec is None and kind == 'video')
+            has_audio = acodec not in (None, 'none') or (acodec is None and kind == 'video')
+            if kind == 'video' and has_video and has_audio:
+                candidates.append(((fmt.get('ext') == 'mp4'), fmt.get('height') or 0, fmt.get('tbr') or 0, fmt))
+            elif kind == 'audio' and has_audio and vcodec == 'none':
+                candidates.append(((fmt.get('ext') == 'm4a'), fmt.get('abr') or 0, fmt.get('tbr') or 0, fmt))
+        if not candidates:
+            return None
+        return max(candidates, key=lambda c: c[:3])[3]
+    
+    def download_format(self, url: str, format_id: str, path: Path,
+                        progress_hook: Optional[Callable[[dict], None]] = None):
+        """
+        用yt-dlp把指定格式直接写入目标文件（不使用 .part 临时文件，便于边写边读）
+        
+        Args:
+            url: 视频链接（需已调用过 extract_info，复用提取结果）
+            format_id: 格式ID
+            path: 目标文件路径
+            progress_hook: yt-dlp 进度回调
+        """
+        opts = self._get_optimized_opts(url, self.base_opts)
+        opts.pop('postprocessors', None)
+        opts.update({
+            'format': format_id,
+            'outtmpl': str(path),
+            'nopart': True,
+            'continuedl': False,
+            'progress_hooks': [self._count_download_hook] + ([progress_hook] if progress_hook else []),
+        })
+        self._run_download(url, opts)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+分片并发下载基准测试
+
+启动一个本地HLS分片服务器（每个连接限速、每个分片有固定延迟，并发过高时返回429），
+分别用固定单并发（原有行为）和自适应分片并发控制器下载同一个流，比较吞吐。
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from api.video_processor import VideoProcessor
+from api.fragment_controller import fragment_controller
+
+def make_handler(segment_count: int, segment_size: int, latency: float, bandwidth: int, max_connections: int):
+    """生成模拟分片源站的请求处理器"""
+    segment = os.urandom(segment_size)
+    playlist = "#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:2\n#EXT-X-MEDIA-SEQUENCE:0\n"
+    playlist += "".join(f"#EXTINF:2.0,\nseg{i}.ts\n" for i in range(segment_count))
+    playlist += "#EXT-X-ENDLIST\n"
+    active = {"count": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.endswith(".m3u8"):
+                body = playlist.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/vnd.apple.mpegurl")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            with lock:
+                if active["count"] >= max_connections:
+                    self.send_response(429)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                active["count"] += 1
+            try:
+                time.sleep(latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "video/mp2t")
+                self.send_header("Content-Length", str(len(segment)))
+                self.end_headers()
+                # 按单连接带宽限速发送
+                chunk = 16 * 1024
+                for offset in range(0, len(segment), chunk):
+                    time.sleep(chunk / bandwidth)
+                    self.wfile.write(segment[offset:offset + chunk])
+            finally:
+                with lock:
+                    active["count"] -= 1
+
+    return Handler
+
+def run_download(url: str, output_dir: Path, round_index: int):
+    """下载一次，返回耗时（秒），失败返回None"""
+    processor = VideoProcessor()
+    processor.extract_info(url)
+    start = time.monotonic()
+    result = asyncio.run(processor._download_video_only(url, output_dir, f"bench{round_index}"))
+    elapsed = time.monotonic() - start
+    if not result:
+        return None
+    Path(result).unlink()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="分片并发下载基准测试")
+    parser.add_argument("--segments", type=int, default=40, help="分片数量")
+    parser.add_argument("--segment-kb", type=int, default=256, help="每个分片大小(KB)")
+    parser.add_argument("--latency", type=float, default=0.05, help="每个分片的首字节延迟(秒)")
+    parser.add_argument("--bandwidth-kb", type=int, default=2048, help="单连接带宽(KB/s)")
+    parser.add_argument("--max-connections", type=int, default=8, help="源站允许的最大并发连接，超出返回429")
+    parser.add_argument("--rounds", type=int, default=10, help="自适应模式的下载轮数")
+    args = parser.parse_args()
+
+    handler = make_handler(
+        args.segments, args.segment_kb * 1024, args.latency,
+        args.bandwidth_kb * 1024, args.max_connections
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/stream.m3u8"
+    total_mb = args.segments * args.segment_kb / 1024
+    output_dir = Path(tempfile.mkdtemp(prefix="fragment_bench_"))
+
+    print("🧪 分片并发下载基准测试")
+    print(f"📋 {args.segments} 个分片，共 {total_mb:.1f} MB，单连接 {args.bandwidth_kb} KB/s，"
+          f"延迟 {args.latency * 1000:.0f} ms，源站并发上限 {args.max_connections}")
+    print("=" * 60)
+
+    try:
+        # 固定单并发（原有行为）
+        fragment_controller.limits["generic"] = {"initial": 1, "min": 1, "max": 1}
+        fragment_controller.current.clear()
+        elapsed = run_download(url, output_dir, 0)
+        if elapsed is None:
+            print("❌ 基准下载失败")
+            return
+        baseline = total_mb / elapsed
+        print(f"固定并发 1: {elapsed:.2f}s, {baseline:.2f} MB/s")
+        print("-" * 60)
+
+        # 自适应并发
+        fragment_controller.limits["generic"] = {"initial": 1, "min": 1, "max": 16}
+        fragment_controller.current.clear()
+        fragment_controller.last_sample.clear()
+        fragment_controller.ceiling.clear()
+        best = 0.0
+        for i in range(1, args.rounds + 1):
+            concurrency = fragment_controller.get("generic")
+            elapsed = run_download(url, output_dir, i)
+            stats = fragment_controller.get_stats().get("generic", {})
+            if elapsed is None:
+                print(f"自适应 第{i}轮 并发 {concurrency:2d}: 下载失败（累计限流 {stats.get('throttled', 0)} 次）")
+                continue
+            throughput = total_mb / elapsed
+            best = max(best, throughput)
+            print(f"自适应 第{i}轮 并发 {concurrency:2d}: {elapsed:.2f}s, {throughput:.2f} MB/s"
+                  f"（累计限流 {stats.get('throttled', 0)} 次）")
+        print("=" * 60)
+        print(f"📊 最佳吞吐 {best:.2f} MB/s，相对固定单并发提升 {best / baseline:.1f} 倍")
+    finally:
+        server.shutdown()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -113,6 +113,14 @@ def handle_port_conflict(port):
     
     return False
 
+def get_option_value(name, default=None):
+    """读取命令行选项的值，如 --pool-size 4"""
+    if name in sys.argv:
+        index = sys.argv.index(name)
+        if index + 1 < len(sys.argv):
+            return sys.argv[index + 1]
+    return default
+
 def main():
     """主函数"""
     print("🚀 视频下载API启动检查")
@@ -156,6 +164,20 @@ def main():
             "--port", str(port)
         ]
         
+        # 进程池模式：yt-dlp和ffmpeg任务在独立工作进程中执行，可利用多核
+        pool_size = get_option_value("--pool-size")
+        if pool_size:
+            os.environ["EXECUTION_BACKEND"] = "process"
+            os.environ["WORKER_PROCESSES"] = pool_size
+            print(f"⚙️  进程池模式 - {pool_size} 个工作进程")
+        
+        # 多工作进程模式：任务状态通过共享SQLite同步，热重载模式下不可用
+        workers = get_option_value("--workers")
+        if workers and int(workers) > 1 and "--dev" not in sys.argv:
+            cmd.extend(["--workers", workers])
+            os.environ["API_WORKERS"] = workers
+            print(f"⚙️  多工作进程模式 - {workers} 个API工作进程")
+
         # 开发模式启用热重载
         if "--dev" in sys.argv:
             cmd.append("--reload")
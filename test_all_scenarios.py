@@ -9,6 +9,7 @@ import time
 import argparse
 import os
 import tempfile
+import json
 
 def test_actual_download(download_url: str, file_type: str) -> bool:
     """测试实际的文件下载功能"""
@@ -62,6 +63,88 @@ def test_actual_download(download_url: str, file_type: str) -> bool:
         print(f"❌ {file_type}文件下载测试出错: {e}")
         return False
 
+def test_range_support(download_url: str, file_type: str) -> bool:
+    """测试断点续传相关功能：HEAD、Range/206、多段范围拒绝、ETag条件请求和If-Range"""
+    try:
+        print(f"🔄 开始测试{file_type}文件断点续传...")
+        
+        head = requests.head(download_url, timeout=30)
+        etag = head.headers.get("etag")
+        size = int(head.headers.get("content-length", 0))
+        if head.status_code != 200 or not etag or size <= 0:
+            print(f"❌ HEAD请求异常 (状态码: {head.status_code}, ETag: {etag})")
+            return False
+        print(f"📄 HEAD: {size} 字节, ETag: {etag}")
+        
+        # 取文件中间和末尾各一段，与完整下载的对应部分比较
+        middle = size // 2
+        full = requests.get(download_url, timeout=120).content
+        checks = [
+            (f"bytes={middle}-{middle + 1023}", full[middle:middle + 1024]),
+            ("bytes=-1024", full[-1024:]),
+        ]
+        for range_header, expected in checks:
+            response = requests.get(download_url, headers={"Range": range_header}, timeout=30)
+            if response.status_code != 206 or response.content != expected:
+                print(f"❌ Range {range_header} 失败 (状态码: {response.status_code})")
+                return False
+        print("✅ 单段Range返回206且内容正确")
+        
+        response = requests.get(download_url, headers={"Range": "bytes=0-9,20-29"}, timeout=30)
+        if response.status_code != 416:
+            print(f"❌ 多段Range应返回416，实际为 {response.status_code}")
+            return False
+        
+        response = requests.get(download_url, headers={"If-None-Match": etag}, timeout=30)
+        if response.status_code != 304:
+            print(f"❌ If-None-Match应返回304，实际为 {response.status_code}")
+            return False
+        
+        response = requests.get(
+            download_url, headers={"Range": "bytes=0-9", "If-Range": '"stale-etag"'}, timeout=120
+        )
+        if response.status_code != 200 or len(response.content) != size:
+            print(f"❌ If-Range不匹配时应返回完整文件，实际为 {response.status_code}")
+            return False
+        
+        print(f"✅ {file_type}文件断点续传测试成功")
+        return True
+        
+    except requests.exceptions.RequestException as e:
+        print(f"❌ {file_type}文件断点续传请求失败: {e}")
+        return False
+
+def iter_task_status(api_base_url: str, task_id: str, max_wait_time: int = 300):
+    """
+    依次产出任务状态，优先使用SSE推送，服务端不支持时回退到轮询
+    """
+    try:
+        with requests.get(
+            f"{api_base_url}/api/status/{task_id}/events",
+            stream=True,
+            timeout=(10, max_wait_time)
+        ) as response:
+            if response.status_code == 200:
+                for line in response.iter_lines(decode_unicode=True):
+                    if line and line.startswith("data:"):
+                        status_data = json.loads(line[5:])
+                        if status_data.get("task_id"):
+                            yield status_data
+                return
+    except requests.exceptions.RequestException as e:
+        print(f"⚠️  状态推送不可用，改为轮询: {e}")
+    
+    start_time = time.time()
+    status_url = f"{api_base_url}/api/status/{task_id}"
+    while time.time() - start_time <= max_wait_time:
+        status_response = requests.get(status_url, timeout=10)
+        status_response.raise_for_status()
+        status_data = status_response.json()
+        yield status_data
+        if status_data.get("status") in ("completed", "error"):
+            return
+        time.sleep(3)  # 每3秒检查一次
+
 def test_scenario(api_base_url: str, video_url: str, extract_audio: bool, keep_video: bool, scenario_name: str):
     """测试特定场景"""
     print(f"\n🧪 测试场景: {scenario_name}")
@@ -88,23 +171,12 @@ def test_scenario(api_base_url: str, video_url: str, extract_audio: bool, keep_v
         print(f"❌ 提交任务失败: {e}")
         return False
 
-    # 2. 轮询任务状态
+    # 2. 监控任务状态（SSE推送，不支持时轮询）
     print(f"🔄 监控任务状态...")
-    status_url = f"{api_base_url}/api/status/{task_id}"
-    
     max_wait_time = 300  # 最多等待5分钟
-    start_time = time.time()
     
-    while True:
-        try:
-            if time.time() - start_time > max_wait_time:
-                print("⏰ 任务超时")
-                return False
-                
-            status_response = requests.get(status_url, timeout=10)
-            status_response.raise_for_status()
-            status_data = status_response.json()
-            
+    try:
+        for status_data in iter_task_status(api_base_url, task_id, max_wait_time):
             status = status_data.get("status")
             progress = status_data.get("progress", 0)
             message = status_data.get("message", "无消息")
@@ -130,7 +202,7 @@ def test_scenario(api_base_url: str, video_url: str, extract_audio: bool, keep_v
                         download_url = f"{api_base_url}/api/download/{os.path.basename(video_file)}"
                         print(f"📥 视频下载链接: {download_url}")
                         # 测试实际下载
-                        if test_actual_download(download_url, "视频"):
+                        if test_actual_download(download_url, "视频") and test_range_support(download_url, "视频"):
                             print("✅ 视频文件下载测试成功")
                         else:
                             print("❌ 视频文件下载测试失败")
@@ -150,7 +222,7 @@ def test_scenario(api_base_url: str, video_url: str, extract_audio: bool, keep_v
                         download_url = f"{api_base_url}/api/download/{os.path.basename(audio_file)}"
                         print(f"📥 音频下载链接: {download_url}")
                         # 测试实际下载
-                        if test_actual_download(download_url, "音频"):
+                        if test_actual_download(download_url, "音频") and test_range_support(download_url, "音频"):
                             print("✅ 音频文件下载测试成功")
                         else:
                             print("❌ 音频文件下载测试失败")
@@ -169,15 +241,16 @@ def test_scenario(api_base_url: str, video_url: str, extract_audio: bool, keep_v
                 print(f"💥 任务失败！")
                 print(f"❌ 错误: {status_data.get('error')}")
                 return False
+        
+        print("⏰ 任务超时")
+        return False
             
-            time.sleep(3)  # 每3秒检查一次
-            
-        except requests.exceptions.RequestException as e:
-            print(f"❌ 查询状态失败: {e}")
-            return False
-        except Exception as e:
-            print(f"❌ 发生意外错误: {e}")
-            return False
+    except requests.exceptions.RequestException as e:
+        print(f"❌ 查询状态失败: {e}")
+        return False
+    except Exception as e:
+        print(f"❌ 发生意外错误: {e}")
+        return False
 
 def test_invalid_scenario(api_base_url: str, video_url: str):
     """测试无效场景（两个都为False）"""